@@ -24,13 +24,20 @@ def load(filename, ref_filename=None, config=None):
     Returns an abstraction view on the data from the given input file.
     @param filename: the source file.
     @param ref_filename: the file containing the reference data; if None, the reference data is assumed to be in the source file.
+    May also be a glob pattern or a list of files, whose records are concatenated.
     @return: a 'Data' object.
     """
     if config is not None:
         max_cache_size = config.max_cache_size
+        max_open_files = config.max_open_files
+        cache_policy = config.cache_policy
+        use_mmap = config.use_mmap
     else:
         max_cache_size = None
-    return Data(filename, ref_filename, max_cache_size)
+        max_open_files = None
+        cache_policy = None
+        use_mmap = False
+    return Data(filename, ref_filename, max_cache_size, max_open_files, cache_policy, use_mmap)
 
 
 def create_config(filename):
@@ -0,0 +1,265 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+from abc import ABC, abstractmethod
+import heapq
+from collections import OrderedDict
+
+POLICY_NAMES = ('lru', 'gdsf', 'largest')
+
+def create_cache_policy(policy=None):
+    """
+    Returns the cache policy of the given name.
+    @param policy: one of 'lru', 'gdsf' and 'largest', or a CachePolicy, which is returned as is; if None, 'lru'.
+    @return: an object of type 'CachePolicy'.
+    """
+    if isinstance(policy, CachePolicy):
+        return policy
+    if policy is None or policy == 'lru':
+        return LruPolicy()
+    if policy == 'gdsf':
+        return GdsfPolicy()
+    if policy == 'largest':
+        return LargestFirstPolicy()
+    raise ValueError('Unknown cache policy \'%s\'; must be one of %s.' % (policy, ', '.join('\'%s\'' % p for p in POLICY_NAMES)))
+
+
+class CachePolicy(ABC):
+    """
+    Bookkeeping of the entries of a cache, deciding which entry to evict next. The size of each entry is recorded
+    when it is added, so that no entry needs to be inspected again. Pinned entries count towards the total size, but
+    are never evicted, so that the total size may exceed any limit the cache sets if the pinned entries alone do.
+    """
+
+    def __init__(self):
+        self.sizes = {}
+        self.pinned = set()
+        self.total_size = 0
+
+
+    def add(self, key, size, pinned=False):
+        if key in self.sizes:
+            self.remove(key)
+        self.sizes[key] = size
+        self.total_size += size
+        if pinned:
+            self.pinned.add(key)
+        else:
+            self._added(key, size)
+
+
+    def touch(self, key):
+        """
+        Records an access to the given entry.
+        """
+        if key in self.sizes and key not in self.pinned:
+            self._touched(key)
+
+
+    def remove(self, key):
+        """
+        Removes the given entry from the bookkeeping.
+        @return: the size recorded for the entry.
+        """
+        size = self.sizes.pop(key)
+        self.total_size -= size
+        if key in self.pinned:
+            self.pinned.discard(key)
+        else:
+            self._removed(key)
+        return size
+
+
+    @abstractmethod
+    def find_victim(self):
+        """
+        Returns the entry to evict next, or None if all entries are pinned; does not change the bookkeeping.
+        """
+
+
+    def evict(self):
+        """
+        Removes the entry to evict next from the bookkeeping.
+        @return: the key of the evicted entry, or None if all entries are pinned.
+        """
+        key = self.find_victim()
+        if key is not None:
+            self._evicted(key)
+            self.remove(key)
+        return key
+
+
+    def _evicted(self, key):
+        pass
+
+
+    def _added(self, key, size):
+        pass
+
+
+    def _touched(self, key):
+        pass
+
+
+    def _removed(self, key):
+        pass
+
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+
+    def __iter__(self):
+        return iter(list(self.sizes))
+
+
+    def __len__(self):
+        return len(self.sizes)
+
+
+class LruPolicy(CachePolicy):
+    """
+    Evicts the least recently used entry; all operations are O(1).
+    """
+
+    def __init__(self):
+        super(LruPolicy, self).__init__()
+        self.__order = OrderedDict()
+
+
+    def _added(self, key, size):
+        self.__order[key] = None
+
+
+    def _touched(self, key):
+        self.__order.move_to_end(key)
+
+
+    def _removed(self, key):
+        del self.__order[key]
+
+
+    def find_victim(self):
+        return next(iter(self.__order), None)
+
+
+class HeapPolicy(CachePolicy):
+    """
+    Evicts the entry of the lowest priority. Priorities are kept in a heap whose outdated items are skipped lazily,
+    so that adding, touching and evicting are O(log n). The heap is rebuilt from the current items once outdated
+    items outnumber them, so that its size stays proportional to the number of entries however often they are
+    touched.
+    """
+
+    def __init__(self):
+        super(HeapPolicy, self).__init__()
+        self.__heap = []
+        # the current heap item of each entry
+        self.__items = {}
+        self.__counter = 0
+
+
+    @abstractmethod
+    def _priority(self, key, size):
+        pass
+
+
+    def _push(self, key):
+        priority = self._priority(key, self.sizes[key])
+        # the counter breaks ties in insertion order and keeps keys from being compared
+        self.__counter += 1
+        item = (priority, self.__counter, key)
+        self.__items[key] = item
+        heapq.heappush(self.__heap, item)
+        self.__compact()
+
+
+    def _added(self, key, size):
+        self._push(key)
+
+
+    def _removed(self, key):
+        del self.__items[key]
+        self.__compact()
+
+
+    def __compact(self):
+        if len(self.__heap) > 2 * len(self.__items) + 1:
+            self.__heap = list(self.__items.values())
+            heapq.heapify(self.__heap)
+
+
+    def get_priority(self, key):
+        return self.__items[key][0]
+
+
+    def get_heap_size(self):
+        """
+        Returns the number of items in the heap, including outdated ones.
+        """
+        return len(self.__heap)
+
+
+    def find_victim(self):
+        while self.__heap:
+            item = self.__heap[0]
+            if self.__items.get(item[2]) is item:
+                return item[2]
+            heapq.heappop(self.__heap)
+        return None
+
+
+class LargestFirstPolicy(HeapPolicy):
+    """
+    Evicts the largest entry, regardless of how recently it was used.
+    """
+
+    def _priority(self, key, size):
+        return -size
+
+
+class GdsfPolicy(HeapPolicy):
+    """
+    Greedy-Dual-Size-Frequency: evicts the entry of the lowest priority L + frequency / size, where L is the priority
+    of the last evicted entry. Small and frequently used entries are kept longest, while L ages out entries that are
+    no longer used.
+    """
+
+    def __init__(self):
+        super(GdsfPolicy, self).__init__()
+        self.__frequencies = {}
+        self.__inflation = 0.0
+
+
+    def _priority(self, key, size):
+        return self.__inflation + self.__frequencies[key] / max(size, 1e-12)
+
+
+    def _added(self, key, size):
+        self.__frequencies[key] = 1
+        self._push(key)
+
+
+    def _touched(self, key):
+        self.__frequencies[key] += 1
+        self._push(key)
+
+
+    def _removed(self, key):
+        self.__frequencies.pop(key)
+        super(GdsfPolicy, self)._removed(key)
+
+
+    def _evicted(self, key):
+        self.__inflation = self.get_priority(key)
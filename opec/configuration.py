@@ -32,7 +32,12 @@ class Configuration(object):
                  properties_file_name=None, write_taylor_diagrams=None, write_xhtml=None,
                  write_csv=None, write_density_plots=None, split_diagrams=None, write_target_diagram=None,
                  target_diagram_bounds=None, normalise_target_diagram=None, utilise_stddev_difference=None,
-                 max_cache_size=None, density_plot_log_scaled=None, remove_empty_matchups=None):
+                 max_cache_size=None, density_plot_log_scaled=None, remove_empty_matchups=None, spatial_index=None,
+                 max_distance=None, worker_count=None, cache_dir=None, cache_max_size=None, cache_max_age=None, interpolation=None,
+                 time_depth_interpolation=None, time_aggregation=None, window_size=None, window_min_valid=None,
+                 valid_cell_search_radius=None, prefilter_records=None, prefilter_tolerance=None,
+                 max_open_files=None, trajectory_mode=None, trajectory_time_slices=None,
+                 super_observations=None, cache_policy=None, use_mmap=None, batch_size=None):
         """
         Priority:
         1) what is passed as parameter
@@ -73,7 +78,28 @@ class Configuration(object):
         self.__set(normalise_target_diagram, 'opec.output.plot.target.normalise_target_diagram', bool_conv)
         self.__set(utilise_stddev_difference, 'opec.output.plot.target.utilise_stddev_difference', bool_conv)
         self.__set(max_cache_size, 'opec.general.max_cache_size', int)
+        self.__set(max_open_files, 'opec.general.max_open_files', int)
+        self.__set(cache_policy, 'opec.general.cache_policy', choice_conv('lru', 'gdsf', 'largest'))
+        self.__set(use_mmap, 'opec.general.use_mmap', bool_conv)
         self.__set(remove_empty_matchups, 'opec.output.remove_empty_matchups', bool_conv)
+        self.__set(spatial_index, 'opec.matchup.spatial_index', bool_conv)
+        self.__set(max_distance, 'opec.matchup.max_distance', float_or_none_conv)
+        self.__set(worker_count, 'opec.matchup.worker_count', int)
+        self.__set(batch_size, 'opec.matchup.batch_size', batch_size_conv)
+        self.__set(cache_dir, 'opec.matchup.cache_dir', str_or_none_conv)
+        self.__set(cache_max_size, 'opec.matchup.cache_max_size', float_or_none_conv)
+        self.__set(cache_max_age, 'opec.matchup.cache_max_age', float_or_none_conv)
+        self.__set(interpolation, 'opec.matchup.interpolation', choice_conv('nearest', 'bilinear'))
+        self.__set(time_depth_interpolation, 'opec.matchup.time_depth_interpolation', choice_conv('nearest', 'linear'))
+        self.__set(time_aggregation, 'opec.matchup.time_aggregation', choice_conv('none', 'mean', 'median'))
+        self.__set(window_size, 'opec.matchup.window_size', window_size_conv)
+        self.__set(window_min_valid, 'opec.matchup.window_min_valid', float)
+        self.__set(valid_cell_search_radius, 'opec.matchup.valid_cell_search_radius', float_or_none_conv)
+        self.__set(prefilter_records, 'opec.matchup.prefilter_records', bool_conv)
+        self.__set(prefilter_tolerance, 'opec.matchup.prefilter_tolerance', float)
+        self.__set(trajectory_mode, 'opec.matchup.trajectory_mode', bool_conv)
+        self.__set(trajectory_time_slices, 'opec.matchup.trajectory_time_slices', time_slices_conv)
+        self.__set(super_observations, 'opec.matchup.super_observations', bool_conv)
 
 
     def __set(self, value, name, converter, target_name=None):
@@ -209,6 +235,18 @@ class Configuration(object):
         return self.__dict['opec.general.max_cache_size']
 
 
+    def __max_open_files(self):
+        return self.__dict['opec.general.max_open_files']
+
+
+    def __cache_policy(self):
+        return self.__dict['opec.general.cache_policy']
+
+
+    def __use_mmap(self):
+        return self.__dict['opec.general.use_mmap']
+
+
     def __density_plot_log_scaled(self):
         return self.__dict['opec.output.plot.density.log_scaled']
 
@@ -217,6 +255,78 @@ class Configuration(object):
         return self.__dict['opec.output.remove_empty_matchups']
 
 
+    def __spatial_index(self):
+        return self.__dict['opec.matchup.spatial_index']
+
+
+    def __max_distance(self):
+        return self.__dict['opec.matchup.max_distance']
+
+
+    def __worker_count(self):
+        return self.__dict['opec.matchup.worker_count']
+
+
+    def __batch_size(self):
+        return self.__dict['opec.matchup.batch_size']
+
+
+    def __cache_dir(self):
+        return self.__dict['opec.matchup.cache_dir']
+
+
+    def __cache_max_size(self):
+        return self.__dict['opec.matchup.cache_max_size']
+
+
+    def __cache_max_age(self):
+        return self.__dict['opec.matchup.cache_max_age']
+
+
+    def __interpolation(self):
+        return self.__dict['opec.matchup.interpolation']
+
+
+    def __time_depth_interpolation(self):
+        return self.__dict['opec.matchup.time_depth_interpolation']
+
+
+    def __time_aggregation(self):
+        return self.__dict['opec.matchup.time_aggregation']
+
+
+    def __window_size(self):
+        return self.__dict['opec.matchup.window_size']
+
+
+    def __window_min_valid(self):
+        return self.__dict['opec.matchup.window_min_valid']
+
+
+    def __valid_cell_search_radius(self):
+        return self.__dict['opec.matchup.valid_cell_search_radius']
+
+
+    def __prefilter_records(self):
+        return self.__dict['opec.matchup.prefilter_records']
+
+
+    def __prefilter_tolerance(self):
+        return self.__dict['opec.matchup.prefilter_tolerance']
+
+
+    def __trajectory_mode(self):
+        return self.__dict['opec.matchup.trajectory_mode']
+
+
+    def __trajectory_time_slices(self):
+        return self.__dict['opec.matchup.trajectory_time_slices']
+
+
+    def __super_observations(self):
+        return self.__dict['opec.matchup.super_observations']
+
+
     alpha = property(__alpha)
     beta = property(__beta)
     ddof = property(__ddof)
@@ -244,7 +354,28 @@ class Configuration(object):
     normalise_target_diagram = property(__normalise_target_diagram)
     utilise_stddev_difference = property(__utilise_stddev_difference)
     max_cache_size = property(__max_cache_size)
+    max_open_files = property(__max_open_files)
+    cache_policy = property(__cache_policy)
+    use_mmap = property(__use_mmap)
     remove_empty_matchups = property(__remove_empty_matchups)
+    spatial_index = property(__spatial_index)
+    max_distance = property(__max_distance)
+    worker_count = property(__worker_count)
+    batch_size = property(__batch_size)
+    cache_dir = property(__cache_dir)
+    cache_max_size = property(__cache_max_size)
+    cache_max_age = property(__cache_max_age)
+    interpolation = property(__interpolation)
+    time_depth_interpolation = property(__time_depth_interpolation)
+    time_aggregation = property(__time_aggregation)
+    window_size = property(__window_size)
+    window_min_valid = property(__window_min_valid)
+    valid_cell_search_radius = property(__valid_cell_search_radius)
+    prefilter_records = property(__prefilter_records)
+    prefilter_tolerance = property(__prefilter_tolerance)
+    trajectory_mode = property(__trajectory_mode)
+    trajectory_time_slices = property(__trajectory_time_slices)
+    super_observations = property(__super_observations)
 
 
 def get_default_config():
@@ -283,6 +414,50 @@ def log_file_conv(value):
     return None if value.strip() == 'None' else value
 
 
+def float_or_none_conv(value):
+    if value is None or str(value).strip() == 'None':
+        return None
+    return float(value)
+
+
+def choice_conv(*choices):
+    def choice(value):
+        chosen = str(value).strip().lower()
+        if chosen not in choices:
+            raise ValueError('Invalid value \'%s\'; must be one of %s.' % (value, ', '.join('\'%s\'' % c for c in choices)))
+        return chosen
+    return choice
+
+
+def window_size_conv(value):
+    window_size = int(value)
+    if window_size < 1 or window_size % 2 == 0:
+        raise ValueError('Illegal window size \'%s\', must be a positive odd number.' % value)
+    return window_size
+
+
+def batch_size_conv(value):
+    if value is None or str(value).strip() == 'None':
+        return None
+    batch_size = int(value)
+    if batch_size < 1:
+        raise ValueError('Illegal batch size \'%s\', must be a positive number.' % value)
+    return batch_size
+
+
+def time_slices_conv(value):
+    time_slices = int(value)
+    if time_slices < 2:
+        raise ValueError('Illegal number of time slices \'%s\', must be at least 2.' % value)
+    return time_slices
+
+
+def str_or_none_conv(value):
+    if value is None or str(value).strip() == 'None':
+        return None
+    return str(value)
+
+
 def split_diagrams_conv(key):
     def shall_split_for_value(value):
         if len(value) > 0 and (not re.match('[un]', value) or len(value) > 3):
@@ -0,0 +1,97 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import numpy as np
+
+from opec.utils import split_masked
+
+
+class CoordinateIndex(object):
+    """
+    Sorted index over the values of a coordinate variable, built once and queried by binary search.
+    Masked values are left out of the index; axes which are not monotonically increasing are sorted.
+    """
+
+    def __init__(self, values):
+        data, invalid = split_masked(values)
+        valid_indices = np.nonzero(~invalid)[0]
+        valid_data = data[valid_indices]
+        self.is_increasing = bool(np.all(valid_data[1:] >= valid_data[:-1]))
+        if not self.is_increasing:
+            valid_indices = valid_indices[np.argsort(valid_data, kind='mergesort')]
+        self.__indices = valid_indices
+        self.__sorted_values = data[valid_indices]
+        self.values = values
+        self.size = len(data)
+
+
+    def find_nearest(self, values, max_delta=float('inf')):
+        """
+        Returns the index of the coordinate value nearest to each of the given values. Only coordinate values with a
+        difference less than max_delta are considered; on equal differences, the lower index is chosen.
+        @param values: a scalar or an array of values; masked or NaN values never match.
+        @param max_delta: the exclusive maximum difference between a value and its nearest coordinate value.
+        @return: for a scalar, the index or None; for an array, a tuple (indices, valid) of equally sized arrays,
+        where indices is only meaningful where valid is True.
+        """
+        if np.ndim(values) == 0:
+            indices, valid = self.find_nearest(np.ma.atleast_1d(values), max_delta)
+            return int(indices[0]) if valid[0] else None
+
+        values, invalid = split_masked(values)
+        indices = np.zeros(len(values), dtype=np.int64)
+        valid = np.zeros(len(values), dtype=bool)
+        count = len(self.__sorted_values)
+        if count == 0 or len(values) == 0:
+            return indices, valid
+
+        sorted_values = self.__sorted_values
+        upper = np.clip(np.searchsorted(sorted_values, values, side='left'), 0, count - 1)
+        lower = np.clip(upper - 1, 0, count - 1)
+        # map the lower candidate to the first of equal coordinate values, which carries the lowest index
+        lower = np.searchsorted(sorted_values, sorted_values[lower], side='left')
+
+        with np.errstate(invalid='ignore', over='ignore'):
+            lower_delta = np.abs(values - sorted_values[lower])
+            upper_delta = np.abs(values - sorted_values[upper])
+        lower_index = self.__indices[lower]
+        upper_index = self.__indices[upper]
+        use_lower = (lower_delta < upper_delta) | ((lower_delta == upper_delta) & (lower_index <= upper_index))
+        indices = np.where(use_lower, lower_index, upper_index)
+        deltas = np.where(use_lower, lower_delta, upper_delta)
+        with np.errstate(invalid='ignore'):
+            valid = ~invalid & (deltas < max_delta)
+        return indices, valid
+
+
+    def find_brackets(self, values):
+        """
+        Returns the two neighbouring coordinate values enclosing each of the given values, and the linear interpolation
+        weight of the upper one. Values outside the coordinate range are clamped to the first or last coordinate value.
+        @param values: an array of values; masked or NaN values get weight 0 on the first coordinate value.
+        @return: a tuple (lower_indices, upper_indices, weights) of equally sized arrays.
+        """
+        values, invalid = split_masked(values)
+        count = len(self.__sorted_values)
+        if count == 0:
+            raise ValueError('Unable to interpolate along a coordinate variable without valid values.')
+        sorted_values = self.__sorted_values
+        with np.errstate(invalid='ignore'):
+            clamped = np.clip(np.where(invalid, sorted_values[0], values), sorted_values[0], sorted_values[-1])
+        upper = np.clip(np.searchsorted(sorted_values, clamped, side='right'), min(1, count - 1), count - 1)
+        lower = np.maximum(upper - 1, 0)
+        spans = (sorted_values[upper] - sorted_values[lower]).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weights = np.where(spans > 0, (clamped - sorted_values[lower]) / spans, 0.0)
+        return self.__indices[lower], self.__indices[upper], weights
@@ -14,30 +14,60 @@
 import functools
 import logging
 import sys
-import os
+import numpy as np
 import numpy.ma as ma
 
 from opec import utils
+from opec.cache_policy import create_cache_policy
+from opec.grid_geometry import create_grid_geometry, create_nearest_valid_cell_map
+from opec.memory import current_rss, log_memory
+from opec.multi_file_facade import open_reference_files
 from opec.netCDF_facade import NetCDFFacade
+from opec.tiling import default_tile_shape, find_tiles, tile_slices
 
 class Data(object):
 
-    def __init__(self, model_file_name, ref_file_name=None, max_cache_size=None):
+    def __init__(self, model_file_name, ref_file_name=None, max_cache_size=None, max_open_files=None, cache_policy=None,
+                 use_mmap=False):
+        """
+        @param ref_file_name: the reference file; may also be a glob pattern or a list of files, whose records are
+        concatenated.
+        @param max_open_files: the maximum number of reference files kept open at the same time.
+        @param cache_policy: the policy choosing the cached variable to evict, one of 'lru', 'gdsf' and 'largest', or a
+        CachePolicy; if None, the least recently used variable is evicted. Coordinate variables are never evicted.
+        @param use_mmap: if True, files in netCDF classic or 64-bit offset format are memory-mapped, and variables read
+        fully are views of the memory map rather than copies.
+        """
         if ref_file_name is not None:
-            self.__reference_file = NetCDFFacade(ref_file_name)
+            self.__reference_file = open_reference_files(ref_file_name, max_open_files, use_mmap)
         if model_file_name is not None:
-            self.__model_file = NetCDFFacade(model_file_name)
+            self.__model_file = NetCDFFacade(model_file_name, use_mmap=use_mmap)
         self.max_cache_size = max_cache_size if max_cache_size is not None else sys.maxsize
-        self.cached_list = []
-        self.current_memory = 0
+        self.cache_policy = create_cache_policy(cache_policy)
+        self.tiles = {}
 
 
     def model_vars(self):
+        """
+        Returns the names of the model data variables; the 2-D latitude and longitude variables of curvilinear grids
+        are part of the grid geometry and not model variables.
+        """
         if not hasattr(self, 'model_variables'):
-            self.model_variables = self.__model_file.get_model_variables()
+            geometry_variables = self.__find_geometry_variable_names()
+            self.model_variables = [name for name in self.__model_file.get_model_variables() if name not in geometry_variables]
         return self.model_variables
 
 
+    def __find_geometry_variable_names(self):
+        names = []
+        for find_variable_name in (self.find_model_latitude_variable_name, self.find_model_longitude_variable_name):
+            try:
+                names.append(find_variable_name())
+            except ValueError:
+                pass
+        return names
+
+
     def close(self):
         self.__model_file.close()
         if self.is_ref_data_split():
@@ -83,6 +113,17 @@ class Data(object):
         return ncfile.get_dimension_string(variable_name)
 
 
+    def get_file_names(self):
+        file_names = [self.__model_file.filename]
+        if self.is_ref_data_split():
+            reference_file_names = self.__reference_file.filename
+            if isinstance(reference_file_names, list):
+                file_names.extend(reference_file_names)
+            else:
+                file_names.append(reference_file_names)
+        return file_names
+
+
     def is_ref_data_split(self):
         return hasattr(self, '_Data__reference_file')
 
@@ -125,54 +166,221 @@ class Data(object):
 
 
     def read_model(self, variable_name, origin=None):
+        if origin is not None and not self.__is_cached(variable_name):
+            return self.read_model_point(variable_name, origin)
         return self.__read(self.__model_file, variable_name, origin)
 
 
+    def get_tile_shape(self, variable_name):
+        """
+        Returns the shape of the tiles a model variable is read in: its netCDF chunk shape, if it is chunked, or else
+        blocks of about 1 MB spanning its trailing dimensions.
+        """
+        if not hasattr(self, 'tile_shapes'):
+            self.tile_shapes = {}
+        if variable_name not in self.tile_shapes:
+            variable = self.__model_file.get_variable(variable_name)
+            chunking = variable.chunking() if hasattr(variable, 'chunking') else None
+            if isinstance(chunking, (list, tuple)):
+                self.tile_shapes[variable_name] = tuple(chunking)
+            else:
+                self.tile_shapes[variable_name] = default_tile_shape(variable.shape, variable.dtype.itemsize)
+        return self.tile_shapes[variable_name]
+
+
+    def read_model_tile(self, variable_name, tile_index):
+        """
+        Reads a tile of a model variable through the tile cache, which shares the budget of max_cache_size with the
+        cache of whole variables.
+        @param tile_index: the tuple of indices of the tile along each dimension.
+        """
+        key = (variable_name, tuple(tile_index))
+        if key in self.cache_policy:
+            self.cache_policy.touch(key)
+            return self.tiles[key]
+        variable = self.__model_file.get_variable(variable_name)
+        slices = tile_slices(key[1], self.get_tile_shape(variable_name), variable.shape)
+        tile_size = compute_array_size([s.stop - s.start for s in slices], variable.dtype.itemsize)
+        self.ensure_memory(tile_size)
+        logging.debug('Reading tile %s of variable \'%s\' into cache.', key[1], variable_name)
+        tile = ma.array(variable[slices])
+        self.tiles[key] = tile
+        self.cache_policy.add(key, tile_size)
+        return tile
+
+
+    def read_model_point(self, variable_name, origin):
+        """
+        Reads a single value of a model variable, from the tile containing it.
+        """
+        tile_shape = self.get_tile_shape(variable_name)
+        tile_index = tuple(int(index) // extent for index, extent in zip(origin, tile_shape))
+        local_index = tuple(int(index) % extent for index, extent in zip(origin, tile_shape))
+        return self.read_model_tile(variable_name, tile_index)[local_index]
+
+
+    def gather(self, variable_name, index_arrays):
+        """
+        Reads the values of a model variable at many cells at once. Unless the variable is already in the cache, the
+        cells are sorted by the tile containing them, each tile is read with a single hyperslab read (or taken from
+        the tile cache), and the values are scattered back into the order of the request.
+        @param index_arrays: one integer array per dimension of the variable; the arrays are broadcast against each
+        other.
+        @return: a masked array of the broadcast shape of the index arrays.
+        """
+        if self.__is_cached(variable_name):
+            self.cache_policy.touch(variable_name)
+            return ma.array(self.__getattribute__(variable_name))[tuple(index_arrays)]
+        index_arrays = np.broadcast_arrays(*[np.asarray(ma.getdata(indices), dtype=np.int64) for indices in index_arrays])
+        result_shape = index_arrays[0].shape
+        index_arrays = [indices.ravel() for indices in index_arrays]
+        shape = self.__model_file.get_variable(variable_name).shape
+        tile_shape = self.get_tile_shape(variable_name)
+        tile_counts = tuple(-(-size // extent) for size, extent in zip(shape, tile_shape))
+        tile_indices = [indices // extent for indices, extent in zip(index_arrays, tile_shape)]
+        local_indices = [indices % extent for indices, extent in zip(index_arrays, tile_shape)]
+
+        keys = np.ravel_multi_index(tuple(tile_indices), tile_counts)
+        order = np.argsort(keys, kind='stable')
+        boundaries = np.flatnonzero(np.diff(keys[order])) + 1
+        result = None
+        for group in np.split(order, boundaries) if len(order) > 0 else []:
+            tile = self.read_model_tile(variable_name, tuple(int(indices[group[0]]) for indices in tile_indices))
+            if result is None:
+                result = ma.masked_all(len(order), dtype=tile.dtype)
+            result[group] = tile[tuple(indices[group] for indices in local_indices)]
+        if result is None:
+            result = ma.masked_all(0, dtype=np.float64)
+        return result.reshape(result_shape)
+
+
+    def get_gather_view(self, variable_name):
+        """
+        Returns a view of a model variable that reads the cells addressed by fancy indexing with 'gather'.
+        """
+        return GatherView(self, variable_name)
+
+
+    def read_model_region(self, variable_name, region):
+        """
+        Reads a hyperslab of a model variable, e.g. a window around a cell. Unless the variable is already in the
+        cache, only the tiles overlapping the hyperslab are read.
+        @param region: a tuple of slices with step 1, one per dimension.
+        """
+        if self.__is_cached(variable_name):
+            return self.read_model(variable_name)[tuple(region)]
+        variable = self.__model_file.get_variable(variable_name)
+        shape = variable.shape
+        tile_shape = self.get_tile_shape(variable_name)
+        region = tuple(slice(*s.indices(size)[:2]) for s, size in zip(region, shape))
+        result = ma.masked_all(tuple(max(0, s.stop - s.start) for s in region), dtype=variable.dtype)
+        for tile_index in find_tiles(region, tile_shape, shape):
+            tile_region = tile_slices(tile_index, tile_shape, shape)
+            starts = [max(r.start, t.start) for r, t in zip(region, tile_region)]
+            stops = [min(r.stop, t.stop) for r, t in zip(region, tile_region)]
+            target = tuple(slice(start - r.start, stop - r.start) for start, stop, r in zip(starts, stops, region))
+            source = tuple(slice(start - t.start, stop - t.start) for start, stop, t in zip(starts, stops, tile_region))
+            result[target] = self.read_model_tile(variable_name, tile_index)[source]
+        return result
+
+
     def read_reference(self, variable_name, origin=None):
         ncfile = self.__reference_file if self.is_ref_data_split() else self.__model_file
         return self.__read(ncfile, variable_name, origin)
 
 
+    def read_model_time_slices(self, variable_name, time_indices):
+        """
+        Reads the given time steps of a model variable. Unless the variable is already in the cache, only these time
+        steps are read from file, without filling the cache.
+        @param time_indices: a sorted array of unique time indices.
+        """
+        if self.__is_cached(variable_name):
+            return self.read_model(variable_name)[time_indices]
+        logging.debug('Reading %s time steps of variable \'%s\'', len(time_indices), variable_name)
+        return ma.array(self.__model_file.get_variable(variable_name)[time_indices])
+
+
+    def read_reference_slice(self, variable_name, start, stop):
+        """
+        Reads the records start to stop of a one-dimensional reference variable. Unless the variable is already in the
+        cache or all of its records are requested, the records are read from file without filling the cache.
+        """
+        ncfile = self.__reference_file if self.is_ref_data_split() else self.__model_file
+        if self.__is_cached(variable_name) or start == 0 and stop >= ncfile.get_variable(variable_name).shape[0]:
+            return self.read_reference(variable_name)[start:stop]
+        logging.debug('Reading records %s to %s of variable \'%s\'', start, stop, variable_name)
+        return ma.array(ncfile.get_variable(variable_name)[start:stop])
+
+
+    def get_cached_list(self):
+        """
+        Returns the names of the variables fully held in the cache; tiles are not listed.
+        """
+        return [key for key in self.cache_policy if isinstance(key, str)]
+
+
     def find_item_to_delete(self):
-        self.cached_list = sorted(self.cached_list, key=self.compute_variable_size, reverse=True)
-        return self.cached_list.pop(0)
+        """
+        Removes the entry chosen by the cache policy from the cache bookkeeping and returns its key, a variable name or
+        a tuple (variable_name, tile_index); returns None if only pinned variables are cached.
+        """
+        return self.cache_policy.evict()
 
 
     def get_current_cache_size(self):
-        return sum([self.compute_variable_size(variable_name) for variable_name in self.cached_list])
+        return self.cache_policy.total_size
 
 
     def ensure_memory(self, variable_size):
-        will_cache_overflow = self.max_cache_size <= self.current_memory + variable_size
-        while will_cache_overflow and len(self.cached_list) > 0:
+        """
+        Evicts cached entries until an entry of the given size fits into max_cache_size. Coordinate variables are
+        pinned and never evicted; if they alone leave no room, the cache exceeds max_cache_size and a warning is logged.
+        """
+        will_cache_overflow = self.max_cache_size <= self.cache_policy.total_size + variable_size
+        while will_cache_overflow:
             var_to_delete = self.find_item_to_delete()
-            self.current_memory -= self.compute_variable_size(var_to_delete)
-            logging.debug('Deleting variable \'%s\' from cache.' % var_to_delete)
-            self.__delattr__(var_to_delete)
-            will_cache_overflow = self.max_cache_size <= self.current_memory + variable_size
-        if not os.name == 'nt':
-            logging.debug('Memory in use after \'ensure_memory\' called: %.2f MB' % (mem() / 1024))
+            if var_to_delete is None:
+                if len(self.cache_policy) > 0:
+                    logging.warning('Cache exceeds max_cache_size: only coordinate variables are left, which are never evicted.')
+                break
+            if isinstance(var_to_delete, tuple):
+                logging.debug('Deleting tile %s of variable \'%s\' from cache.', var_to_delete[1], var_to_delete[0])
+                del self.tiles[var_to_delete]
+            else:
+                logging.debug('Deleting variable \'%s\' from cache.', var_to_delete)
+                self.__delattr__(var_to_delete)
+            will_cache_overflow = self.max_cache_size <= self.cache_policy.total_size + variable_size
+        log_memory('Memory in use after \'ensure_memory\' called')
 
 
     def __read(self, ncfile, variable_name, origin=None):
-        variable_size = self.compute_variable_size(variable_name)
-        if not self.__is_cached(variable_name):
+        if self.__is_cached(variable_name):
+            self.cache_policy.touch(variable_name)
+        else:
+            self.__drop_tiles(variable_name)
+            variable_size = self.compute_variable_size(variable_name)
             self.ensure_memory(variable_size)
-            logging.debug('Reading variable \'%s\' fully into cache.' % variable_name)
-            if not os.name == 'nt':
-                logging.debug('Memory in use before reading variable %s fully into cache: %.2f MB' % (variable_name, mem() / 1024))
+            logging.debug('Reading variable \'%s\' fully into cache.', variable_name)
+            log_memory('Memory in use before reading variable %s fully into cache', variable_name)
             variable = ncfile.get_variable(variable_name)
             self.__setattr__(variable_name, variable[:])
-            self.cached_list.append(variable_name)
-            self.current_memory += self.compute_variable_size(variable_name)
-            if not os.name == 'nt':
-                logging.debug('Memory in use after reading variable %s fully into cache: %.2f MB' % (variable_name, mem() / 1024))
+            self.cache_policy.add(variable_name, variable_size, self.__is_coordinate_variable(variable_name))
+            log_memory('Memory in use after reading variable %s fully into cache', variable_name)
         if origin is None:
             return ma.array(self.__getattribute__(variable_name))
 
         return self.get_data(origin, variable_name)
 
 
+    def __drop_tiles(self, variable_name):
+        # once a variable is cached fully, its tiles would only hold the same data a second time
+        for key in [key for key in self.tiles if key[0] == variable_name]:
+            logging.debug('Deleting tile %s of variable \'%s\' from cache.', key[1], variable_name)
+            del self.tiles[key]
+            self.cache_policy.remove(key)
+
+
     def get_data(self, origin, variable_name):
         '''
         Read single pixel from origin
@@ -182,7 +390,15 @@ class Data(object):
 
 
     def __is_cached(self, variable_name):
-        return variable_name in self.cached_list
+        return variable_name in self.cache_policy
+
+
+    def __is_coordinate_variable(self, variable_name):
+        if not hasattr(self, 'coordinate_variables'):
+            coordinate_variables = set(self.__model_file.get_coordinate_variables())
+            coordinate_variables.update(self.reference_coordinate_variables())
+            self.coordinate_variables = coordinate_variables
+        return variable_name in self.coordinate_variables
 
 
     def __find_model_variable_name(self, possible_names, standard_name):
@@ -195,6 +411,18 @@ class Data(object):
         raise ValueError('Unable to find \'%s\'-variable.' % standard_name)
 
 
+    def get_grid_geometry(self):
+        if not hasattr(self, 'grid_geometry'):
+            self.grid_geometry = create_grid_geometry(self)
+        return self.grid_geometry
+
+
+    def get_nearest_valid_cell_map(self):
+        if not hasattr(self, 'nearest_valid_cell_map'):
+            self.nearest_valid_cell_map = create_nearest_valid_cell_map(self)
+        return self.nearest_valid_cell_map
+
+
     def find_model_latitude_variable_name(self):
         return self.__find_model_variable_name(['lat', 'latitude'], 'latitude')
 
@@ -240,10 +468,10 @@ class Data(object):
         reference_values.mask = reference_values.mask | model_values.mask
         model_values.mask = reference_values.mask | model_values.mask
 
-        logging.debug('Compressing ref-variable %s' % ref_name)
+        logging.debug('Compressing ref-variable %s', ref_name)
         reference_values = reference_values.compressed()
 
-        logging.debug('Compressing model variable %s' % model_name)
+        logging.debug('Compressing model variable %s', model_name)
         model_values = model_values.compressed()
 
         return reference_values, model_values
@@ -313,6 +541,24 @@ class Data(object):
         return index
 
 
+    cached_list = property(get_cached_list)
+    current_memory = property(get_current_cache_size)
+
+
+class GatherView(object):
+    """
+    Stands in for a model variable where only fancy indexing with a tuple of index arrays is needed.
+    """
+
+    def __init__(self, data, variable_name):
+        self.data = data
+        self.variable_name = variable_name
+
+
+    def __getitem__(self, index_arrays):
+        return self.data.gather(self.variable_name, index_arrays)
+
+
 def compute_array_size(shape, itemsize):
     num_entries = functools.reduce(lambda x, y: x * y, shape)
     byte_size = num_entries * itemsize
@@ -320,4 +566,4 @@ def compute_array_size(shape, itemsize):
 
 
 def mem():
-    return int(os.popen('ps -p %d -o rss | tail -1' % os.getpid()).read())
+    return current_rss()
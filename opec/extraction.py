@@ -0,0 +1,165 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import itertools
+
+import numpy as np
+import numpy.ma as ma
+
+from opec.utils import split_masked
+
+
+def interpolate(values, positions):
+    """
+    Interpolates the given array linearly at many positions at once. Dimensions are either addressed by an index
+    array or interpolated between two indices; for each combination of lower and upper indices ('corner'), the values
+    are gathered with one fancy-indexing read. Invalid corners are left out and the weights of the valid corners are
+    renormalised, so that a value is only invalid if all corners with non-zero weight are invalid.
+    @param values: the (masked) array to interpolate, e.g. a model variable.
+    @param positions: one entry per dimension of values: an index array, or a tuple (lower_indices, upper_indices,
+    weights), where weights are the weights of the upper indices.
+    @return: a masked array with one value per position.
+    """
+    interpolated_dimensions = [dimension for dimension, position in enumerate(positions) if isinstance(position, tuple)]
+    weighted_sum = None
+    weight_sum = None
+    for corner in itertools.product((False, True), repeat=len(interpolated_dimensions)):
+        index = list(positions)
+        weights = 1.0
+        for dimension, is_upper in zip(interpolated_dimensions, corner):
+            lower_indices, upper_indices, upper_weights = positions[dimension]
+            upper_weights = ma.getdata(upper_weights)
+            index[dimension] = upper_indices if is_upper else lower_indices
+            weights = weights * (upper_weights if is_upper else 1.0 - upper_weights)
+        corner_values, invalid = split_masked(values[tuple(index)])
+        weights = np.where(invalid, 0.0, weights)
+        contribution = np.where(weights > 0, corner_values * weights, 0.0)
+        weighted_sum = contribution if weighted_sum is None else weighted_sum + contribution
+        weight_sum = weights if weight_sum is None else weight_sum + weights
+
+    is_empty = weight_sum <= 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.where(is_empty, 0.0, weighted_sum / np.where(is_empty, 1.0, weight_sum))
+    return ma.array(result, mask=is_empty)
+
+
+def aggregate(values, window_offsets, method):
+    """
+    Reduces consecutive windows of values, excluding invalid values. The windows are given as one flat array, so
+    that each window holds exactly its own values. Means are computed from cumulative sums and medians by sorting all
+    values once, so that the cost depends on the total number of values only, not on the length of the longest window.
+    @param values: a (masked) 1-D array: the values of all windows, one window after the other.
+    @param window_offsets: the start of each window within values, followed by the end of the last window.
+    @param method: either 'mean' or 'median'.
+    @return: a masked array with one value per window; masked where a window contains no valid value.
+    """
+    data, invalid = split_masked(values)
+    valid = ~invalid
+    window_count = len(window_offsets) - 1
+    if method == 'mean':
+        sums = np.zeros(len(data) + 1)
+        np.cumsum(np.where(valid, data, 0.0), out=sums[1:])
+        counts = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum(valid, out=counts[1:])
+        window_sums = sums[window_offsets[1:]] - sums[window_offsets[:-1]]
+        window_counts = counts[window_offsets[1:]] - counts[window_offsets[:-1]]
+        is_empty = window_counts == 0
+        return ma.array(window_sums / np.where(is_empty, 1, window_counts), mask=is_empty)
+    if method == 'median':
+        windows = np.searchsorted(window_offsets, np.arange(len(data)), side='right') - 1
+        # values outside all windows are left out, like invalid values
+        valid &= (windows >= 0) & (windows < window_count)
+        windows = windows[valid]
+        data = data[valid]
+        # sorted by window first and by value second, the valid values of each window are consecutive and in order
+        sorted_data = data[np.lexsort((data, windows))]
+        counts = np.bincount(windows, minlength=window_count)
+        is_empty = counts == 0
+        if len(sorted_data) == 0:
+            return ma.array(np.zeros(window_count), mask=is_empty)
+        firsts = np.cumsum(counts) - counts
+        lower = np.minimum(firsts + np.maximum(counts - 1, 0) // 2, len(sorted_data) - 1)
+        upper = np.minimum(firsts + counts // 2, len(sorted_data) - 1)
+        medians = (sorted_data[lower] + sorted_data[upper]) / 2.0
+        return ma.array(np.where(is_empty, 0.0, medians), mask=is_empty)
+    raise ValueError('Unknown aggregation method \'%s\'.' % method)
+
+
+def window_statistics(window_values, cell_counts=None):
+    """
+    Computes statistics of the valid values in each row.
+    @param window_values: a (masked) array of shape (windows, cells per window).
+    @param cell_counts: the number of cells of each window the valid fraction refers to, e.g. leaving out cells
+    outside the grid; if None, all cells per window.
+    @return: a dictionary of arrays with one value per window: 'mean' and 'stddev' (masked where a window has no
+    valid value), 'count' (of valid values) and 'valid_fraction'.
+    """
+    data, invalid = split_masked(window_values)
+    valid = ~invalid
+    counts = np.count_nonzero(valid, axis=1)
+    is_empty = counts == 0
+    divisors = np.where(is_empty, 1, counts)
+    means = np.where(valid, data, 0.0).sum(axis=1) / divisors
+    with np.errstate(invalid='ignore', over='ignore'):
+        squared_deviations = np.where(valid, (data - means[:, np.newaxis]) ** 2, 0.0)
+    stddevs = np.sqrt(squared_deviations.sum(axis=1) / divisors)
+    if cell_counts is None:
+        cell_counts = np.full(len(counts), data.shape[1])
+    return {
+        'mean': ma.array(means, mask=is_empty),
+        'stddev': ma.array(stddevs, mask=is_empty),
+        'count': counts,
+        'valid_fraction': counts / np.maximum(cell_counts, 1).astype(np.float64)
+    }
+
+
+def find_groups(index_columns):
+    """
+    Groups rows by their tuple of indices. The index tuples are flattened to single keys, which are sorted once, so
+    that the cost is O(n log n) in the number of rows.
+    @param index_columns: a sequence of non-negative integer arrays of equal length, e.g. the cell indices of matchups.
+    @return: a tuple (group_indices, first_indices): the group of each row, numbered in the order of the flattened
+    keys, and the first row of each group.
+    """
+    index_columns = [np.asarray(ma.getdata(column), dtype=np.int64) for column in index_columns]
+    if len(index_columns[0]) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    shape = tuple(int(column.max()) + 1 for column in index_columns)
+    keys = np.ravel_multi_index(tuple(index_columns), shape)
+    _, first_indices, group_indices = np.unique(keys, return_index=True, return_inverse=True)
+    return group_indices.ravel(), first_indices
+
+
+def group_statistics(values, group_indices, group_count):
+    """
+    Computes statistics of the valid values of each group with bincount, in O(n).
+    @param values: a (masked) array with one value per row.
+    @param group_indices: the group of each row, between 0 and group_count - 1.
+    @return: a dictionary of arrays with one value per group: 'mean' and 'stddev' (masked where a group has no valid
+    value) and 'count' (of valid values).
+    """
+    data, invalid = split_masked(values)
+    valid = ~invalid
+    counts = np.bincount(group_indices, weights=valid, minlength=group_count).astype(np.int64)
+    is_empty = counts == 0
+    divisors = np.where(is_empty, 1, counts)
+    means = np.bincount(group_indices, weights=np.where(valid, data, 0.0), minlength=group_count) / divisors
+    with np.errstate(invalid='ignore', over='ignore'):
+        squared_deviations = np.where(valid, (data - means[group_indices]) ** 2, 0.0)
+    stddevs = np.sqrt(np.bincount(group_indices, weights=squared_deviations, minlength=group_count) / divisors)
+    return {
+        'mean': ma.array(means, mask=is_empty),
+        'stddev': ma.array(stddevs, mask=is_empty),
+        'count': counts
+    }
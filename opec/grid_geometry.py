@@ -0,0 +1,260 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import numpy as np
+import numpy.ma as ma
+from scipy.ndimage import distance_transform_edt
+
+from opec.coordinate_index import CoordinateIndex
+from opec.spatial_index import SpatialIndex
+from opec.utils import split_masked
+
+# maximum relative deviation of the spacing between neighbouring coordinates for an axis to be considered uniform
+UNIFORMITY_TOLERANCE = 1e-3
+
+
+class AxisGeometry(object):
+    """
+    Describes a single horizontal axis of the model grid: name, size, origin, spacing, direction and uniformity.
+    """
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+        data, invalid = split_masked(values)
+        self.size = len(data)
+        self.origin = data[0] if self.size > 0 else None
+        self.spacing = data[1] - data[0] if self.size > 1 else None
+        differences = np.diff(data.astype(np.float64))
+        if self.size > 1 and np.all(differences > 0):
+            self.direction = 1
+        elif self.size > 1 and np.all(differences < 0):
+            self.direction = -1
+        else:
+            self.direction = 0
+        self.is_uniform = self.direction != 0 and not np.any(invalid) and \
+                          bool(np.all(np.abs(differences - differences[0]) <= UNIFORMITY_TOLERANCE * abs(differences[0])))
+        self.__index = None if self.is_uniform else CoordinateIndex(values)
+
+
+    def find_indices(self, target_values):
+        """
+        Returns the indices of the grid cells containing the given coordinate values.
+        Values before the first cell (in axis direction) are invalid; values beyond the last cell belong to the last cell.
+        @param target_values: the coordinate values to find.
+        @return: a tuple (indices, valid) of equally sized arrays; indices are only meaningful where valid is True.
+        """
+        values, invalid = split_masked(target_values)
+        if self.size == 0:
+            return np.zeros(len(values), dtype=np.int64), np.zeros(len(values), dtype=bool)
+        with np.errstate(invalid='ignore'):
+            offsets = values - self.origin
+            valid = ~invalid
+            if self.direction != 0:
+                valid &= offsets * self.direction >= 0
+        if self.is_uniform:
+            with np.errstate(invalid='ignore'):
+                indices = np.floor(offsets / self.spacing + 0.5)
+            indices = np.where(valid, np.minimum(indices, self.size - 1), 0).astype(np.int64)
+        else:
+            indices, found = self.__index.find_nearest(values)
+            valid &= found
+            indices = np.where(valid, indices, 0)
+        return indices, valid
+
+
+    def find_index(self, target_value):
+        indices, valid = self.find_indices(np.ma.atleast_1d(target_value))
+        return int(indices[0]) if valid[0] else None
+
+
+    def get_extent(self):
+        """
+        Returns the tuple (minimum, maximum) of the coordinates covered by the cells of this axis, including the outer
+        half of the border cells.
+        """
+        data, invalid = split_masked(self.values)
+        data = data[~invalid].astype(np.float64)
+        if len(data) < 2:
+            return np.min(data), np.max(data)
+        half_cells = (abs(data[1] - data[0]) / 2, abs(data[-1] - data[-2]) / 2)
+        if data[0] > data[-1]:
+            half_cells = half_cells[::-1]
+        return np.min(data) - half_cells[0], np.max(data) + half_cells[1]
+
+
+    def find_brackets(self, target_values):
+        """
+        Returns the two neighbouring grid cells enclosing each of the given coordinate values, and the linear
+        interpolation weight of the upper one. Values outside the grid are clamped to the first or last cell.
+        @return: a tuple (lower_indices, upper_indices, weights) of equally sized arrays.
+        """
+        if not self.is_uniform:
+            return self.__index.find_brackets(target_values)
+        values, invalid = split_masked(target_values)
+        with np.errstate(invalid='ignore'):
+            offsets = np.clip(np.where(invalid, 0, (values - self.origin) / self.spacing), 0, self.size - 1)
+        lower = np.minimum(np.floor(offsets), max(self.size - 2, 0)).astype(np.int64)
+        upper = np.minimum(lower + 1, self.size - 1)
+        weights = np.where(upper > lower, offsets - lower, 0.0)
+        return lower, upper, weights
+
+
+class GridGeometry(object):
+    """
+    Describes the horizontal model grid. Built once per data source and reused by every matchup lookup.
+    Regular grids are described by one AxisGeometry per axis; curvilinear grids (2-D latitude and longitude variables)
+    are looked up through a spatial index.
+    """
+
+    def __init__(self, lat_name, lat_values, lon_name, lon_values):
+        self.lat_name = lat_name
+        self.lon_name = lon_name
+        self.lat_values = lat_values
+        self.lon_values = lon_values
+        self.is_curvilinear = np.ndim(lat_values) > 1 or np.ndim(lon_values) > 1
+        if self.is_curvilinear:
+            self.lat = None
+            self.lon = None
+        else:
+            self.lat = AxisGeometry(lat_name, lat_values)
+            self.lon = AxisGeometry(lon_name, lon_values)
+        self.__spatial_index = None
+
+
+    def get_spatial_index(self):
+        if self.__spatial_index is None:
+            if self.is_curvilinear:
+                self.__spatial_index = SpatialIndex(self.lat_values, self.lon_values)
+            else:
+                lat_grid = ma.asarray(self.lat_values)[:, np.newaxis] + ma.zeros((1, self.lon.size))
+                lon_grid = ma.asarray(self.lon_values)[np.newaxis, :] + ma.zeros((self.lat.size, 1))
+                self.__spatial_index = SpatialIndex(lat_grid, lon_grid)
+        return self.__spatial_index
+
+
+    def find_positions(self, ref_lats, ref_lons, max_distance=None, use_spatial_index=False):
+        """
+        Returns the grid cells of the given positions. Curvilinear grids are always looked up through the spatial index.
+        @param max_distance: the maximum distance in km between position and cell centre; only considered by the
+        spatial index.
+        @param use_spatial_index: look up regular grids through the spatial index, too.
+        @return: a tuple (lat_indices, lon_indices, valid) of equally sized arrays.
+        """
+        if self.is_curvilinear or use_spatial_index:
+            (lat_indices, lon_indices), distances, valid = self.get_spatial_index().query(ref_lats, ref_lons, max_distance)
+            return lat_indices, lon_indices, valid
+        lat_indices, lat_valid = self.lat.find_indices(ref_lats)
+        lon_indices, lon_valid = self.lon.find_indices(ref_lons)
+        return lat_indices, lon_indices, lat_valid & lon_valid
+
+
+    def find_brackets(self, ref_lats, ref_lons):
+        """
+        Returns the grid cells enclosing the given positions, for bilinear interpolation; not supported for
+        curvilinear grids.
+        @return: a tuple (lat_brackets, lon_brackets), each as returned by AxisGeometry.find_brackets.
+        """
+        if self.is_curvilinear:
+            raise ValueError('Unable to interpolate bilinearly on a curvilinear grid.')
+        return self.lat.find_brackets(ref_lats), self.lon.find_brackets(ref_lons)
+
+
+    def get_extent(self):
+        """
+        Returns the extent of the grid as tuple (lat_min, lat_max, lon_min, lon_max). The extent of regular grids
+        includes the outer half of the border cells; that of curvilinear grids ends at the border cell centres.
+        """
+        if self.is_curvilinear:
+            extent = []
+            for values in (self.lat_values, self.lon_values):
+                data, invalid = split_masked(values)
+                extent.extend([np.min(data[~invalid]), np.max(data[~invalid])])
+            return tuple(extent)
+        return self.lat.get_extent() + self.lon.get_extent()
+
+
+    def get_coordinates(self, lat_indices, lon_indices):
+        """
+        Returns the latitudes and longitudes of the given grid cells.
+        """
+        if self.is_curvilinear:
+            return self.lat_values[lat_indices, lon_indices], self.lon_values[lat_indices, lon_indices]
+        return self.lat_values[lat_indices], self.lon_values[lon_indices]
+
+
+class NearestValidCellMap(object):
+    """
+    Maps every cell of the horizontal model grid to its nearest valid cell in index space, such as the nearest sea
+    cell of a land cell. Computed once by a Euclidean distance transform of the invalid cells, so that looking up the
+    nearest valid cell of any number of cells is a single gather.
+    """
+
+    def __init__(self, invalid_cells):
+        self.invalid_cells = np.asarray(invalid_cells, dtype=bool)
+        self.has_valid_cells = not np.all(self.invalid_cells)
+        if self.has_valid_cells:
+            self.__nearest_cells = distance_transform_edt(self.invalid_cells, return_distances=False, return_indices=True)
+
+
+    def find_nearest_valid_cells(self, lat_indices, lon_indices):
+        """
+        Returns the nearest valid cells of the given cells; valid cells are their own nearest valid cells.
+        @return: a tuple (lat_indices, lon_indices) of the nearest valid cells.
+        """
+        if not self.has_valid_cells:
+            return lat_indices, lon_indices
+        return self.__nearest_cells[0][lat_indices, lon_indices], self.__nearest_cells[1][lat_indices, lon_indices]
+
+
+def create_nearest_valid_cell_map(data):
+    """
+    Creates the map of nearest valid cells of the grid of the given data. Cells are invalid if all model variables
+    are masked or NaN. The land-sea mask is assumed not to change over time and depth: only the first time step and
+    depth level, i.e. index 0 of each dimension before latitude and longitude, is read. Variables whose last two
+    dimensions are not the horizontal dimensions of the grid are not considered, nor are the latitude and longitude
+    variables of curvilinear grids, which are never masked.
+    """
+    horizontal_dimensions = find_horizontal_dimensions(data)
+    invalid_cells = None
+    for variable_name in data.model_vars():
+        dimensions = tuple(data.get_model_dimensions(variable_name))
+        if dimensions[-2:] != horizontal_dimensions:
+            continue
+        if len(dimensions) > 2:
+            values = data.read_model_time_slices(variable_name, np.array([0]))
+        else:
+            values = data.read_model(variable_name)
+        values = values.reshape((-1,) + values.shape[-2:])[0]
+        invalid = ma.getmaskarray(ma.masked_invalid(values))
+        invalid_cells = invalid if invalid_cells is None else invalid_cells & invalid
+    return NearestValidCellMap(invalid_cells)
+
+
+def find_horizontal_dimensions(data):
+    """
+    Returns the names of the latitude and longitude dimensions of the model grid, in the order of the model variables:
+    the dimensions of the latitude and longitude variables for rectilinear grids, and their common two dimensions for
+    curvilinear grids.
+    """
+    dimensions = []
+    for variable_name in (data.find_model_latitude_variable_name(), data.find_model_longitude_variable_name()):
+        dimensions.extend(name for name in data.get_model_dimensions(variable_name) if name not in dimensions)
+    return tuple(dimensions)
+
+
+def create_grid_geometry(data):
+    lat_name = data.find_model_latitude_variable_name()
+    lon_name = data.find_model_longitude_variable_name()
+    return GridGeometry(lat_name, data.read_model(lat_name), lon_name, data.read_model(lon_name))
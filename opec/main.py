@@ -28,11 +28,9 @@ from opec import processor, get_logging_formatter, utils
 from opec.configuration import Configuration
 from opec.matchup_engine import MatchupEngine
 from opec.data import Data
+from opec.memory import MemoryTracker, log_memory
 from opec.output import Output
 
-if not os.name == 'nt':
-    import resource
-
 
 class VariableMappingsParseAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
@@ -78,7 +76,8 @@ def parse_arguments(arguments):
     parser.add_argument('-p', '--prefix', help='Target prefix', metavar='')
     parser.add_argument('-v', '--variable_mappings', help='A list of variable mappings <var>:<ref_var>', metavar='',
                         nargs='+', action=VariableMappingsParseAction)
-    parser.add_argument('-r', '--reference_file', help='An optional file containing the reference data', metavar='')
+    parser.add_argument('-r', '--reference_file', help='Optional files or glob patterns containing the reference data', metavar='',
+                        nargs='+')
     return parser.parse_args(arguments)
 
 
@@ -89,7 +88,7 @@ def ref_stddev(statistics):
 def create_zip(target_files, config, file_handler, parsed_args):
     files_to_remove = []
     zipfile = ZipFile('%s/%sbenchmarks.zip' % (parsed_args.output_dir, config.target_prefix), 'w')
-    logging.info('Creating zip file: %s' % zipfile.filename)
+    logging.info('Creating zip file: %s', zipfile.filename)
     for file in target_files:
         zipfile.write(file, os.path.basename(file))
         files_to_remove.append(file)
@@ -105,9 +104,33 @@ def create_zip(target_files, config, file_handler, parsed_args):
         os.remove(file)
 
 
+def extract_batch_values(matchup_engine, data, config, variable_mappings):
+    """
+    Finds the matchups batch by batch and extracts the values of the variable mappings with one-dimensional reference
+    variables from each batch, keeping only the pairs of valid values.
+    @return: a tuple (values, matchup_count), where values maps each tuple (model_name, ref_name) to a tuple
+    (reference_values, model_values).
+    """
+    if config.super_observations:
+        raise ValueError('Unable to compute super-observations batch by batch; set opec.matchup.batch_size to None.')
+    mappings = [(model_name, ref_name) for model_name, ref_name in variable_mappings if len(data.get_reference_dimensions(ref_name)) == 1]
+    matchup_count = 0
+
+    def batches():
+        nonlocal matchup_count
+        for matchups in matchup_engine.iter_matchups(config.batch_size):
+            if config.remove_empty_matchups:
+                matchups = matchup_engine.remove_empty_matchups(matchups)
+            matchup_count += len(matchups)
+            yield matchups
+
+    values = utils.extract_values_from_batches(batches(), data, [(ref_name, model_name) for model_name, ref_name in mappings], True)
+    return dict(zip(mappings, values)), matchup_count
+
+
 def log_warning(msg, category, filename, lineno, file=None, line=None):
     msg = msg.args[0].replace('Warning: converting a masked element to nan.', 'converting a masked element to nan')
-    logging.warn('%s in %s:%s' % (msg, filename, lineno))
+    logging.warn('%s in %s:%s', msg, filename, lineno)
 
 #noinspection PyUnboundLocalVariable
 def setup_logging(config):
@@ -129,27 +152,39 @@ def main():
     config = Configuration(properties_file_name=parsed_args.config, target_dir=parsed_args.output_dir,
                            target_prefix=parsed_args.prefix)
     file_handler = setup_logging(config)
+    memory_tracker = MemoryTracker()
+    memory_tracker.start('matchups')
     if parsed_args.reference_file is not None:
-        data = Data(parsed_args.path, parsed_args.reference_file, config.max_cache_size)
+        data = Data(parsed_args.path, parsed_args.reference_file, config.max_cache_size, config.max_open_files, config.cache_policy,
+                    config.use_mmap)
     else:
-        data = Data(parsed_args.path, max_cache_size=config.max_cache_size)
+        data = Data(parsed_args.path, max_cache_size=config.max_cache_size, max_open_files=config.max_open_files,
+                    cache_policy=config.cache_policy, use_mmap=config.use_mmap)
 
     output = Output(config=config)
 
     matchups = None
+    matchup_count = 0
+    batch_values = {}
     if data.has_one_dim_ref_var():
         me = MatchupEngine(data, config)
-        matchups = me.find_all_matchups()
-        if not matchups:
-            logging.warning('No matchups found. System will exit.')
-            exit(0)
-        if config.remove_empty_matchups:
-            matchups = me.remove_empty_matchups(matchups)
+        if config.batch_size is None:
+            matchups = me.find_all_matchups()
+            if not matchups:
+                logging.warning('No matchups found. System will exit.')
+                exit(0)
+            if config.remove_empty_matchups:
+                matchups = me.remove_empty_matchups(matchups)
+            matchup_count = len(matchups)
+        else:
+            batch_values, matchup_count = extract_batch_values(me, data, config, parsed_args.variable_mappings)
+            if matchup_count == 0:
+                logging.warning('No matchups found. System will exit.')
+                exit(0)
 
-    if not os.name == 'nt':
-        logging.debug('Memory after matchups have been found: %s' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    log_memory('Memory after matchups have been found')
+    memory_tracker.start('statistics')
 
-    matchup_count = 0 if matchups is None else len(matchups)
     collected_statistics = {}
     density_plot_files = []
     target_files = []
@@ -161,38 +196,39 @@ def main():
         if is_gridded:
             reference_values, model_values = data.get_values(ref_name, model_name)
             matchup_count += ma.count(reference_values)
+        elif (model_name, ref_name) in batch_values:
+            reference_values, model_values = batch_values[(model_name, ref_name)]
         else:
             reference_values, model_values = utils.extract_values(matchups, data, ref_name, model_name)
             reference_values, model_values = utils.harmonise(reference_values, model_values)
-            logging.debug('Compressing ref-variable %s' % ref_name)
+            logging.debug('Compressing ref-variable %s', ref_name)
             reference_values = reference_values.compressed()
-            logging.debug('Compressing model-variable %s' % model_name)
+            logging.debug('Compressing model-variable %s', model_name)
             model_values = model_values.compressed()
 
-        logging.info('Calculating statistics for \'%s\' with \'%s\'' % (model_name, ref_name))
+        logging.info('Calculating statistics for \'%s\' with \'%s\'', model_name, ref_name)
         stats = processor.calculate_statistics(model_values, reference_values, model_name, ref_name, unit, config)
         collected_statistics[(model_name, ref_name)] = stats
 
         if config.write_density_plots:
             axis_min = min(stats['min'], stats['ref_min'])
             axis_max = max(stats['p90'], stats['ref_p90'])
-            logging.info('Creating density plot for \'%s\' and \'%s\'' % (model_name, ref_name))
+            logging.info('Creating density plot for \'%s\' and \'%s\'', model_name, ref_name)
             density_plots[model_name + ref_name] = output.density_plot(model_name, ref_name, model_values,
                                                                        reference_values, config.density_plot_log_scaled,
                                                                        None, axis_min, axis_max, data.unit(model_name))
 
-    if not os.name == 'nt':
-        logging.debug(
-            'Memory after statistics have been computed: %s' % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    log_memory('Memory after statistics have been computed')
+    memory_tracker.start('output')
 
     if config.write_csv:
         csv_target_file = '%s/%sstatistics.csv' % (parsed_args.output_dir, config.target_prefix)
         target_files.append(csv_target_file)
         output.csv(data, parsed_args.variable_mappings, collected_statistics, matchup_count, matchups=matchups, source_file=parsed_args.path, target_file=csv_target_file)
-        logging.info('CSV output written to \'%s\'' % csv_target_file)
+        logging.info('CSV output written to \'%s\'', csv_target_file)
         if matchups is not None:
             matchup_filename = '%s_matchups.csv' % os.path.splitext(csv_target_file)[0]
-            logging.info('Matchups written to \'%s\'' % matchup_filename)
+            logging.info('Matchups written to \'%s\'', matchup_filename)
             target_files.append(matchup_filename)
 
     taylor_target_files = []
@@ -202,7 +238,7 @@ def main():
         del d
         if written_taylor_diagrams:
             for written_taylor_diagram in written_taylor_diagrams:
-                logging.info('Taylor diagram written to \'%s\'' % written_taylor_diagram)
+                logging.info('Taylor diagram written to \'%s\'', written_taylor_diagram)
                 target_files.append(written_taylor_diagram)
                 taylor_target_files.append(written_taylor_diagram)
 
@@ -212,13 +248,13 @@ def main():
             density_plot_files.append(density_target)
             target_files.append(density_target)
             output.write_density_plot(density_plots[model_name + ref_name], density_target)
-            logging.info('Density plot written to \'%s\'' % density_target)
+            logging.info('Density plot written to \'%s\'', density_target)
 
     target_diagram_file = None
     if config.write_target_diagram:
         target_diagram_file = '%s/%starget.png' % (parsed_args.output_dir, config.target_prefix)
         output.target_diagram(list(collected_statistics.values()), target_diagram_file)
-        logging.info('Target diagram written to \'%s\'' % target_diagram_file)
+        logging.info('Target diagram written to \'%s\'', target_diagram_file)
         target_files.append(target_diagram_file)
 
     if config.write_xhtml:
@@ -230,11 +266,11 @@ def main():
         css_target = '%s/%s' % (parsed_args.output_dir, os.path.basename(css))
         output.xhtml(list(collected_statistics.values()), matchup_count, matchups, data, xml_target_file, taylor_target_files,
                      target_diagram_file, density_plot_files)
-        logging.info('XHTML report written to \'%s\'' % xml_target_file)
+        logging.info('XHTML report written to \'%s\'', xml_target_file)
         shutil.copy(xsl, parsed_args.output_dir)
-        logging.info('XHTML support file written to \'%s/%s\'' % (parsed_args.output_dir, 'analysis-summary.xsl'))
+        logging.info('XHTML support file written to \'%s/%s\'', parsed_args.output_dir, 'analysis-summary.xsl')
         shutil.copy(css, parsed_args.output_dir)
-        logging.info('XHTML support file written to \'%s/%s\'' % (parsed_args.output_dir, 'styleset.xsl'))
+        logging.info('XHTML support file written to \'%s/%s\'', parsed_args.output_dir, 'styleset.xsl')
         target_files.append(xml_target_file)
         target_files.append(xsl_target)
         target_files.append(css_target)
@@ -242,6 +278,9 @@ def main():
     if config.zip:
         create_zip(target_files, config, file_handler, parsed_args)
 
+    data.close()
+    memory_tracker.stop()
+    memory_tracker.log_summary()
     logging.info('End of process')
 
 
@@ -11,6 +11,11 @@
 #
 # You should have received a copy of the GNU General Public License along
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import numpy as np
+import numpy.ma as ma
+
+from opec.extraction import aggregate, find_groups, group_statistics, interpolate, window_statistics
+from opec.reference_records_finder import ReferenceRecord
 from opec.utils import retrieve_origin
 
 class Matchup(object):
@@ -60,3 +65,374 @@ class Matchup(object):
     spacetime_position = property(get_spacetime_position)
     reference_record = property(get_reference_record)
 
+
+class MatchupSet(object):
+    """
+    Column-oriented collection of matchups. Each column holds one value per matchup; columns referring to a dimension
+    the model does not have (or coordinates the reference data does not have) are None. 'Matchup' objects are only
+    created on demand, e.g. when iterating.
+    """
+
+    CELL_INDEX_COLUMNS = ('time_index', 'depth_index', 'lat_index', 'lon_index')
+    SPACETIME_COLUMNS = ('time', 'depth', 'lat', 'lon')
+    REFERENCE_COLUMNS = ('ref_time', 'ref_depth', 'ref_lat', 'ref_lon')
+    # further columns: 'record_number'; 'distance', the great-circle distance in km between reference position and
+    # model cell centre; 'time_window_start' and 'time_window_stop', the range of model time steps aggregated per matchup;
+    # 'lat_offset' and 'lon_offset', the offsets in cells of nearest valid cells replacing invalid matchup cells
+    # suffixes of the columns of a dimension along which model values are interpolated, prefixed by the dimension name
+    BRACKET_SUFFIXES = ('_lower_index', '_upper_index', '_weight')
+
+    def __init__(self, columns, time_aggregation=None, window_size=1, window_min_valid=0.0, time_slice_window=None,
+                 super_observations=False):
+        """
+        @param columns: dictionary of column name to array or None.
+        @param time_aggregation: the reduction of model values over the time windows, either 'mean' or 'median'; if
+        None, model values are taken from single time steps.
+        @param window_size: the edge length in cells of the window centred on the matchup cell whose mean is taken as
+        model value; 1 takes the value of the matchup cell itself.
+        @param window_min_valid: the minimum fraction of valid cells of a window for its mean to be valid.
+        @param time_slice_window: if not None, model values are read by sweeping the matchups in time order, holding
+        at most this many model time slices in memory; if None, model variables are read fully.
+        @param super_observations: if True, statistics are computed from super-observations, i.e. the values of the
+        matchups sharing a model cell averaged per cell, rather than from single matchups.
+        """
+        self.__columns = columns
+        self.__size = len(columns['record_number'])
+        self.time_aggregation = time_aggregation
+        self.window_size = window_size
+        self.window_min_valid = window_min_valid
+        self.time_slice_window = time_slice_window
+        self.super_observations = super_observations
+
+
+    def get_column(self, name):
+        return self.__columns.get(name)
+
+
+    def get_columns(self):
+        return dict(self.__columns)
+
+
+    def get_settings(self):
+        """
+        Returns the settings determining how model values are extracted, as keyword arguments to the constructor.
+        """
+        return {'time_aggregation': self.time_aggregation, 'window_size': self.window_size, 'window_min_valid': self.window_min_valid,
+                'time_slice_window': self.time_slice_window, 'super_observations': self.super_observations}
+
+
+    def get_record_numbers(self):
+        return self.__columns['record_number']
+
+
+    def get_cell_indices(self):
+        """
+        Returns the tuple of cell index arrays of all dimensions the model has, usable for fancy indexing model arrays.
+        """
+        return tuple(self.__columns[name] for name in MatchupSet.CELL_INDEX_COLUMNS if self.__columns.get(name) is not None)
+
+
+    def get_brackets(self, dimension):
+        """
+        Returns the tuple (lower_indices, upper_indices, weights) model values are interpolated with along the given
+        dimension, or None if the nearest cell is used along it.
+        """
+        if self.__columns.get(dimension + '_weight') is None:
+            return None
+        return tuple(self.__columns[dimension + suffix] for suffix in MatchupSet.BRACKET_SUFFIXES)
+
+
+    def set_brackets(self, dimension, brackets):
+        for suffix, column in zip(MatchupSet.BRACKET_SUFFIXES, brackets):
+            self.__columns[dimension + suffix] = column
+
+
+    def is_interpolated(self):
+        return any(self.get_brackets(dimension) is not None for dimension in MatchupSet.SPACETIME_COLUMNS)
+
+
+    def get_matchup(self, index):
+        if index < 0:
+            index += self.__size
+        if index < 0 or index >= self.__size:
+            raise IndexError('Matchup index %s out of range' % index)
+        cell_position = [self.__item(name, index, int) for name in MatchupSet.CELL_INDEX_COLUMNS]
+        spacetime_position = [self.__item(name, index) for name in MatchupSet.SPACETIME_COLUMNS]
+        ref_time, ref_depth, ref_lat, ref_lon = [self.__item(name, index) for name in MatchupSet.REFERENCE_COLUMNS]
+        reference_record = ReferenceRecord(int(self.get_record_numbers()[index]), ref_lat, ref_lon, ref_time, ref_depth)
+        return Matchup(cell_position, spacetime_position, reference_record)
+
+
+    def filter(self, selection):
+        """
+        Returns a new matchup set containing the matchups selected by the given slice, boolean mask, or index array.
+        """
+        columns = {}
+        for name, column in self.__columns.items():
+            columns[name] = None if column is None else column[selection]
+        return MatchupSet(columns, **self.get_settings())
+
+
+    def get_model_values(self, variable_name, data):
+        """
+        Returns the values of the given model variable at all matchup cells as masked array; interpolated along the
+        dimensions the matchups have brackets for, and aggregated over the time windows if the matchups have them.
+        """
+        if self.window_size > 1:
+            return self.get_window_model_values(self.get_window_statistics(variable_name, data))
+        if self.get_time_windows() is not None:
+            return self.__aggregate_in_time(variable_name, data)
+        if self.__is_swept_in_time():
+            return self.__sweep_in_time(variable_name, data, self.__positions())
+        if not self.is_interpolated():
+            return data.gather(variable_name, self.get_cell_indices())
+        return interpolate(data.get_gather_view(variable_name), self.__positions())
+
+
+    def get_window_statistics(self, variable_name, data):
+        """
+        Returns statistics of the values of the given model variable in the window_size × window_size cells centred on
+        the matchup cells. The values of all windows are gathered at once; cells outside the grid are left out, so that
+        the valid fraction of a window at the grid edge refers to its cells inside the grid.
+        @return: a dictionary of arrays with one value per matchup: 'mean' and 'stddev' (masked where a window has no
+        valid cell), 'count' (of valid cells), 'valid_fraction' and 'centre', the value of the matchup cell itself.
+        """
+        lat_size, lon_size = [data.model_dim_size(name) for name in data.get_model_dimensions(variable_name)[-2:]]
+        offsets = np.arange(self.window_size) - self.window_size // 2
+        lat_offsets, lon_offsets = [o.ravel() for o in np.meshgrid(offsets, offsets, indexing='ij')]
+        lat_indices = self.__columns['lat_index'][:, np.newaxis] + lat_offsets
+        lon_indices = self.__columns['lon_index'][:, np.newaxis] + lon_offsets
+        outside = (lat_indices < 0) | (lat_indices >= lat_size) | (lon_indices < 0) | (lon_indices >= lon_size)
+
+        # the windows replace horizontal brackets; positions in time and depth are broadcast over the window cells
+        positions = []
+        for position in self.__positions()[:-2]:
+            if isinstance(position, tuple):
+                positions.append(tuple(column[:, np.newaxis] for column in position))
+            else:
+                positions.append(position[:, np.newaxis])
+        positions.append(np.clip(lat_indices, 0, lat_size - 1))
+        positions.append(np.clip(lon_indices, 0, lon_size - 1))
+        if self.__is_swept_in_time():
+            window_values = self.__sweep_in_time(variable_name, data, positions)
+        else:
+            window_values = interpolate(data.get_gather_view(variable_name), positions)
+        statistics = window_statistics(ma.array(window_values, mask=ma.getmaskarray(window_values) | outside),
+                                       np.count_nonzero(~outside, axis=1))
+        statistics['centre'] = window_values[:, (self.window_size * self.window_size) // 2]
+        return statistics
+
+
+    def get_window_model_values(self, statistics):
+        """
+        Returns the model values of the matchups given their window statistics: the window mean where at least
+        window_min_valid of the window cells are valid, such as away from land, and the value of the matchup cell
+        itself elsewhere.
+        @param statistics: as returned by get_window_statistics.
+        """
+        is_window_valid = ~ma.getmaskarray(statistics['mean']) & (statistics['valid_fraction'] >= self.window_min_valid)
+        return ma.where(is_window_valid, statistics['mean'], statistics['centre'])
+
+
+    def get_time_windows(self):
+        """
+        Returns the tuple (start_indices, stop_indices) of the model time steps aggregated per matchup, or None if
+        model values are not aggregated in time.
+        """
+        if self.time_aggregation is None or self.__columns.get('time_window_start') is None:
+            return None
+        return self.__columns['time_window_start'], self.__columns['time_window_stop']
+
+
+    def set_time_windows(self, start_indices, stop_indices, time_aggregation):
+        self.__columns['time_window_start'] = start_indices
+        self.__columns['time_window_stop'] = stop_indices
+        self.time_aggregation = time_aggregation
+
+
+    def __aggregate_in_time(self, variable_name, data):
+        if self.__size == 0:
+            return ma.array(np.zeros(0), mask=np.zeros(0, dtype=bool))
+        start_indices, stop_indices = [ma.getdata(column) for column in self.get_time_windows()]
+        window_lengths = np.maximum(stop_indices - start_indices, 0)
+        window_offsets = np.concatenate(([0], np.cumsum(window_lengths)))
+        # gather exactly the time steps of each matchup's own window at once, one window after the other
+        matchup_indices = np.repeat(np.arange(self.__size), window_lengths)
+        positions = []
+        for position in self.__positions():
+            if isinstance(position, tuple):
+                positions.append(tuple(column[matchup_indices] for column in position))
+            else:
+                positions.append(position[matchup_indices])
+        positions[0] = np.arange(window_offsets[-1]) - window_offsets[matchup_indices] + start_indices[matchup_indices]
+        values = interpolate(data.get_gather_view(variable_name), positions)
+        return aggregate(values, window_offsets, self.time_aggregation)
+
+
+    def __is_swept_in_time(self):
+        return self.time_slice_window is not None and self.__columns.get('time_index') is not None and self.__size > 0
+
+
+    def __sweep_in_time(self, variable_name, data, positions):
+        """
+        Reads the values of the given model variable at the given positions, visiting the matchups in time order. The
+        matchups are processed in groups spanning at most time_slice_window model time slices; slices still needed by
+        the next group are kept, all others are released, so that memory does not grow with the number of time steps.
+        @param positions: as for 'interpolate', with the matchups along the first axis of all index arrays.
+        """
+        time_position = positions[0]
+        is_bracketed = isinstance(time_position, tuple)
+        # time positions may be broadcast over further axes, but are the same for all values of a matchup
+        lower_indices = ma.getdata(time_position[0] if is_bracketed else time_position).reshape(self.__size, -1)[:, 0]
+        upper_indices = ma.getdata(time_position[1]).reshape(self.__size, -1)[:, 0] if is_bracketed else lower_indices
+        order = np.argsort(lower_indices, kind='stable')
+        sorted_lower_indices = lower_indices[order]
+        lower_times = np.unique(sorted_lower_indices)
+        # each group of lower time indices may need as many upper time indices
+        group_size = max(1, self.time_slice_window // 2) if is_bracketed else self.time_slice_window
+        is_interpolated = any(isinstance(position, tuple) for position in positions)
+
+        window = {}
+        result = None
+        for group_start in range(0, len(lower_times), group_size):
+            group_times = lower_times[group_start:group_start + group_size]
+            first = np.searchsorted(sorted_lower_indices, group_times[0], side='left')
+            last = np.searchsorted(sorted_lower_indices, group_times[-1], side='right')
+            selection = order[first:last]
+            time_indices = np.unique(np.concatenate((lower_indices[selection], upper_indices[selection])))
+            window = {time_index: window[time_index] for time_index in time_indices.tolist() if time_index in window}
+            missing = [time_index for time_index in time_indices.tolist() if time_index not in window]
+            if missing:
+                for time_index, time_slice in zip(missing, data.read_model_time_slices(variable_name, np.array(missing))):
+                    window[time_index] = time_slice
+            values = ma.array([window[time_index] for time_index in time_indices.tolist()])
+
+            group_positions = []
+            for position in positions:
+                if isinstance(position, tuple):
+                    group_positions.append(tuple(column[selection] for column in position))
+                else:
+                    group_positions.append(position[selection])
+            if is_bracketed:
+                lower, upper, weights = group_positions[0]
+                group_positions[0] = (np.searchsorted(time_indices, lower), np.searchsorted(time_indices, upper), weights)
+            else:
+                group_positions[0] = np.searchsorted(time_indices, group_positions[0])
+            if is_interpolated:
+                group_values = interpolate(values, group_positions)
+            else:
+                group_values = values[tuple(group_positions)]
+            if result is None:
+                result = ma.masked_all((self.__size,) + group_values.shape[1:], dtype=group_values.dtype)
+            result[selection] = group_values
+        return result
+
+
+    def __positions(self):
+        positions = []
+        for dimension, index_column in zip(MatchupSet.SPACETIME_COLUMNS, MatchupSet.CELL_INDEX_COLUMNS):
+            if self.__columns.get(index_column) is None:
+                continue
+            brackets = self.get_brackets(dimension)
+            positions.append(self.__columns[index_column] if brackets is None else brackets)
+        return positions
+
+
+    def get_cell_groups(self):
+        """
+        Groups the matchups by their model cell, i.e. by their tuple of cell indices.
+        @return: a tuple (group_indices, first_indices): the group of each matchup and the first matchup of each group.
+        """
+        return find_groups(self.get_cell_indices())
+
+
+    def get_super_observations(self, ref_name, model_name, data):
+        """
+        Returns the values of the given reference and model variables aggregated per model cell. Matchups whose
+        reference or model value is invalid are left out.
+        @return: a tuple (reference_statistics, model_statistics) of dictionaries of arrays with one value per model
+        cell: 'mean' and 'stddev' (masked where a cell has no valid matchup) and 'count' (of valid matchups).
+        """
+        reference_values = ma.array(self.get_ref_values(ref_name, data), dtype=np.float64)
+        model_values = ma.array(self.get_model_values(model_name, data), dtype=np.float64)
+        invalid = ma.getmaskarray(reference_values) | ma.getmaskarray(model_values)
+        group_indices, first_indices = self.get_cell_groups()
+        reference_statistics = group_statistics(ma.array(reference_values, mask=invalid), group_indices, len(first_indices))
+        model_statistics = group_statistics(ma.array(model_values, mask=invalid), group_indices, len(first_indices))
+        return reference_statistics, model_statistics
+
+
+    def get_ref_values(self, variable_name, data):
+        """
+        Returns the values of the given reference variable for all matchups as masked array.
+        """
+        reference_dimensions = data.get_reference_dimensions(variable_name)
+        if len(reference_dimensions) == 1:
+            record_numbers = self.get_record_numbers()
+            start = int(record_numbers.min()) if self.__size > 0 else 0
+            stop = int(record_numbers.max()) + 1 if self.__size > 0 else 0
+            return data.read_reference_slice(variable_name, start, stop)[record_numbers - start]
+        columns = dict(self.__columns)
+        if columns.get('ref_time') is None:
+            columns['time_index'] = None
+        if columns.get('ref_depth') is None:
+            columns['depth_index'] = None
+        origin = tuple(columns[name] for name in MatchupSet.CELL_INDEX_COLUMNS if columns.get(name) is not None)
+        return data.read_reference(variable_name)[origin]
+
+
+    def __item(self, name, index, converter=None):
+        column = self.__columns.get(name)
+        if column is None:
+            return None
+        if converter is not None:
+            return converter(column[index])
+        return column[index]
+
+
+    def __len__(self):
+        return self.__size
+
+
+    def __iter__(self):
+        for index in range(self.__size):
+            yield self.get_matchup(index)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.get_matchup(key)
+        return self.filter(key)
+
+
+    def __str__(self):
+        return 'MatchupSet of %s matchups with columns %s' % (self.__size, ', '.join(sorted(self.__columns.keys())))
+
+
+    columns = property(get_columns)
+    settings = property(get_settings)
+    record_numbers = property(get_record_numbers)
+
+
+def create_matchup_set(matchups):
+    """
+    Returns the given matchups as 'MatchupSet'; lists of 'Matchup' objects are converted.
+    """
+    if isinstance(matchups, MatchupSet):
+        return matchups
+    columns = {'record_number': np.array([m.reference_record.record_number for m in matchups], dtype=np.int64)}
+    for index, name in enumerate(MatchupSet.CELL_INDEX_COLUMNS):
+        columns[name] = to_column([m.cell_position[index] for m in matchups], np.int64)
+    for index, name in enumerate(MatchupSet.SPACETIME_COLUMNS):
+        columns[name] = to_column([m.spacetime_position[index] for m in matchups])
+    for name, attribute in zip(MatchupSet.REFERENCE_COLUMNS, ('time', 'depth', 'lat', 'lon')):
+        columns[name] = to_column([m.reference_record.__getattribute__(attribute) for m in matchups])
+    return MatchupSet(columns)
+
+
+def to_column(values, dtype=None):
+    if not values or values[0] is None:
+        return None
+    if dtype is not None:
+        return np.array(values, dtype=dtype)
+    return ma.array(values)
@@ -0,0 +1,151 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+
+import numpy as np
+import numpy.ma as ma
+
+from opec.matchup import MatchupSet
+
+# version of the stored columns; to be increased whenever the columns of matchup sets change
+FORMAT_VERSION = 3
+
+# the configuration properties that determine which matchups are found
+MATCHUP_CRITERIA = ['time_delta', 'depth_delta', 'spatial_index', 'max_distance', 'interpolation', 'time_depth_interpolation',
+                    'time_aggregation', 'window_size', 'window_min_valid',
+                    'valid_cell_search_radius', 'prefilter_records', 'prefilter_tolerance', 'trajectory_mode',
+                    'trajectory_time_slices', 'super_observations']
+
+
+class MatchupCache(object):
+    """
+    Persistent store of matchups, one .npz file per combination of input files and matchup criteria.
+    Entries are evicted least recently used first when the cache exceeds max_size, and when older than max_age.
+    """
+
+    def __init__(self, directory, max_size=None, max_age=None):
+        """
+        @param directory: the cache directory; created if missing.
+        @param max_size: the maximum total size of all entries in MB; if None, size is not limited.
+        @param max_age: the maximum time in days an entry is kept without being used; if None, age is not limited.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+
+    def create_key(self, data, config, ref_columns):
+        """
+        Returns the cache key for the given data, configuration and reference coordinate columns. The key is derived
+        from path, size and modification time of the input files, checksums of model and reference coordinates, and
+        the matchup criteria of the configuration.
+        """
+        fingerprint = ['format=%s' % FORMAT_VERSION]
+        for file_name in data.get_file_names():
+            status = os.stat(file_name)
+            fingerprint.append('%s:%s:%s' % (os.path.abspath(file_name), status.st_size, status.st_mtime_ns))
+        grid_geometry = data.get_grid_geometry()
+        coordinates = [grid_geometry.lat_values, grid_geometry.lon_values]
+        for dimension in ('time', 'depth'):
+            if data.has_model_dimension(dimension):
+                coordinates.append(data.read_model(dimension))
+        coordinates.extend(ref_columns)
+        for values in coordinates:
+            fingerprint.append('-' if values is None else str(checksum(values)))
+        for name in MATCHUP_CRITERIA:
+            fingerprint.append('%s=%s' % (name, config.__getattribute__(name)))
+        return hashlib.sha1('|'.join(fingerprint).encode('utf-8')).hexdigest()
+
+
+    def load(self, key):
+        """
+        Returns the matchups stored under the given key, or None.
+        """
+        file_name = self.__file_name(key)
+        if not os.path.exists(file_name):
+            return None
+        with np.load(file_name) as stored:
+            columns = dict((name, None) for name in stored['none_columns'])
+            for name in stored['columns']:
+                columns[name] = ma.array(stored['data_' + name], mask=stored['mask_' + name])
+            for name in stored['columns']:
+                if name == 'record_number' or name.endswith('_index'):
+                    columns[name] = ma.getdata(columns[name])
+            settings = json.loads(str(stored['settings']))
+        os.utime(file_name)
+        logging.debug('Loaded matchups from cache file \'%s\'', file_name)
+        return MatchupSet(columns, **settings)
+
+
+    def store(self, key, matchups):
+        """
+        Stores the given matchups under the given key and evicts entries exceeding the cache limits.
+        """
+        arrays = {'columns': [], 'none_columns': [], 'settings': json.dumps(matchups.settings)}
+        for name, column in matchups.columns.items():
+            if column is None:
+                arrays['none_columns'].append(name)
+                continue
+            arrays['columns'].append(name)
+            arrays['data_' + name] = ma.getdata(column)
+            arrays['mask_' + name] = ma.getmaskarray(column)
+        arrays['columns'] = np.array(arrays['columns'], dtype=str)
+        arrays['none_columns'] = np.array(arrays['none_columns'], dtype=str)
+
+        file_name = self.__file_name(key)
+        temp_file_name = '%s.%s.tmp' % (file_name, os.getpid())
+        with open(temp_file_name, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(temp_file_name, file_name)
+        logging.debug('Stored matchups in cache file \'%s\'', file_name)
+        self.evict()
+
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.npz'):
+                file_name = os.path.join(self.directory, name)
+                status = os.stat(file_name)
+                entries.append((status.st_mtime, status.st_size, file_name))
+        entries.sort()
+
+        now = time.time()
+        total_size = sum(entry[1] for entry in entries)
+        for last_used, size, file_name in entries:
+            is_stale = self.max_age is not None and now - last_used > self.max_age * 24 * 3600
+            is_too_big = self.max_size is not None and total_size > self.max_size * 1024 * 1024
+            if not is_stale and not is_too_big:
+                continue
+            logging.debug('Evicting matchup cache file \'%s\'', file_name)
+            os.remove(file_name)
+            total_size -= size
+
+
+    def __file_name(self, key):
+        return os.path.join(self.directory, 'matchups_%s.npz' % key)
+
+
+def checksum(values):
+    data = np.ascontiguousarray(ma.getdata(values))
+    mask = np.ascontiguousarray(ma.getmaskarray(values))
+    return zlib.crc32(mask.tobytes(), zlib.crc32(data.tobytes()))
@@ -12,14 +12,27 @@
 # You should have received a copy of the GNU General Public License along
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
 
+from concurrent.futures import ProcessPoolExecutor
 import logging
-from math import fabs, floor
+from math import floor
+from multiprocessing.shared_memory import SharedMemory
 
 import numpy as np
+import numpy.ma as ma
 
 from opec.configuration import get_default_config
-from opec.matchup import Matchup
+from opec.coordinate_index import CoordinateIndex
+from opec.matchup import Matchup, MatchupSet, create_matchup_set
+from opec.matchup_cache import MatchupCache
 from opec.reference_records_finder import ReferenceRecordsFinder
+from opec.spatial_index import haversine_distance
+from opec.utils import split_masked
+
+# number of chunks per worker process the reference records are split into when finding matchups in parallel
+CHUNKS_PER_WORKER = 4
+
+# number of reference records the matchups are found for at once when iterating over matchups
+DEFAULT_BATCH_SIZE = 100000
 
 
 class MatchupEngine(object):
@@ -27,27 +40,190 @@ class MatchupEngine(object):
     def __init__(self, data, configuration=None):
         self.data = data
         self.config = configuration if configuration is not None else get_default_config()
-        self.pixel_sizes = {}
+        self.coordinate_indices = {}
+        self.cell_finder = None
+
+
+    def find_all_matchups(self, worker_count=None):
+        """
+        Finds the matchups of all reference records.
+        @param worker_count: the number of worker processes to use; if None, the configured number is used.
+        @return: a 'MatchupSet'; the order of matchups does not depend on the number of workers.
+        """
+        if worker_count is None:
+            worker_count = self.config.worker_count
+        rrf = ReferenceRecordsFinder(self.data, self.config)
+        reference_records = rrf.find_reference_records()
 
+        cache = None
+        if self.config.cache_dir is not None:
+            cache = MatchupCache(self.config.cache_dir, self.config.cache_max_size, self.config.cache_max_age)
+            key = cache.create_key(self.data, self.config, reference_records.get_columns())
+            cached_matchups = cache.load(key)
+            if cached_matchups is not None:
+                logging.debug('Found %s cached matchups', len(cached_matchups))
+                return cached_matchups
 
-    def find_all_matchups(self):
-        rrf = ReferenceRecordsFinder(self.data)
-        reference_records = rrf.find_reference_records()
-        index = 0
-        all_matchups = []
-        for rr in reference_records:
-            index += 1
-            matchups = self.find_matchups(rr)
-            if index % 1000 == 0:
-                logging.debug('Found matchups for %s reference records so far' % index)
-                logging.debug('Found %s matchups so far' % len(all_matchups))
-            if matchups:
-                all_matchups.extend(matchups)
-
-        logging.debug('Found %s matchups' % len(all_matchups))
+        all_matchups = self.__find_all_matchups(reference_records, worker_count)
+        if cache is not None:
+            cache.store(key, all_matchups)
+
+        logging.debug('Found %s matchups', len(all_matchups))
         return all_matchups
 
 
+    def iter_matchups(self, batch_size=DEFAULT_BATCH_SIZE, worker_count=None):
+        """
+        Finds the matchups batch by batch, reading the coordinates of at most batch_size reference records at a time.
+        Unlike find_all_matchups, this keeps memory bounded by the batch size rather than by the number of records.
+        @param batch_size: the number of reference records per batch.
+        @param worker_count: the number of worker processes to use; if None, the configured number is used.
+        @return: a generator of non-empty 'MatchupSet's, together containing the same matchups as find_all_matchups.
+        """
+        if worker_count is None:
+            worker_count = self.config.worker_count
+        rrf = ReferenceRecordsFinder(self.data, self.config)
+        # the worker processes are started with the first batch needing them and reused for all further batches
+        executor = None
+        try:
+            for reference_records in rrf.iter_reference_records(batch_size):
+                if executor is None and worker_count > 1 and len(reference_records) > 1:
+                    executor = create_worker_pool(self.get_cell_finder(), worker_count)
+                matchups = self.__find_all_matchups(reference_records, worker_count, executor)
+                logging.debug('Found %s matchups for %s reference records', len(matchups), len(reference_records))
+                if len(matchups) > 0:
+                    yield matchups
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+
+    def __find_all_matchups(self, reference_records, worker_count, executor=None):
+        ref_lats, ref_lons, ref_times, ref_depths = reference_records.get_columns()
+        if worker_count > 1 and len(ref_lats) > 1:
+            logging.debug('Finding matchups using %s worker processes', worker_count)
+            cells = find_cells_in_parallel(self.get_cell_finder(), (ref_lats, ref_lons, ref_times, ref_depths), worker_count,
+                                           executor=executor)
+        else:
+            cells = self.find_matchup_cells(ref_lats, ref_lons, ref_times, ref_depths)
+        record_indices, time_indices, depth_indices, lat_indices, lon_indices = cells
+        lat_offsets = lon_offsets = None
+        if self.config.valid_cell_search_radius is not None:
+            lat_indices, lon_indices, lat_offsets, lon_offsets = self.__find_nearest_valid_cells(lat_indices, lon_indices,
+                select(ref_lats, record_indices), select(ref_lons, record_indices))
+
+        lat_values, lon_values = self.data.get_grid_geometry().get_coordinates(lat_indices, lon_indices)
+        columns = {
+            'record_number': reference_records.record_numbers[record_indices],
+            'time_index': time_indices,
+            'depth_index': depth_indices,
+            'lat_index': lat_indices,
+            'lon_index': lon_indices,
+            'time': self.__coordinate_values('time', time_indices),
+            'depth': self.__coordinate_values('depth', depth_indices),
+            'lat': lat_values,
+            'lon': lon_values,
+            'ref_time': select(ref_times, record_indices),
+            'ref_depth': select(ref_depths, record_indices),
+            'ref_lat': select(ref_lats, record_indices),
+            'ref_lon': select(ref_lons, record_indices),
+            'lat_offset': lat_offsets,
+            'lon_offset': lon_offsets
+        }
+        columns['distance'] = haversine_distance(ma.getdata(columns['ref_lat']), ma.getdata(columns['ref_lon']), ma.getdata(lat_values), ma.getdata(lon_values))
+        matchups = MatchupSet(columns)
+        if self.config.max_distance is not None:
+            matchups = matchups.filter(matchups.get_column('distance') <= self.config.max_distance)
+        if self.config.interpolation == 'bilinear':
+            self.__add_horizontal_brackets(matchups)
+        if self.config.time_depth_interpolation == 'linear':
+            self.__add_time_depth_brackets(matchups)
+        if self.config.time_aggregation != 'none':
+            self.__add_time_windows(matchups)
+        if self.config.window_size > 1:
+            if self.config.time_aggregation != 'none':
+                raise ValueError('Unable to combine time aggregation with windows of more than one model cell.')
+            matchups.window_size = self.config.window_size
+            matchups.window_min_valid = self.config.window_min_valid
+        if self.config.trajectory_mode:
+            matchups.time_slice_window = self.config.trajectory_time_slices
+        matchups.super_observations = self.config.super_observations
+        return matchups
+
+
+    def __find_nearest_valid_cells(self, lat_indices, lon_indices, ref_lats, ref_lons):
+        """
+        Replaces the matchup cells which are invalid in all model variables by their nearest valid cells, as long as
+        these are within the valid cell search radius of the reference positions.
+        @return: a tuple (lat_indices, lon_indices, lat_offsets, lon_offsets), where the offsets are the differences
+        in cells between replacing and replaced cells.
+        """
+        valid_cell_map = self.data.get_nearest_valid_cell_map()
+        valid_lat_indices, valid_lon_indices = valid_cell_map.find_nearest_valid_cells(lat_indices, lon_indices)
+        valid_lats, valid_lons = self.data.get_grid_geometry().get_coordinates(valid_lat_indices, valid_lon_indices)
+        distances = haversine_distance(ma.getdata(ref_lats), ma.getdata(ref_lons), ma.getdata(valid_lats), ma.getdata(valid_lons))
+        is_replaced = valid_cell_map.invalid_cells[lat_indices, lon_indices] & (distances <= self.config.valid_cell_search_radius)
+        logging.debug('Replacing %s invalid matchup cells by their nearest valid cells', np.count_nonzero(is_replaced))
+        lat_offsets = np.where(is_replaced, valid_lat_indices - lat_indices, 0)
+        lon_offsets = np.where(is_replaced, valid_lon_indices - lon_indices, 0)
+        return lat_indices + lat_offsets, lon_indices + lon_offsets, lat_offsets, lon_offsets
+
+
+    def __add_time_windows(self, matchups):
+        ref_times = matchups.get_column('ref_time')
+        if ref_times is None or matchups.get_column('time_index') is None:
+            return
+        times, invalid = split_masked(self.get_coordinate_index('time').values)
+        if np.any(invalid) or np.any(np.diff(times) < 0):
+            raise ValueError('Unable to aggregate model values in time: model times are invalid or not increasing.')
+        ref_times = ma.getdata(ref_times)
+        # the windows comprise the model times less than time_delta away from the reference time, like nearest matching
+        start_indices = np.searchsorted(times, ref_times - self.config.time_delta, side='right')
+        stop_indices = np.searchsorted(times, ref_times + self.config.time_delta, side='left')
+        matchups.set_time_windows(start_indices, stop_indices, self.config.time_aggregation)
+
+
+    def __add_time_depth_brackets(self, matchups):
+        for dimension in ('time', 'depth'):
+            ref_values = matchups.get_column('ref_' + dimension)
+            if ref_values is None or matchups.get_column(dimension + '_index') is None:
+                continue
+            matchups.set_brackets(dimension, self.get_coordinate_index(dimension).find_brackets(ref_values))
+
+
+    def __add_horizontal_brackets(self, matchups):
+        grid_geometry = self.data.get_grid_geometry()
+        if grid_geometry.is_curvilinear:
+            logging.warning('Bilinear interpolation is not supported for curvilinear grids; using nearest model cells.')
+            return
+        lat_brackets, lon_brackets = grid_geometry.find_brackets(matchups.get_column('ref_lat'), matchups.get_column('ref_lon'))
+        matchups.set_brackets('lat', lat_brackets)
+        matchups.set_brackets('lon', lon_brackets)
+
+
+    def find_matchup_cells(self, ref_lats, ref_lons, ref_times=None, ref_depths=None):
+        """
+        Finds the model cells of all given reference positions at once. The result is identical to calling
+        find_matchups for each single position, ordered by position, time and depth.
+        @param ref_lats: array of reference latitudes.
+        @param ref_lons: array of reference longitudes.
+        @param ref_times: optional array of reference times; if None, all model times match.
+        @param ref_depths: optional array of reference depths; if None, all model depths match.
+        @return: a tuple of index arrays (record_indices, time_indices, depth_indices, lat_indices, lon_indices), where
+        record_indices refer to the given reference arrays; time_indices and depth_indices are None if the model does
+        not have the respective dimension.
+        """
+        return self.get_cell_finder().find_cells(ref_lats, ref_lons, ref_times, ref_depths)
+
+
+    def get_cell_finder(self):
+        if self.cell_finder is None:
+            time_index = self.get_coordinate_index('time') if self.data.has_model_dimension('time') else None
+            depth_index = self.get_coordinate_index('depth') if self.data.has_model_dimension('depth') else None
+            self.cell_finder = CellFinder(self.data.get_grid_geometry(), time_index, depth_index, self.config)
+        return self.cell_finder
+
+
     def find_matchups(self, reference_record):
         matchup_position = self.find_matchup_position(reference_record.lat, reference_record.lon)
         matchup_times = self.find_matchup_times(reference_record.time)
@@ -70,44 +246,33 @@ class MatchupEngine(object):
         return matchups
 
 
-    def __find_position(self, dimension, target_value):
-        dim_size = self.data.model_dim_size(dimension)
-        if dimension in self.pixel_sizes:
-            pixel_size = self.pixel_sizes[dimension]
-        else:
-            self.__prepare_lat_lon_data()
-            pixel_size = self.data.__getattribute__(dimension)[1] - self.data.__getattribute__(dimension)[0]
-        index = target_value - self.data.__getattribute__(dimension)[0]
-        if index < 0:
-            return None
-        return normalise(index / pixel_size, dim_size - 1)
-
-
     def find_matchup_position(self, ref_lat, ref_lon):
-        lon_variable_name = self.data.find_model_longitude_variable_name()
-        lat_variable_name = self.data.find_model_latitude_variable_name()
-
-        pixel_x = self.__find_position(lon_variable_name, ref_lon)
-        pixel_y = self.__find_position(lat_variable_name, ref_lat)
-
-        if pixel_x is None or pixel_y is None:
+        grid_geometry = self.data.get_grid_geometry()
+        lat_indices, lon_indices, valid = self.__find_positions(np.ma.atleast_1d(ref_lat), np.ma.atleast_1d(ref_lon))
+        if not valid[0]:
             return None
 
-        current_lon = self.data.__getattribute__(lon_variable_name)[pixel_x]
-        current_lat = self.data.__getattribute__(lat_variable_name)[pixel_y]
+        pixel_x = int(lon_indices[0])
+        pixel_y = int(lat_indices[0])
+        current_lats, current_lons = grid_geometry.get_coordinates(lat_indices, lon_indices)
 
-        return (pixel_x, pixel_y, current_lon, current_lat)
+        return (pixel_x, pixel_y, current_lons[0], current_lats[0])
 
 
-    def __prepare_lat_lon_data(self):
-        self.data.read_model(self.data.find_model_latitude_variable_name())
-        self.data.read_model(self.data.find_model_longitude_variable_name())
+    def __find_positions(self, ref_lats, ref_lons):
+        return self.get_cell_finder().find_positions(ref_lats, ref_lons)
 
 
     def find_matchup_times(self, ref_time):
         return self.__find_matchup_index(ref_time, 'time', self.config.time_delta)
 
 
+    def __coordinate_values(self, dimension, indices):
+        if indices is None:
+            return None
+        return self.get_coordinate_index(dimension).values[indices]
+
+
     def __find_matchup_depths(self, ref_depth):
         return self.__find_matchup_index(ref_depth, 'depth', self.config.depth_delta)
 
@@ -141,29 +306,196 @@ class MatchupEngine(object):
 
 
     def __find_matchup_index_in_model_data(self, dimension, ref, max_delta):
-        self.data.read_model(dimension)
-        dimension_data = self.data.__getattribute__(dimension)
-        current_delta = float("inf")
-        index = 0
-        matchup_index = None
-        for d in dimension_data:
-            difference = fabs(ref - d)
-            if difference < current_delta and difference < max_delta:
-                current_delta = difference
-                matchup_index = index, d
-            index += 1
-        return matchup_index
+        coordinate_index = self.get_coordinate_index(dimension)
+        index = coordinate_index.find_nearest(ref, max_delta)
+        if index is None:
+            return None
+        return index, coordinate_index.values[index]
+
+
+    def get_coordinate_index(self, dimension):
+        if dimension not in self.coordinate_indices:
+            self.coordinate_indices[dimension] = CoordinateIndex(self.data.read_model(dimension))
+        return self.coordinate_indices[dimension]
 
 
     def remove_empty_matchups(self, matchups):
-        cleaned_matchups = []
-        for m in matchups:
-            for model_name in self.data.model_vars():
-                value = m.get_model_value(model_name, self.data)
-                if not np.ma.is_masked(value):
-                    cleaned_matchups.append(m)
-                    break
-        return cleaned_matchups
+        """
+        Removes the matchups without a valid value in any of the model variables. The model mask is gathered at all
+        matchup cells at once, one variable after the other.
+        @param matchups: a 'MatchupSet' or a list of matchups.
+        @return: the remaining matchups, of the same type as the given matchups.
+        """
+        if len(matchups) == 0:
+            return matchups
+        matchup_set = create_matchup_set(matchups)
+        keep = np.zeros(len(matchup_set), dtype=bool)
+        for model_name in self.data.model_vars():
+            if keep.all():
+                break
+            keep |= ~ma.getmaskarray(matchup_set.get_model_values(model_name, self.data))
+        logging.debug('Removing %s matchups without valid model values', np.count_nonzero(~keep))
+        if isinstance(matchups, MatchupSet):
+            return matchups.filter(keep)
+        return [m for m, is_kept in zip(matchups, keep) if is_kept]
+
+
+class CellFinder(object):
+    """
+    Finds the model cells of reference positions. Holds everything needed for that, but no file handles, so that it can
+    be sent to worker processes.
+    """
+
+    def __init__(self, grid_geometry, time_index, depth_index, config):
+        self.grid_geometry = grid_geometry
+        self.time_index = time_index
+        self.depth_index = depth_index
+        self.time_delta = config.time_delta
+        self.depth_delta = config.depth_delta
+        self.max_distance = config.max_distance
+        self.use_spatial_index = config.spatial_index
+        if grid_geometry.is_curvilinear or self.use_spatial_index:
+            grid_geometry.get_spatial_index()
+
+
+    def find_positions(self, ref_lats, ref_lons):
+        return self.grid_geometry.find_positions(ref_lats, ref_lons, self.max_distance, self.use_spatial_index)
+
+
+    def find_cells(self, ref_lats, ref_lons, ref_times=None, ref_depths=None):
+        lat_indices, lon_indices, valid = self.find_positions(ref_lats, ref_lons)
+        record_indices = np.nonzero(valid)[0]
+        lat_indices = lat_indices[record_indices]
+        lon_indices = lon_indices[record_indices]
+
+        columns = [lat_indices, lon_indices]
+        record_indices, columns, time_indices = self.__expand(record_indices, columns, ref_times, self.time_index, self.time_delta)
+        columns.append(time_indices)
+        record_indices, columns, depth_indices = self.__expand(record_indices, columns, ref_depths, self.depth_index, self.depth_delta)
+        lat_indices, lon_indices, time_indices = columns
+
+        return record_indices, time_indices, depth_indices, lat_indices, lon_indices
+
+
+    def __expand(self, record_indices, columns, ref_values, coordinate_index, delta):
+        if coordinate_index is None:
+            return record_indices, columns, None
+        if ref_values is None:
+            dim_size = coordinate_index.size
+            indices = np.tile(np.arange(dim_size), len(record_indices))
+            record_indices = np.repeat(record_indices, dim_size)
+            return record_indices, [None if c is None else np.repeat(c, dim_size) for c in columns], indices
+        indices, valid = coordinate_index.find_nearest(ref_values[record_indices], delta)
+        record_indices = record_indices[valid]
+        return record_indices, [None if c is None else c[valid] for c in columns], indices[valid]
+
+
+def create_worker_pool(cell_finder, worker_count):
+    """
+    Starts a pool of worker processes for find_cells_in_parallel. Each worker receives the cell finder once, so that
+    the pool can be reused for any number of calls.
+    """
+    return ProcessPoolExecutor(worker_count, initializer=init_worker, initargs=(cell_finder,))
+
+
+def find_cells_in_parallel(cell_finder, ref_columns, worker_count, chunk_size=None, executor=None):
+    """
+    Finds the model cells of the given reference columns (lats, lons, times, depths) in a pool of worker processes.
+    The columns are passed to the workers through shared memory. Chunk results are combined in chunk order, so the
+    result equals that of cell_finder.find_cells.
+    @param executor: a pool created by create_worker_pool for the same cell finder; if None, a pool is started for
+    this call only.
+    """
+    record_count = len(ref_columns[0])
+    if chunk_size is None:
+        chunk_size = max(1, -(-record_count // (worker_count * CHUNKS_PER_WORKER)))
+
+    shared_memories = []
+    try:
+        descriptors = []
+        for column in ref_columns:
+            if column is None:
+                descriptors.append(None)
+                continue
+            data_memory, data_descriptor = share_array(ma.getdata(column))
+            mask_memory, mask_descriptor = share_array(ma.getmaskarray(column))
+            shared_memories.extend([data_memory, mask_memory])
+            descriptors.append((data_descriptor, mask_descriptor))
+        chunks = [(descriptors, start, min(start + chunk_size, record_count)) for start in range(0, record_count, chunk_size)]
+        if executor is None:
+            with create_worker_pool(cell_finder, worker_count) as executor:
+                results = list(executor.map(find_cells_in_chunk, chunks))
+        else:
+            results = list(executor.map(find_cells_in_chunk, chunks))
+    finally:
+        for shared_memory in shared_memories:
+            shared_memory.close()
+            shared_memory.unlink()
+
+    if not results:
+        return cell_finder.find_cells(*ref_columns)
+    cells = []
+    for index in range(len(results[0])):
+        if results[0][index] is None:
+            cells.append(None)
+        else:
+            cells.append(np.concatenate([result[index] for result in results]))
+    return tuple(cells)
+
+
+def share_array(array):
+    array = np.ascontiguousarray(array)
+    shared_memory = SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shared_memory.buf)[...] = array
+    return shared_memory, (shared_memory.name, array.shape, array.dtype.str)
+
+
+def attach_array(descriptor):
+    name, shape, dtype = descriptor
+    shared_memory = SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shared_memory.buf), shared_memory
+
+
+# state of a worker process: the cell finder, set up once by init_worker, and the reference columns of the current call
+worker_state = {}
+
+
+def init_worker(cell_finder):
+    worker_state['cell_finder'] = cell_finder
+    worker_state['descriptors'] = None
+    worker_state['columns'] = []
+    worker_state['shared_memories'] = []
+
+
+def attach_columns(descriptors):
+    if worker_state['descriptors'] == descriptors:
+        return
+    # the columns of the previous call are views of its shared memory, which can only be closed without them
+    worker_state['columns'] = []
+    for shared_memory in worker_state['shared_memories']:
+        shared_memory.close()
+    worker_state['descriptors'] = descriptors
+    worker_state['shared_memories'] = []
+    for descriptor in descriptors:
+        if descriptor is None:
+            worker_state['columns'].append(None)
+            continue
+        data, data_memory = attach_array(descriptor[0])
+        mask, mask_memory = attach_array(descriptor[1])
+        worker_state['columns'].append(ma.array(data, mask=mask, copy=False))
+        worker_state['shared_memories'].extend([data_memory, mask_memory])
+
+
+def find_cells_in_chunk(chunk):
+    descriptors, start, stop = chunk
+    attach_columns(descriptors)
+    columns = [None if column is None else column[start:stop] for column in worker_state['columns']]
+    cells = worker_state['cell_finder'].find_cells(*columns)
+    return (cells[0] + start,) + tuple(cells[1:])
+
+
+def select(values, indices):
+    return None if values is None else values[indices]
 
 
 def normalise(n, max):
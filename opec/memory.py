@@ -0,0 +1,105 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import logging
+import os
+import sys
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STATM_FILE = '/proc/self/statm'
+
+def current_rss():
+    """
+    Returns the resident set size of this process in KB, read from /proc/self/statm; where that file does not exist,
+    the peak resident set size is returned instead. Returns None if neither is available.
+    """
+    try:
+        with open(STATM_FILE) as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * (os.sysconf('SC_PAGE_SIZE') // 1024)
+    except (OSError, IndexError, ValueError, AttributeError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process in KB, or None if it is unavailable.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, other systems report KB
+    return max_rss // 1024 if sys.platform == 'darwin' else max_rss
+
+
+def log_memory(message, *args):
+    """
+    Logs the memory in use at debug level. The memory is only measured, and the message only formatted, if debug
+    logging is enabled.
+    @param message: the log message, which is followed by the memory in use; may contain %-placeholders for args.
+    """
+    if not logging.getLogger().isEnabledFor(logging.DEBUG):
+        return
+    rss = current_rss()
+    if rss is not None:
+        logging.debug(message + ': %.2f MB', *(args + (rss / 1024,)))
+
+
+class MemoryTracker(object):
+    """
+    Records the memory in use at the start and end of stages of processing, and the peak memory of each stage. The
+    peak of a stage is the process peak if that increased during the stage; otherwise, only the larger of the
+    memory in use at start and end is known, which is recorded instead.
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.__current_stage = None
+
+
+    def start(self, stage_name):
+        if self.__current_stage is not None:
+            self.stop()
+        self.__current_stage = (stage_name, current_rss(), peak_rss())
+
+
+    def stop(self):
+        if self.__current_stage is None:
+            return
+        stage_name, start_rss, start_peak = self.__current_stage
+        end_rss = current_rss()
+        end_peak = peak_rss()
+        measured = [rss for rss in (start_rss, end_rss) if rss is not None]
+        if end_peak is not None and start_peak is not None and end_peak > start_peak:
+            measured.append(end_peak)
+        stage_peak = max(measured) if measured else None
+        self.stages.append({'stage': stage_name, 'start_rss': start_rss, 'end_rss': end_rss, 'peak_rss': stage_peak})
+        self.__current_stage = None
+
+
+    def get_peak(self, stage_name):
+        for stage in self.stages:
+            if stage['stage'] == stage_name:
+                return stage['peak_rss']
+        return None
+
+
+    def log_summary(self, level=logging.DEBUG):
+        for stage in self.stages:
+            if stage['peak_rss'] is not None:
+                logging.log(level, 'Peak memory of stage \'%s\': %.2f MB', stage['stage'], stage['peak_rss'] / 1024)
@@ -0,0 +1,221 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import warnings
+
+import numpy as np
+import numpy.ma as ma
+from netCDF4 import default_fillvals
+from scipy.io import netcdf_file
+
+# the magic numbers of the netCDF classic and 64-bit offset formats
+CLASSIC_FORMAT_SIGNATURES = (b'CDF\x01', b'CDF\x02')
+# the number of values checked at once for fill values and the valid range when reading a variable
+MASK_BLOCK_SIZE = 1 << 20
+
+def is_classic_format(filename):
+    """
+    Returns True if the given file is a netCDF file in classic or 64-bit offset format.
+    """
+    with open(filename, 'rb') as file:
+        return file.read(4) in CLASSIC_FORMAT_SIGNATURES
+
+
+class MmapDataset(object):
+    """
+    Read-only access to a netCDF file in classic or 64-bit offset format through a memory map. Offers the part of the
+    interface of netCDF4.Dataset used by NetCDFFacade. Variable data is not copied into memory: the pages are shared
+    with the operating system's page cache, and thus with other processes reading the same file.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__file = netcdf_file(filename, 'r', mmap=True, maskandscale=False)
+        self.dimensions = {}
+        for name, size in self.__file.dimensions.items():
+            self.dimensions[name] = MmapDimension(name, self.__file._recs if size is None else size)
+        self.variables = {name: MmapVariable(name, variable) for name, variable in self.__file.variables.items()}
+        self.__attributes = {name: decode_attribute(value) for name, value in self.__file._attributes.items()}
+        # like netCDF4, global attributes are attributes of the dataset
+        set_attributes(self, self.__attributes)
+
+
+    def ncattrs(self):
+        return list(self.__attributes.keys())
+
+
+    def close(self):
+        self.variables = {}
+        # the memory map stays open as long as arrays still refer to it, e.g. from the Data cache
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.__file.close()
+
+
+class MmapDimension(object):
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+
+
+    def __len__(self):
+        return self.size
+
+
+class MmapVariable(object):
+    """
+    A variable of a MmapDataset. Like netCDF4, reading a variable masks fill values, missing values and values outside
+    the valid range, and applies scale_factor and add_offset; this is done lazily, on the values read only.
+    """
+
+    def __init__(self, name, variable):
+        self.name = name
+        self._name = name
+        self.dimensions = tuple(variable.dimensions)
+        self.__variable = variable
+        self.__attributes = {attribute: decode_attribute(value) for attribute, value in variable._attributes.items()}
+        self.shape = tuple(variable.data.shape)
+        self.ndim = len(self.shape)
+        self.dtype = self.__find_dtype()
+        self.__invalid_values = self.__find_invalid_values()
+        self.__valid_min, self.__valid_max = self.__find_valid_range()
+        set_attributes(self, self.__attributes)
+
+
+    def __find_invalid_values(self):
+        attributes = self.__attributes
+        stored_dtype = self.__variable.data.dtype
+        fill_value = attributes.get('_FillValue')
+        if fill_value is None and stored_dtype.kind in 'iuf' and stored_dtype.itemsize > 1:
+            fill_value = default_fillvals.get('%s%s' % (stored_dtype.kind, stored_dtype.itemsize))
+        invalid_values = [np.atleast_1d(value) for value in (fill_value, attributes.get('missing_value')) if value is not None]
+        return np.concatenate(invalid_values) if invalid_values else None
+
+
+    def __find_valid_range(self):
+        attributes = self.__attributes
+        valid_range = attributes.get('valid_range')
+        valid_min = attributes.get('valid_min', None if valid_range is None else np.atleast_1d(valid_range)[0])
+        valid_max = attributes.get('valid_max', None if valid_range is None else np.atleast_1d(valid_range)[-1])
+        return valid_min, valid_max
+
+
+    def __find_dtype(self):
+        # unpacked values keep the byte order of the file, so that they can be views of the memory map
+        stored_dtype = self.__variable.data.dtype
+        packing = [self.__attributes[name] for name in ('scale_factor', 'add_offset') if name in self.__attributes]
+        if not packing:
+            return stored_dtype
+        dtype = np.result_type(*[np.asarray(value).dtype for value in packing])
+        return dtype if np.issubdtype(dtype, np.floating) else np.dtype(np.float64)
+
+
+    def _getdims(self):
+        return self.dimensions
+
+
+    def ncattrs(self):
+        return list(self.__attributes.keys())
+
+
+    def getncattr(self, name):
+        return self.__attributes[name]
+
+
+    def chunking(self):
+        return 'contiguous'
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, key):
+        values = self.__variable.data[to_numpy_index(key)]
+        return self.__mask_and_scale(np.asarray(values))
+
+
+    def __mask_and_scale(self, values):
+        if self.__invalid_values is not None or self.__valid_min is not None or self.__valid_max is not None:
+            mask = self.__find_mask(values)
+        else:
+            mask = ma.nomask
+        attributes = self.__attributes
+        if 'scale_factor' in attributes or 'add_offset' in attributes:
+            # one copy, scaled in place
+            values = values.astype(self.dtype)
+            values *= np.asarray(attributes.get('scale_factor', 1), dtype=self.dtype)
+            values += np.asarray(attributes.get('add_offset', 0), dtype=self.dtype)
+        return ma.array(values, mask=mask, copy=False)
+
+
+    def __find_mask(self, values):
+        # the values are checked in blocks along the first dimension, and a mask of the full size is only allocated if
+        # there are invalid values at all
+        if values.ndim == 0:
+            invalid = self.__find_invalid(values)
+            return invalid if invalid.any() else ma.nomask
+        row_size = max(values[0].size, 1)
+        rows_per_block = max(MASK_BLOCK_SIZE // row_size, 1)
+        mask = ma.nomask
+        for start in range(0, len(values), rows_per_block):
+            block = slice(start, start + rows_per_block)
+            invalid = self.__find_invalid(values[block])
+            if invalid.any():
+                if mask is ma.nomask:
+                    mask = np.zeros(values.shape, dtype=bool)
+                mask[block] = invalid
+        return mask
+
+
+    def __find_invalid(self, values):
+        invalid = np.zeros(values.shape, dtype=bool)
+        if self.__invalid_values is not None:
+            for invalid_value in self.__invalid_values:
+                invalid |= values == invalid_value
+        if self.__valid_min is not None:
+            invalid |= values < self.__valid_min
+        if self.__valid_max is not None:
+            invalid |= values > self.__valid_max
+        return invalid
+
+
+def to_numpy_index(key):
+    """
+    Converts netCDF4-style orthogonal indices, where ranges select contiguous index ranges, to a numpy index.
+    """
+    if not isinstance(key, (tuple, list)):
+        return key
+    index = []
+    for item in key:
+        if isinstance(item, range) and item.step == 1:
+            index.append(slice(item.start, item.stop))
+        else:
+            index.append(item)
+    return tuple(index)
+
+
+def set_attributes(target, attributes):
+    for name, value in attributes.items():
+        if name not in vars(target):
+            setattr(target, name, value)
+
+
+def decode_attribute(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, np.ndarray) and value.size == 1:
+        return value[0]
+    return value
@@ -0,0 +1,250 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import glob
+import logging
+from collections import OrderedDict
+import numpy as np
+import numpy.ma as ma
+
+from opec.netCDF_facade import NetCDFFacade
+
+DEFAULT_MAX_OPEN_FILES = 64
+
+def expand_file_names(file_names):
+    """
+    Expands a file name, a glob pattern or a list of these into a list of file names.
+    @param file_names: a file name or glob pattern, or a list of file names or glob patterns.
+    @return: the list of file names; the matches of each glob pattern are sorted.
+    """
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    result = []
+    for file_name in file_names:
+        if glob.has_magic(file_name):
+            matches = sorted(glob.glob(file_name))
+            if not matches:
+                raise ValueError('No files found matching \'%s\'' % file_name)
+            result.extend(matches)
+        else:
+            result.append(file_name)
+    return result
+
+
+def open_reference_files(file_names, max_open_files=None, use_mmap=False):
+    """
+    Opens the given reference files.
+    @param file_names: a file name or glob pattern, or a list of file names or glob patterns.
+    @param max_open_files: the maximum number of files kept open at the same time.
+    @param use_mmap: if True, files in netCDF classic format are memory-mapped.
+    @return: a NetCDFFacade if there is a single file, a MultiFileFacade otherwise.
+    """
+    file_names = expand_file_names(file_names)
+    if len(file_names) == 1:
+        return NetCDFFacade(file_names[0], use_mmap=use_mmap)
+    return MultiFileFacade(file_names, max_open_files, use_mmap)
+
+
+class FileHandlePool(object):
+    """
+    Opens files on demand and keeps at most max_open_files of them open; the least recently used file is closed first.
+    """
+
+    def __init__(self, file_names, max_open_files=None, use_mmap=False):
+        self.file_names = file_names
+        self.use_mmap = use_mmap
+        self.max_open_files = max_open_files if max_open_files is not None else DEFAULT_MAX_OPEN_FILES
+        if self.max_open_files < 1:
+            raise ValueError('max_open_files must be at least 1')
+        self.__open_files = OrderedDict()
+
+
+    def get(self, index):
+        if index in self.__open_files:
+            self.__open_files.move_to_end(index)
+            return self.__open_files[index]
+        while len(self.__open_files) >= self.max_open_files:
+            closed_index, ncfile = self.__open_files.popitem(last=False)
+            logging.debug('Closing file \'%s\'', self.file_names[closed_index])
+            ncfile.close()
+        ncfile = NetCDFFacade(self.file_names[index], use_mmap=self.use_mmap)
+        self.__open_files[index] = ncfile
+        return ncfile
+
+
+    def open_file_count(self):
+        return len(self.__open_files)
+
+
+    def close(self):
+        for ncfile in self.__open_files.values():
+            ncfile.close()
+        self.__open_files.clear()
+
+
+class MultiFileFacade(object):
+    """
+    Presents a set of reference files sharing the same variables as a single file: the reference variables and
+    their coordinate variables are concatenated along their record dimension. Records are read lazily from the
+    individual files, which are opened through a bounded pool of file handles. Any other variable, as well as all
+    metadata, is taken from the first file.
+    """
+
+    def __init__(self, file_names, max_open_files=None, use_mmap=False):
+        if not file_names:
+            raise ValueError('At least one file name must be provided')
+        self.filename = list(file_names)
+        self.__pool = FileHandlePool(self.filename, max_open_files, use_mmap)
+        self.__first_file = NetCDFFacade(self.filename[0], use_mmap=use_mmap)
+        self.__record_dimension = self.__find_record_dimension()
+        self.__variables = {}
+
+
+    def __getattr__(self, name):
+        # all metadata queries are answered by the first file
+        if name == '_MultiFileFacade__first_file':
+            raise AttributeError(name)
+        return getattr(self._MultiFileFacade__first_file, name)
+
+
+    def __find_record_dimension(self):
+        for variable_name in self.__first_file.get_reference_variables():
+            dimensions = self.__first_file.get_dimensions(variable_name)
+            if len(dimensions) == 1:
+                return dimensions[0]
+        return None
+
+
+    def get_record_dimension(self):
+        return self.__record_dimension
+
+
+    def get_record_offsets(self):
+        """
+        Returns the index of the first record of each file within the concatenated record dimension, followed by the
+        total number of records. The record counts are read once, opening each file only briefly instead of through the
+        pool of file handles, which would close and reopen files when there are more files than handles.
+        """
+        if not hasattr(self, 'record_offsets'):
+            record_counts = [self.__first_file.get_dim_size(self.__record_dimension)]
+            for file_name in self.filename[1:]:
+                ncfile = NetCDFFacade(file_name, use_mmap=self.__pool.use_mmap)
+                record_counts.append(ncfile.get_dim_size(self.__record_dimension))
+                ncfile.close()
+            self.record_offsets = np.concatenate(([0], np.cumsum(record_counts))).astype(np.int64)
+        return self.record_offsets
+
+
+    def open_file_count(self):
+        return self.__pool.open_file_count()
+
+
+    def get_dim_size(self, dimName):
+        if dimName is not None and dimName == self.__record_dimension:
+            return int(self.get_record_offsets()[-1])
+        return self.__first_file.get_dim_size(dimName)
+
+
+    def get_variable(self, variableName):
+        variable = self.__first_file.get_variable(variableName)
+        if variable is None or self.__record_dimension is None or tuple(variable.dimensions) != (self.__record_dimension,):
+            return variable
+        if variableName not in self.__variables:
+            self.__variables[variableName] = ConcatenatedVariable(self, variable)
+        return self.__variables[variableName]
+
+
+    def read_variable_fully(self, variableName):
+        return self.get_variable(variableName)
+
+
+    def get_variable_size(self, variableName):
+        return int(np.prod(self.get_variable(variableName).shape))
+
+
+    def read_records(self, variable_name, indices):
+        """
+        Reads the given records of a concatenated variable; each file is read once, covering the range of records
+        requested from it.
+        @param indices: an array of record indices within the concatenated record dimension.
+        @return: a masked array of the record values.
+        """
+        offsets = self.get_record_offsets()
+        dtype = self.__first_file.get_variable(variable_name).dtype
+        result = ma.masked_all(len(indices), dtype=dtype)
+        if len(indices) == 0:
+            return result
+        # requested indices are usually sorted already; otherwise they are sorted once, so that the records of each
+        # file form a single block, found by a binary search per file
+        order = None if np.all(indices[1:] >= indices[:-1]) else np.argsort(indices, kind='stable')
+        sorted_indices = indices if order is None else indices[order]
+        block_bounds = np.searchsorted(sorted_indices, offsets)
+        for file_index in np.flatnonzero(np.diff(block_bounds)).tolist():
+            block = slice(block_bounds[file_index], block_bounds[file_index + 1])
+            positions = block if order is None else order[block]
+            local_indices = sorted_indices[block] - offsets[file_index]
+            start = local_indices[0]
+            stop = local_indices[-1] + 1
+            variable = self.__pool.get(file_index).get_variable(variable_name)
+            if variable is None:
+                raise ValueError('Variable \'%s\' not found in file \'%s\'' % (variable_name, self.filename[file_index]))
+            result[positions] = ma.array(variable[start:stop])[local_indices - start]
+        return result
+
+
+    def close(self):
+        self.__pool.close()
+        self.__first_file.close()
+
+
+class ConcatenatedVariable(object):
+    """
+    A one-dimensional variable whose records are spread across the files of a MultiFileFacade.
+    """
+
+    def __init__(self, multi_file_facade, first_variable):
+        self.__facade = multi_file_facade
+        self.__first_variable = first_variable
+        self.name = first_variable.name
+        self.dtype = first_variable.dtype
+        self.dimensions = tuple(first_variable.dimensions)
+        self.ndim = 1
+
+
+    def __getattr__(self, name):
+        # attributes are taken from the variable in the first file
+        if name == '_ConcatenatedVariable__first_variable':
+            raise AttributeError(name)
+        return getattr(self._ConcatenatedVariable__first_variable, name)
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    @property
+    def shape(self):
+        return (self.__facade.get_dim_size(self.dimensions[0]),)
+
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 1:
+            key = key[0]
+        if isinstance(key, slice):
+            indices = np.arange(*key.indices(len(self)))
+        else:
+            indices = np.arange(len(self))[key]
+        if np.ndim(indices) == 0:
+            return self.__facade.read_records(self.name, np.array([indices]))[0]
+        return self.__facade.read_records(self.name, indices)
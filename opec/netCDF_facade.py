@@ -13,12 +13,22 @@
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
 
 import functools
+import os
 from netCDF4 import Dataset
 
+from opec.mmap_dataset import MmapDataset, is_classic_format
+
 class NetCDFFacade(object):
 
-    def __init__(self, filename=None, dataset=None):
-        if filename is not None:
+    def __init__(self, filename=None, dataset=None, use_mmap=False):
+        """
+        @param use_mmap: if True and the file is in netCDF classic or 64-bit offset format, it is memory-mapped instead
+        of being read through the netCDF library.
+        """
+        self.filename = filename
+        if filename is not None and use_mmap and os.path.isfile(filename) and is_classic_format(filename):
+            self.data_set = MmapDataset(filename)
+        elif filename is not None:
             try:
                 self.data_set = Dataset(filename, 'r', format='NETCDF4_CLASSIC')
             except RuntimeError as re:
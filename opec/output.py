@@ -22,6 +22,7 @@ from mako.template import Template
 
 from opec import plotter, utils
 from opec.configuration import get_default_config
+from opec.matchup import create_matchup_set
 
 
 def rename(string):
@@ -125,6 +126,8 @@ class Output(object):
         lines.append('# Matchup criteria:')
         lines.append('#    Maximum time delta = {} seconds'.format(self.config.time_delta))
         lines.append('#    Maximum depth delta = {} meters'.format(self.config.depth_delta))
+        if self.config.max_distance is not None:
+            lines.append('#    Maximum distance = {} kilometres'.format(self.config.max_distance))
         lines.append('#')
         lines.append('# Algorithm parameters:')
         lines.append(
@@ -163,6 +166,7 @@ class Output(object):
 
 
     def __matchup_infos(self, matchups, data):
+        matchups = create_matchup_set(matchups)
         header = []
         header.append('Matchup #')
         header.append('reference_time')
@@ -173,39 +177,52 @@ class Output(object):
         header.append('model_depth')
         header.append('model_lat')
         header.append('model_lon')
+        extra_columns = ['distance'] if self.__writes_distance(data) else []
+        extra_columns.extend(name for name in ('lat_offset', 'lon_offset') if matchups.get_column(name) is not None)
+        header.extend(extra_columns)
         ref_vars = data.ref_vars()
         model_vars = data.model_vars()
         header.extend(ref_vars)
         header.extend(model_vars)
+        if matchups.window_size > 1:
+            for model_var in model_vars:
+                header.extend([model_var + '_stddev', model_var + '_valid_fraction'])
+
+        columns = [matchups.get_column(name) for name in ('record_number', 'ref_time', 'ref_depth', 'ref_lat', 'ref_lon', 'time', 'depth', 'lat', 'lon')]
+        columns.extend(matchups.get_column(name) for name in extra_columns)
+        columns.extend(self.__matchup_values(matchups, data, ref_vars, True).values())
+        if matchups.window_size > 1:
+            # the window statistics yield the model values as well, so that each window is gathered only once
+            window_statistics = [matchups.get_window_statistics(model_var, data) for model_var in model_vars]
+            columns.extend(matchups.get_window_model_values(statistics) for statistics in window_statistics)
+            for statistics in window_statistics:
+                columns.extend([statistics['stddev'], statistics['valid_fraction']])
+        else:
+            columns.extend(self.__matchup_values(matchups, data, model_vars, False).values())
 
         lines = [self.config.separator.join(header)]
-        for matchup in matchups:
-            line = []
-            line.append(str(matchup.reference_record.record_number))
-            line.append(str(matchup.reference_record.time))
-            line.append(str(matchup.reference_record.depth))
-            line.append(str(matchup.reference_record.lat))
-            line.append(str(matchup.reference_record.lon))
-            line.append(str(matchup.spacetime_position[0]))
-            line.append(str(matchup.spacetime_position[1]))
-            line.append(str(matchup.spacetime_position[2]))
-            line.append(str(matchup.spacetime_position[3]))
-            lines.append(self.config.separator.join(line))
-
-        # writing matchups column-wise in order to not be forced to read data multiple times
-        for var in ref_vars:
-            for i, matchup in enumerate(matchups):
-                lines[i + 1] += self.config.separator
-                lines[i + 1] += str(matchup.get_ref_value(var, data))
-
-        for var in model_vars:
-            for i, matchup in enumerate(matchups):
-                lines[i + 1] += self.config.separator
-                lines[i + 1] += str(matchup.get_model_value(var, data))
+        for i in range(len(matchups)):
+            lines.append(self.config.separator.join([str(None if column is None else column[i]) for column in columns]))
 
         return lines
 
 
+    def __writes_distance(self, data):
+        # the distance to the cell centre is only of interest if cells are found by distance, so that the columns of
+        # the matchup file stay the same otherwise
+        return self.config.max_distance is not None or self.config.spatial_index or data.get_grid_geometry().is_curvilinear
+
+
+    def __matchup_values(self, matchups, data, variable_names, is_reference):
+        values = {}
+        for variable_name in variable_names:
+            if is_reference:
+                values[variable_name] = matchups.get_ref_values(variable_name, data)
+            else:
+                values[variable_name] = matchups.get_model_values(variable_name, data)
+        return values
+
+
     def __write_lines_to_file(self, target_file, lines):
         directory = os.path.dirname(target_file)
         if not os.path.exists(directory):
@@ -244,6 +261,8 @@ class Output(object):
                 ref_pair[key.replace('ref_', '')] = format_statistic(stats, key)
             all_ref_stats.append((stats['ref_name'], ref_pair))
 
+        matchup_set = create_matchup_set(matchups) if matchups else None
+
         density_plot_files = get_basenames(density_plot_files)
         taylor_target_files = get_basenames(taylor_target_files)
         target_diagram_file = os.path.basename(target_diagram_file) if target_diagram_file is not None else None
@@ -261,7 +280,9 @@ class Output(object):
             all_model_stats=all_model_stats,
             all_ref_stats=all_ref_stats,
             matchups=matchups,
-            data=data,
+            record_numbers=matchup_set.record_numbers if matchup_set is not None else None,
+            reference_values=self.__matchup_values(matchup_set, data, data.ref_vars(), True) if matchup_set is not None else None,
+            model_values=self.__matchup_values(matchup_set, data, data.model_vars(), False) if matchup_set is not None else None,
             reference_vars=data.ref_vars(),
             model_vars=data.model_vars(),
             write_taylor_diagrams=self.config.write_taylor_diagrams,
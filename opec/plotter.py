@@ -59,7 +59,7 @@ def create_taylor_diagrams(statistics, config=None):
             for v in ref_stddevs:
                 if v == 0.0 or np.isnan(v):
                     logging.warning('Unable to create Taylor diagram from statistics.')
-                    logging.debug('Statistics: %s' % current_statistics)
+                    logging.debug('Statistics: %s', current_statistics)
                     continue
 
             figure = plt.figure()
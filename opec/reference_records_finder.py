@@ -13,23 +13,99 @@
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
 import logging
 
+import numpy as np
+
+from opec.utils import split_masked
+
 class ReferenceRecordsFinder(object):
 
-    def __init__(self, data):
+    def __init__(self, data, config=None):
+        """
+        @param config: the optional configuration; if it enables pre-filtering, records outside the model domain and
+        time range are dropped.
+        """
         self.data = data
+        self.config = config
 
     def find_reference_records(self):
+        """
+        Returns all reference records as 'ReferenceRecordTable', whose columns are views of the cached reference
+        coordinate variables.
+        """
         ref_coordinate_variables = self.data.reference_coordinate_variables()
         ref_lat_variable_name, ref_lon_variable_name, ref_time_variable_name, ref_depth_variable_name = find_ref_coordinate_names(ref_coordinate_variables)
+        dim_size = self.__find_record_count()
+        if dim_size is None:
+            return ReferenceRecordTable(np.array([]), np.array([]))
         self.__read_reference_dimensions(ref_depth_variable_name, ref_lat_variable_name, ref_lon_variable_name, ref_time_variable_name)
 
+        columns = []
+        for name in (ref_lat_variable_name, ref_lon_variable_name, ref_time_variable_name, ref_depth_variable_name):
+            if name is None:
+                columns.append(None)
+            else:
+                columns.append(self.data.__getattribute__(name)[:dim_size])
+        logging.debug('Found %s reference records', dim_size)
+        return self.__prefilter(ReferenceRecordTable(*columns))
+
+    def find_reference_columns(self):
+        """
+        Returns the coordinates of all reference records as whole arrays rather than as single records.
+        @return: a tuple (lats, lons, times, depths); times and depths are None if the reference data lacks them.
+        """
+        return self.find_reference_records().get_columns()
+
+    def iter_reference_records(self, batch_size):
+        """
+        Reads the reference records in slices of at most batch_size records.
+        @return: a generator of 'ReferenceRecordTable's.
+        """
+        ref_coordinate_variables = self.data.reference_coordinate_variables()
+        ref_coordinate_names = find_ref_coordinate_names(ref_coordinate_variables)
+        dim_size = self.__find_record_count()
+        if dim_size is None:
+            return
+        for start in range(0, dim_size, batch_size):
+            stop = min(start + batch_size, dim_size)
+            columns = [None if name is None else self.data.read_reference_slice(name, start, stop) for name in ref_coordinate_names]
+            yield self.__prefilter(ReferenceRecordTable(*columns, record_numbers=np.arange(start, stop)))
+
+    def filter_by_model_extent(self, reference_records, tolerance=0.0, time_delta=0):
+        """
+        Drops the reference records outside the spatial extent of the model grid (widened by tolerance) or outside the
+        model time range (widened by time_delta). Records with invalid coordinates are kept for the matching to decide.
+        @param tolerance: the widening of the spatial extent in degrees.
+        @param time_delta: the widening of the time range in seconds.
+        @return: the remaining reference records.
+        """
+        lat_min, lat_max, lon_min, lon_max = self.data.get_grid_geometry().get_extent()
+        keep = np.ones(len(reference_records), dtype=bool)
+        criteria = [(reference_records.lats, lat_min - tolerance, lat_max + tolerance),
+                    (reference_records.lons, lon_min - tolerance, lon_max + tolerance)]
+        if reference_records.times is not None and self.data.has_model_dimension('time'):
+            model_times, invalid_times = split_masked(self.data.read_model('time'))
+            if not np.all(invalid_times):
+                criteria.append((reference_records.times, np.min(model_times[~invalid_times]) - time_delta, np.max(model_times[~invalid_times]) + time_delta))
+        for values, minimum, maximum in criteria:
+            values, invalid = split_masked(values)
+            with np.errstate(invalid='ignore'):
+                keep &= invalid | ((values >= minimum) & (values <= maximum))
+        dropped_count = len(keep) - np.count_nonzero(keep)
+        logging.info('Dropped %s of %s reference records outside the model domain and time range', dropped_count, len(keep))
+        return reference_records.filter(keep)
+
+    def __prefilter(self, reference_records):
+        if self.config is None or not self.config.prefilter_records or len(reference_records) == 0:
+            return reference_records
+        return self.filter_by_model_extent(reference_records, self.config.prefilter_tolerance, self.config.time_delta)
+
+    def __find_record_count(self):
         for ref_var in self.data.ref_vars():
             dimensions = self.data.get_reference_dimensions(ref_var)
             if len(dimensions) > 1:
                 continue
-            dim_size = self.data.ref_dim_size(dimensions[0])
-            return self.__find_reference_records(dim_size, ref_depth_variable_name, ref_lat_variable_name, ref_lon_variable_name, ref_time_variable_name)
-        return []
+            return self.data.ref_dim_size(dimensions[0])
+        return None
 
     def __read_reference_dimensions(self, ref_depth_variable_name, ref_lat_variable_name, ref_lon_variable_name,
                                     ref_time_variable_name):
@@ -41,25 +117,6 @@ class ReferenceRecordsFinder(object):
         if ref_depth_variable_name is not None:
             self.data.read_reference(ref_depth_variable_name)
 
-    def __find_reference_records(self, dim_size, ref_depth_variable_name, ref_lat_variable_name, ref_lon_variable_name, ref_time_variable_name):
-        reference_records = []
-        for record_number in range(dim_size):
-            ref_lat = self.data.__getattribute__(ref_lat_variable_name)[record_number]
-            ref_lon = self.data.__getattribute__(ref_lon_variable_name)[record_number]
-            # todo - pythonise this by function object or sth
-            if ref_time_variable_name is not None:
-                ref_time = self.data.__getattribute__(ref_time_variable_name)[record_number]
-            else:
-                ref_time = None
-            if ref_depth_variable_name is not None:
-                ref_depth = self.data.__getattribute__(ref_depth_variable_name)[record_number]
-            else:
-                ref_depth = None
-            rr = ReferenceRecord(record_number, ref_lat, ref_lon, ref_time, ref_depth)
-            reference_records.append(rr)
-        logging.debug('Found %s reference records' % (len(reference_records)))
-        return reference_records
-
 
 def find_ref_coordinate_names(ref_coordinate_variables):
     lat = None
@@ -89,4 +146,55 @@ class ReferenceRecord(object):
         self.depth = depth
 
     def __str__(self):
-        return ', '.join('%s: %s' % (k.replace('_ReferenceRecord', ''), vars(self)[k]) for k in vars(self))
\ No newline at end of file
+        return ', '.join('%s: %s' % (k.replace('_ReferenceRecord', ''), vars(self)[k]) for k in vars(self))
+
+class ReferenceRecordTable(object):
+    """
+    Column-oriented collection of reference records: record numbers and coordinates are held as arrays, typically
+    views of the cached reference variables. 'ReferenceRecord' objects are only created on demand, e.g. when iterating.
+    """
+
+    def __init__(self, lats, lons, times=None, depths=None, record_numbers=None):
+        """
+        @param times: the reference times; None if the reference data has no time.
+        @param depths: the reference depths; None if the reference data has no depth.
+        @param record_numbers: the numbers of the records; if None, records are numbered from 0.
+        """
+        self.lats = lats
+        self.lons = lons
+        self.times = times
+        self.depths = depths
+        self.record_numbers = np.arange(len(lats)) if record_numbers is None else record_numbers
+
+    def get_columns(self):
+        return self.lats, self.lons, self.times, self.depths
+
+    def get_record(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('Reference record index %s out of range' % index)
+        time = None if self.times is None else self.times[index]
+        depth = None if self.depths is None else self.depths[index]
+        return ReferenceRecord(int(self.record_numbers[index]), self.lats[index], self.lons[index], time, depth)
+
+    def filter(self, selection):
+        """
+        Returns a new table containing the records selected by the given slice, boolean mask, or index array.
+        """
+        columns = [None if column is None else column[selection] for column in self.get_columns()]
+        return ReferenceRecordTable(*columns, record_numbers=self.record_numbers[selection])
+
+    def __len__(self):
+        return len(self.record_numbers)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.get_record(index)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.get_record(key)
+        return self.filter(key)
+
+    columns = property(get_columns)
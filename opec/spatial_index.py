@@ -0,0 +1,96 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from opec.utils import split_masked
+
+# mean earth radius in kilometres
+EARTH_RADIUS = 6371.0
+
+
+class SpatialIndex(object):
+    """
+    KD-tree over the cell centres of a model grid, using 3-D coordinates on the unit sphere. Latitudes and longitudes
+    are given per cell, as 2-D arrays for curvilinear grids or as 1-D arrays for unstructured grids.
+    Built once and queried in bulk.
+    """
+
+    def __init__(self, lats, lons):
+        lats, lat_invalid = split_masked(lats)
+        lons, lon_invalid = split_masked(lons)
+        if lats.shape != lons.shape:
+            raise ValueError('Latitude and longitude arrays must have identical shapes')
+        self.shape = lats.shape
+        valid = ~(lat_invalid | lon_invalid).ravel()
+        self.__cell_indices = np.nonzero(valid)[0]
+        self.__tree = cKDTree(to_cartesian(lats.ravel()[valid], lons.ravel()[valid]))
+
+
+    def query(self, ref_lats, ref_lons, max_distance=None):
+        """
+        Finds the nearest grid cell of each given position.
+        @param ref_lats: array of latitudes.
+        @param ref_lons: array of longitudes.
+        @param max_distance: the optional maximum great-circle distance in km; positions farther away from any cell centre
+        do not match.
+        @return: a tuple (cell_indices, distances, valid): cell_indices is a tuple of index arrays, one per grid dimension;
+        distances are great-circle distances in km.
+        """
+        ref_lats, lat_invalid = split_masked(ref_lats)
+        ref_lons, lon_invalid = split_masked(ref_lons)
+        invalid = lat_invalid | lon_invalid
+        size = len(ref_lats)
+        positions = np.zeros(size, dtype=np.int64)
+        distances = np.full(size, np.inf)
+        valid = ~invalid
+        if len(self.__cell_indices) > 0 and np.any(valid):
+            upper_bound = np.inf if max_distance is None else chord_length(max_distance) * (1 + 1e-9)
+            chords, nearest = self.__tree.query(to_cartesian(ref_lats[valid], ref_lons[valid]), distance_upper_bound=upper_bound)
+            found = np.isfinite(chords)
+            chord_distances = np.full(len(chords), np.inf)
+            chord_distances[found] = great_circle_distance(chords[found])
+            distances[valid] = chord_distances
+            positions[np.nonzero(valid)[0][found]] = self.__cell_indices[nearest[found]]
+        valid &= np.isfinite(distances)
+        if max_distance is not None:
+            valid &= distances <= max_distance
+        return np.unravel_index(positions, self.shape), distances, valid
+
+
+def to_cartesian(lats, lons):
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lons = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lats = np.cos(lats)
+    return np.column_stack((cos_lats * np.cos(lons), cos_lats * np.sin(lons), np.sin(lats)))
+
+
+def chord_length(distance):
+    return 2 * np.sin(np.asarray(distance, dtype=np.float64) / (2 * EARTH_RADIUS))
+
+
+def great_circle_distance(chords):
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chords) / 2, 0, 1))
+
+
+def haversine_distance(lats_1, lons_1, lats_2, lons_2):
+    """
+    Returns the great-circle distances in km between the given pairs of positions, using the haversine formula.
+    """
+    lats_1 = np.radians(np.asarray(lats_1, dtype=np.float64))
+    lats_2 = np.radians(np.asarray(lats_2, dtype=np.float64))
+    delta_lons = np.radians(np.asarray(lons_2, dtype=np.float64) - np.asarray(lons_1, dtype=np.float64))
+    haversines = np.sin((lats_2 - lats_1) / 2) ** 2 + np.cos(lats_1) * np.cos(lats_2) * np.sin(delta_lons / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(haversines, 0, 1)))
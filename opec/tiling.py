@@ -0,0 +1,60 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import itertools
+
+DEFAULT_TILE_SIZE = 1024 * 1024
+
+def default_tile_shape(shape, itemsize, max_tile_size=DEFAULT_TILE_SIZE):
+    """
+    Returns the shape of tiles of at most max_tile_size bytes for an array of the given shape. Trailing dimensions are
+    covered fully as long as the tiles stay small enough; the dimension where they would not is split, and all
+    leading dimensions get an extent of 1, so that a tile is a contiguous block of a C-ordered array.
+    @param shape: the shape of the array.
+    @param itemsize: the size in bytes of an array element.
+    @param max_tile_size: the maximum size in bytes of a tile.
+    @return: the tile shape, as tuple.
+    """
+    tile_shape = [1] * len(shape)
+    elements = max(1, max_tile_size // itemsize)
+    for dimension in reversed(range(len(shape))):
+        extent = max(1, shape[dimension])
+        if extent > elements:
+            tile_shape[dimension] = max(1, elements)
+            break
+        tile_shape[dimension] = extent
+        elements //= extent
+    return tuple(tile_shape)
+
+
+def tile_slices(tile_index, tile_shape, shape):
+    """
+    Returns the tuple of slices of the array region covered by the given tile.
+    """
+    return tuple(slice(index * extent, min((index + 1) * extent, size)) for index, extent, size in zip(tile_index, tile_shape, shape))
+
+
+def find_tiles(region, tile_shape, shape):
+    """
+    Returns the indices of all tiles overlapping the given region.
+    @param region: a tuple of slices with step 1, one per dimension.
+    @return: a list of tile index tuples.
+    """
+    ranges = []
+    for (start, stop, step), extent in zip([s.indices(size) for s, size in zip(region, shape)], tile_shape):
+        if stop <= start:
+            return []
+        ranges.append(range(start // extent, (stop - 1) // extent + 1))
+    return list(itertools.product(*ranges))
+
@@ -37,8 +37,27 @@ def create_masked_array(values):
     return values
 
 
+def split_masked(values):
+    """
+    Returns the plain data of the given (possibly masked) array together with a boolean array marking invalid entries.
+    """
+    data = np.asarray(ma.getdata(values))
+    invalid = ma.getmaskarray(values)
+    if np.issubdtype(data.dtype, np.floating):
+        invalid = invalid | np.isnan(data)
+    return data, invalid
+
+
 def extract_values(matchups, data, ref_name, model_name):
-    logging.debug('Extracting values of variables \'%s\' and \'%s\'' % (ref_name, model_name))
+    logging.debug('Extracting values of variables \'%s\' and \'%s\'', ref_name, model_name)
+    if is_matchup_set(matchups) and matchups.super_observations:
+        reference_statistics, model_statistics = matchups.get_super_observations(ref_name, model_name, data)
+        logging.debug('Aggregated %s matchups to %s super-observations', len(matchups), len(reference_statistics['count']))
+        return reference_statistics['mean'], model_statistics['mean']
+    if is_matchup_set(matchups):
+        reference_values = np.ma.array(matchups.get_ref_values(ref_name, data), dtype=np.float64)
+        model_values = np.ma.array(matchups.get_model_values(model_name, data), dtype=np.float64)
+        return reference_values, model_values
     reference_values = np.ma.empty(len(matchups))
     model_values = np.ma.empty(len(matchups))
     index = 0
@@ -48,6 +67,41 @@ def extract_values(matchups, data, ref_name, model_name):
         index += 1
     return reference_values, model_values
 
+
+def extract_values_from_batches(matchup_batches, data, variable_pairs, compress=False):
+    """
+    Extracts the values of several variable pairs from a sequence of matchup sets, consuming one set at a time. Only
+    the extracted values are kept, so that the matchups of all batches never need to be in memory at once; the values
+    themselves are still kept for all batches.
+    @param matchup_batches: an iterable of matchup sets, such as returned by MatchupEngine.iter_matchups.
+    @param variable_pairs: a list of tuples (ref_name, model_name).
+    @param compress: if True, only the pairs of values valid in both variables are kept, batch by batch.
+    @return: a list of tuples (reference_values, model_values), one per variable pair.
+    """
+    reference_values = [[] for pair in variable_pairs]
+    model_values = [[] for pair in variable_pairs]
+    for matchups in matchup_batches:
+        for index, (ref_name, model_name) in enumerate(variable_pairs):
+            batch_reference_values, batch_model_values = extract_values(matchups, data, ref_name, model_name)
+            if compress:
+                batch_reference_values, batch_model_values = harmonise(batch_reference_values, batch_model_values)
+                batch_reference_values = np.ma.array(batch_reference_values.compressed())
+                batch_model_values = np.ma.array(batch_model_values.compressed())
+            reference_values[index].append(batch_reference_values)
+            model_values[index].append(batch_model_values)
+    return [(concatenate(reference_values[index]), concatenate(model_values[index])) for index in range(len(variable_pairs))]
+
+
+def concatenate(arrays):
+    if not arrays:
+        return np.ma.empty(0)
+    return np.ma.concatenate(arrays)
+
+
+def is_matchup_set(matchups):
+    # duck typing, because opec.matchup depends on this module
+    return hasattr(matchups, 'get_model_values')
+
 def get_unit(ncfile, variable_name):
     if ncfile.get_variable(variable_name):
         return ncfile.get_variable_attribute(variable_name, 'units')
@@ -0,0 +1,115 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import unittest
+
+from opec.cache_policy import create_cache_policy, CachePolicy, HeapPolicy, LruPolicy, GdsfPolicy, LargestFirstPolicy
+
+
+class CachePolicy_test(unittest.TestCase):
+
+    def test_create_cache_policy(self):
+        self.assertTrue(isinstance(create_cache_policy(), LruPolicy))
+        self.assertTrue(isinstance(create_cache_policy('gdsf'), GdsfPolicy))
+        self.assertTrue(isinstance(create_cache_policy('largest'), LargestFirstPolicy))
+        policy = LruPolicy()
+        self.assertIs(policy, create_cache_policy(policy))
+        self.assertRaises(ValueError, lambda: create_cache_policy('fifo'))
+        self.assertRaises(TypeError, CachePolicy)
+        self.assertRaises(TypeError, HeapPolicy)
+
+
+    def test_lru(self):
+        policy = LruPolicy()
+        policy.add('a', 1.0)
+        policy.add('b', 5.0)
+        policy.add('c', 2.0)
+        self.assertEqual(8.0, policy.total_size)
+        self.assertEqual('a', policy.find_victim())
+        policy.touch('a')
+        self.assertEqual('b', policy.find_victim())
+        self.assertEqual(5.0, policy.remove('b'))
+        self.assertEqual('c', policy.find_victim())
+        self.assertEqual(['a', 'c'], sorted(policy))
+        self.assertEqual(3.0, policy.total_size)
+
+
+    def test_largest_first(self):
+        policy = LargestFirstPolicy()
+        policy.add('a', 1.0)
+        policy.add('b', 5.0)
+        policy.add('c', 2.0)
+        policy.touch('b')
+        self.assertEqual('b', policy.find_victim())
+        policy.remove('b')
+        self.assertEqual('c', policy.find_victim())
+
+
+    def test_gdsf(self):
+        policy = GdsfPolicy()
+        policy.add('small', 1.0)
+        policy.add('large', 4.0)
+        self.assertEqual('large', policy.find_victim())
+        for i in range(4):
+            policy.touch('large')
+        # 5 accesses of 4 MB outweigh 1 access of 1 MB
+        self.assertEqual('small', policy.find_victim())
+        policy.remove('small')
+        self.assertEqual('large', policy.find_victim())
+
+
+    def test_gdsf_inflation_is_set_on_eviction_only(self):
+        policy = GdsfPolicy()
+        policy.add('a', 1.0)
+        policy.add('b', 2.0)
+        for i in range(10):
+            self.assertEqual('b', policy.find_victim())
+        policy.add('c', 1.0)
+        self.assertAlmostEqual(1.0, policy.get_priority('c'))
+        self.assertEqual('b', policy.evict())
+        self.assertFalse('b' in policy)
+        # entries added after the eviction are aged by the priority of 'b'
+        policy.add('d', 1.0)
+        self.assertAlmostEqual(1.5, policy.get_priority('d'))
+        self.assertEqual(['a', 'c', 'd'], sorted(policy))
+
+
+    def test_heap_size_is_bounded(self):
+        policy = GdsfPolicy()
+        policy.add('tile', 1.0)
+        for i in range(100000):
+            policy.touch('tile')
+        self.assertTrue(policy.get_heap_size() <= 3)
+        self.assertEqual('tile', policy.find_victim())
+        policy.add('other', 1.0)
+        for i in range(1000):
+            policy.touch('other')
+        self.assertTrue(policy.get_heap_size() <= 5)
+        self.assertEqual('other', policy.find_victim())
+        policy.remove('tile')
+        policy.remove('other')
+        self.assertTrue(policy.get_heap_size() <= 1)
+        self.assertIsNone(policy.find_victim())
+
+
+    def test_pinned_entries_are_not_evicted(self):
+        for policy in (LruPolicy(), GdsfPolicy(), LargestFirstPolicy()):
+            policy.add('lat', 10.0, pinned=True)
+            policy.add('chl', 1.0)
+            self.assertEqual('chl', policy.find_victim())
+            self.assertEqual('chl', policy.evict())
+            self.assertIsNone(policy.find_victim())
+            self.assertIsNone(policy.evict())
+            self.assertTrue('lat' in policy)
+            self.assertEqual(10.0, policy.total_size)
@@ -158,4 +158,23 @@ class Configuration_test(unittest.TestCase):
         self.assertTrue(c.remove_empty_matchups)
 
         c = Configuration(remove_empty_matchups=False)
-        self.assertFalse(c.remove_empty_matchups)
\ No newline at end of file
+        self.assertFalse(c.remove_empty_matchups)
+
+    def test_batch_size(self):
+        self.assertIsNone(Configuration().batch_size)
+        self.assertEqual(1000, Configuration(batch_size='1000').batch_size)
+        self.assertRaises(ValueError, lambda: Configuration(batch_size=0))
+
+
+    def test_interpolation(self):
+        c = Configuration()
+        self.assertEqual('nearest', c.interpolation)
+
+        c = Configuration(interpolation='Bilinear')
+        self.assertEqual('bilinear', c.interpolation)
+
+        self.assertRaises(ValueError, lambda: Configuration(interpolation='cubic'))
+
+        self.assertEqual('nearest', Configuration().time_depth_interpolation)
+        self.assertEqual('linear', Configuration(time_depth_interpolation='linear').time_depth_interpolation)
+        self.assertRaises(ValueError, lambda: Configuration(time_depth_interpolation='bilinear'))
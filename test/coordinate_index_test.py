@@ -0,0 +1,74 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import unittest
+
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as test
+
+from opec.coordinate_index import CoordinateIndex
+
+
+class CoordinateIndex_test(unittest.TestCase):
+
+    def test_find_nearest_scalar(self):
+        index = CoordinateIndex(np.array([1261440000, 1261447200]))
+        self.assertEqual(0, index.find_nearest(1261440250, 100000))
+        self.assertEqual(1, index.find_nearest(1261447205, 6))
+        self.assertIsNone(index.find_nearest(1261447205, 5))
+        self.assertIsNone(index.find_nearest(ma.masked, 100000))
+
+
+    def test_find_nearest_array(self):
+        index = CoordinateIndex(np.array([0.0, 1.0, 2.0, 3.0]))
+        indices, valid = index.find_nearest(np.array([-0.4, 0.5, 1.6, 3.3, 7.0, np.nan]), 0.6)
+        test.assert_array_equal([True, True, True, True, False, False], valid)
+        test.assert_array_equal([0, 0, 2, 3], indices[valid])
+
+
+    def test_find_nearest_non_monotonic(self):
+        index = CoordinateIndex(np.array([3.0, 1.0, 2.0, 1.0, 0.0]))
+        self.assertFalse(index.is_increasing)
+        indices, valid = index.find_nearest(np.array([0.9, 1.5, 2.5, -1.0]))
+        self.assertTrue(np.all(valid))
+        test.assert_array_equal([1, 1, 0, 4], indices)
+
+
+    def test_find_nearest_ignores_masked_coordinates(self):
+        index = CoordinateIndex(ma.array([0.0, 1.0, 2.0], mask=[False, True, False]))
+        indices, valid = index.find_nearest(np.array([0.9, 1.1]), 2)
+        test.assert_array_equal([0, 2], indices)
+        self.assertEqual(3, index.size)
+
+
+    def test_find_nearest_without_coordinates(self):
+        index = CoordinateIndex(np.array([]))
+        indices, valid = index.find_nearest(np.array([0.9, 1.1]))
+        self.assertFalse(np.any(valid))
+
+
+    def test_find_brackets(self):
+        index = CoordinateIndex(np.array([0.0, 1.0, 5.0]))
+        lower, upper, weights = index.find_brackets(np.array([0.25, 1.0, 3.0, 5.0, 7.0, -1.0]))
+        test.assert_array_equal([0, 1, 1, 1, 1, 0], lower)
+        test.assert_array_equal([1, 2, 2, 2, 2, 1], upper)
+        test.assert_array_almost_equal([0.25, 0.0, 0.5, 1.0, 1.0, 0.0], weights)
+
+
+    def test_find_brackets_descending(self):
+        index = CoordinateIndex(np.array([5.0, 1.0, 0.0]))
+        lower, upper, weights = index.find_brackets(np.array([0.5, 4.0]))
+        test.assert_array_equal([2, 1], lower)
+        test.assert_array_equal([1, 0], upper)
+        test.assert_array_almost_equal([0.5, 0.75], weights)
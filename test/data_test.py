@@ -128,6 +128,81 @@ class Data_test(unittest.TestCase):
         self.assertTrue(hasattr(data, 'chl'))
 
 
+    def test_caching_evicts_least_recently_used_variable(self):
+        test_file = os.path.dirname(os.path.realpath(__file__)) + "/../resources/ogs_test_smaller.nc"
+        data = Data(test_file, None, 0.05)
+        data.read_model('chl')
+        data.read_model('longitude')
+        data.read_model('dox')
+        self.assertEqual(['longitude', 'dox'], data.cached_list)
+        data.read_model('chl')
+        self.assertEqual(['longitude', 'chl'], data.cached_list)
+        self.assertAlmostEqual(0.0250244140625 + 0.00030517578125, data.get_current_cache_size())
+
+        data = Data(test_file, None, 0.05, cache_policy='largest')
+        data.read_model('chl')
+        data.read_model('dox')
+        data.read_model('chl')
+        self.assertEqual(['chl'], data.cached_list)
+
+
+    def test_caching_warns_if_coordinate_variables_exceed_cache_size(self):
+        test_file = os.path.dirname(os.path.realpath(__file__)) + "/../resources/ogs_test_smaller.nc"
+        data = Data(test_file, None, 0.0001)
+        with self.assertLogs(level='WARNING') as logs:
+            data.read_model('longitude')
+            data.read_model('latitude')
+        self.assertTrue('max_cache_size' in logs.output[0])
+        self.assertEqual(['longitude', 'latitude'], data.cached_list)
+
+
+    def test_read_model_through_tiles(self):
+        test_file = os.path.dirname(os.path.realpath(__file__)) + "/../resources/ogs_test_smaller.nc"
+        data = Data(test_file, None, 0.03)
+        expected = Data(test_file).read_model('chl')
+        data.tile_shapes = {'chl': (1, 1, 20, 80)}
+        self.assertAlmostEqual(expected[0, 1, 30, 5], data.read_model('chl', [0, 1, 30, 5]))
+        self.assertEqual([('chl', (0, 1, 1, 0))], list(data.tiles.keys()))
+        self.assertEqual([], data.cached_list)
+
+        region = (slice(0, 1), slice(0, 2), slice(18, 23), slice(10, 13))
+        assert_array_equal(expected[region], data.read_model_region('chl', region))
+        self.assertEqual(4, len(data.tiles))
+        self.assertAlmostEqual(4 * 20 * 80 * 4 / (1024 * 1024), data.get_current_cache_size())
+
+        data.read_model('dox')
+        self.assertEqual(['dox'], data.cached_list)
+        self.assertEqual(0, len(data.tiles))
+
+
+    def test_gather(self):
+        test_file = os.path.dirname(os.path.realpath(__file__)) + "/../resources/ogs_test_smaller.nc"
+        expected = Data(test_file).read_model('chl')
+        data = Data(test_file)
+        data.tile_shapes = {'chl': (1, 1, 10, 40)}
+        index_arrays = (np.array([0, 0, 0, 0, 0]), np.array([1, 0, 1, 0, 1]), np.array([40, 3, 12, 5, 40]), np.array([79, 2, 0, 39, 78]))
+        assert_array_equal(expected[index_arrays], data.gather('chl', index_arrays))
+        self.assertEqual(3, len(data.tiles))
+        self.assertEqual([], data.cached_list)
+
+        lat_indices = np.array([[3], [35]])
+        lon_indices = np.array([[38, 39, 40, 41]])
+        values = data.gather('chl', (0, 0, lat_indices, lon_indices))
+        self.assertEqual((2, 4), values.shape)
+        assert_array_equal(expected[0, 0, lat_indices, lon_indices], values)
+        self.assertEqual(0, len(data.gather('chl', (np.zeros(0, dtype=int),) * 4)))
+
+        data.read_model('chl')
+        self.assertEqual(0, len(data.tiles))
+        self.assertEqual(['chl'], data.cached_list)
+        self.assertAlmostEqual(data.compute_variable_size('chl'), data.get_current_cache_size())
+        assert_array_equal(expected[index_arrays], data.gather('chl', index_arrays))
+
+
+    def test_get_tile_shape(self):
+        self.assertEqual((2, 2, 2, 4), self.data.get_tile_shape('chl'))
+
+
     def test_compute_variable_size(self):
         test_file = os.path.dirname(os.path.realpath(__file__)) + "/../resources/ogs_test_smaller.nc"
         data = Data(test_file)
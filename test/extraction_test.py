@@ -0,0 +1,104 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import unittest
+
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as test
+
+from opec.extraction import aggregate, find_groups, group_statistics, interpolate, window_statistics
+
+
+class Extraction_test(unittest.TestCase):
+
+    def test_interpolate_bilinearly(self):
+        values = ma.array([[1.0, 2.0], [3.0, 4.0]])
+        brackets = (np.array([0, 0]), np.array([1, 1]), np.array([0.5, 0.0]))
+        result = interpolate(values, [brackets, (np.array([0, 0]), np.array([1, 1]), np.array([0.5, 1.0]))])
+        test.assert_array_almost_equal([2.5, 2.0], result)
+        self.assertFalse(np.any(ma.getmaskarray(result)))
+
+
+    def test_interpolate_along_some_dimensions(self):
+        values = ma.arange(12.0).reshape(3, 4)
+        result = interpolate(values, [np.array([2, 1]), (np.array([0, 2]), np.array([1, 3]), np.array([0.25, 0.5]))])
+        test.assert_array_almost_equal([8.25, 6.5], result)
+
+
+    def test_interpolate_renormalises_weights_of_valid_corners(self):
+        values = ma.array([[1.0, 2.0], [3.0, 4.0]], mask=[[False, True], [True, True]])
+        brackets = (np.array([0, 0, 0]), np.array([1, 1, 1]), np.array([0.5, 1.0, 0.0]))
+        result = interpolate(values, [brackets, (np.array([0, 1, 0]), np.array([1, 1, 1]), np.array([0.5, 0.0, 1.0]))])
+        test.assert_array_equal([False, True, True], ma.getmaskarray(result))
+        self.assertAlmostEqual(1.0, result[0])
+
+
+    def test_interpolate_ignores_invalid_corners_without_weight(self):
+        values = ma.array([[1.0, np.nan], [3.0, 4.0]])
+        result = interpolate(values, [np.array([0]), (np.array([0]), np.array([1]), np.array([0.0]))])
+        test.assert_array_almost_equal([1.0], result)
+        self.assertFalse(ma.getmaskarray(result)[0])
+
+
+    def test_aggregate_mean(self):
+        # windows [1, 2, 3, 4] and [20, 30], the latter all invalid
+        values = ma.array([1.0, 2.0, 3.0, 4.0, 20.0, 30.0], mask=[False, False, False, False, True, True])
+        result = aggregate(values, np.array([0, 4, 6]), 'mean')
+        self.assertAlmostEqual(2.5, result[0])
+        self.assertTrue(result[1] is ma.masked)
+        result = aggregate(values, np.array([0, 0, 3]), 'mean')
+        self.assertTrue(result[0] is ma.masked)
+        self.assertAlmostEqual(2.0, result[1])
+
+
+    def test_aggregate_median(self):
+        values = ma.array([5.0, 3.0, 4.0, 10.0, 20.0, 30.0, 40.0], mask=[False, False, False, False, True, True, False])
+        result = aggregate(values, np.array([0, 3, 7]), 'median')
+        test.assert_array_almost_equal([4.0, 25.0], result)
+        result = aggregate(values, np.array([0, 1, 1, 3]), 'median')
+        self.assertAlmostEqual(5.0, result[0])
+        self.assertTrue(result[1] is ma.masked)
+        self.assertAlmostEqual(3.5, result[2])
+        result = aggregate(ma.array([1.0], mask=[True]), np.array([0, 1]), 'median')
+        self.assertTrue(result[0] is ma.masked)
+        self.assertRaises(ValueError, lambda: aggregate(values, np.array([0, 7]), 'mode'))
+
+
+    def test_window_statistics(self):
+        window_values = ma.array([[1.0, 2.0, 3.0, 6.0], [1.0, 2.0, 3.0, 4.0]], mask=[[False, False, False, False], [True, True, True, True]])
+        statistics = window_statistics(window_values)
+        test.assert_array_almost_equal([3.0], statistics['mean'][:1])
+        test.assert_array_almost_equal([np.std([1.0, 2.0, 3.0, 6.0])], statistics['stddev'][:1])
+        test.assert_array_equal([False, True], ma.getmaskarray(statistics['mean']))
+        test.assert_array_equal([4, 0], statistics['count'])
+        test.assert_array_almost_equal([1.0, 0.0], statistics['valid_fraction'])
+        statistics = window_statistics(window_values[:, :2], np.array([2, 0]))
+        test.assert_array_almost_equal([1.0, 0.0], statistics['valid_fraction'])
+
+
+    def test_find_groups(self):
+        group_indices, first_indices = find_groups([np.array([1, 0, 1, 1, 0]), np.array([2, 3, 2, 0, 3])])
+        test.assert_array_equal([2, 0, 2, 1, 0], group_indices)
+        test.assert_array_equal([1, 3, 0], first_indices)
+        group_indices, first_indices = find_groups([np.zeros(0, dtype=np.int64)])
+        self.assertEqual(0, len(group_indices))
+
+
+    def test_group_statistics(self):
+        values = ma.array([1.0, 2.0, 3.0, 5.0, 4.0], mask=[False, False, False, False, True])
+        statistics = group_statistics(values, np.array([0, 2, 0, 0, 1]), 3)
+        test.assert_array_almost_equal([3.0, 2.0], statistics['mean'][[0, 2]])
+        test.assert_array_almost_equal([np.std([1.0, 3.0, 5.0]), 0.0], statistics['stddev'][[0, 2]])
+        test.assert_array_equal([False, True, False], ma.getmaskarray(statistics['mean']))
+        test.assert_array_equal([3, 0, 1], statistics['count'])
@@ -0,0 +1,113 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import os
+import unittest
+
+import numpy as np
+import numpy.testing as test
+
+from opec.data import Data
+from opec.grid_geometry import AxisGeometry, NearestValidCellMap, find_horizontal_dimensions
+
+
+class GridGeometry_test(unittest.TestCase):
+
+    def test_grid_geometry_of_data(self):
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test.nc')
+        grid_geometry = data.get_grid_geometry()
+        self.assertIs(grid_geometry, data.get_grid_geometry())
+        self.assertEqual('lat', grid_geometry.lat.name)
+        self.assertEqual('lon', grid_geometry.lon.name)
+        self.assertEqual(4, grid_geometry.lon.size)
+        self.assertAlmostEqual(5.3, grid_geometry.lon.origin, 5)
+        self.assertAlmostEqual(0.5, grid_geometry.lon.spacing, 5)
+        self.assertEqual(1, grid_geometry.lon.direction)
+        self.assertTrue(grid_geometry.lon.is_uniform)
+
+        lat_indices, lon_indices, valid = grid_geometry.find_positions(np.array([55.8, 54.1, 56.12]), np.array([6.0, 5.5, 12.35]))
+        test.assert_array_equal([True, False, True], valid)
+        test.assert_array_equal([0, 1], lat_indices[valid])
+        test.assert_array_equal([1, 3], lon_indices[valid])
+        data.close()
+
+
+    def test_descending_axis(self):
+        axis = AxisGeometry('lat', np.array([60.0, 59.0, 58.0, 57.0]))
+        self.assertEqual(-1, axis.direction)
+        self.assertTrue(axis.is_uniform)
+        self.assertEqual(0, axis.find_index(60.0))
+        self.assertEqual(1, axis.find_index(58.6))
+        self.assertEqual(3, axis.find_index(50.0))
+        self.assertIsNone(axis.find_index(60.2))
+
+
+    def test_non_uniform_axis(self):
+        axis = AxisGeometry('depth', np.array([0.0, 1.0, 5.0, 20.0]))
+        self.assertEqual(1, axis.direction)
+        self.assertFalse(axis.is_uniform)
+        indices, valid = axis.find_indices(np.array([0.4, 2.9, 3.1, 12.0, 100.0, -0.1]))
+        test.assert_array_equal([True, True, True, True, True, False], valid)
+        test.assert_array_equal([0, 1, 2, 2, 3], indices[:5])
+
+
+    def test_find_brackets(self):
+        axis = AxisGeometry('lon', np.array([5.3, 5.8, 6.3, 6.8]))
+        lower, upper, weights = axis.find_brackets(np.array([5.3, 5.55, 6.7, 6.8, 9.0, 4.0]))
+        test.assert_array_equal([0, 0, 2, 2, 2, 0], lower)
+        test.assert_array_equal([1, 1, 3, 3, 3, 1], upper)
+        test.assert_array_almost_equal([0.0, 0.5, 0.8, 1.0, 1.0, 0.0], weights)
+
+        descending_axis = AxisGeometry('lat', np.array([60.0, 59.0, 58.0]))
+        lower, upper, weights = descending_axis.find_brackets(np.array([58.5]))
+        test.assert_array_equal([1], lower)
+        test.assert_array_equal([2], upper)
+        test.assert_array_almost_equal([0.5], weights)
+
+        single_cell_axis = AxisGeometry('lat', np.array([60.0]))
+        lower, upper, weights = single_cell_axis.find_brackets(np.array([58.5]))
+        test.assert_array_equal([0], upper)
+        test.assert_array_almost_equal([0.0], weights)
+
+
+    def test_nearest_valid_cell_map(self):
+        invalid_cells = np.array([[True, True, False, False], [False, True, False, False]])
+        valid_cell_map = NearestValidCellMap(invalid_cells)
+        lat_indices, lon_indices = valid_cell_map.find_nearest_valid_cells(np.array([0, 0, 0, 1]), np.array([0, 1, 2, 3]))
+        test.assert_array_equal([1, 0, 0, 1], lat_indices)
+        test.assert_array_equal([0, 2, 2, 3], lon_indices)
+
+        valid_cell_map = NearestValidCellMap(np.ones((2, 2), dtype=bool))
+        self.assertFalse(valid_cell_map.has_valid_cells)
+        lat_indices, lon_indices = valid_cell_map.find_nearest_valid_cells(np.array([1]), np.array([0]))
+        test.assert_array_equal([1], lat_indices)
+        test.assert_array_equal([0], lon_indices)
+
+
+    def test_find_horizontal_dimensions(self):
+        path = os.path.dirname(os.path.realpath(__file__)) + '/../resources/'
+        data = Data(path + 'test_without_depth.nc')
+        self.assertEqual(('lat', 'lon'), find_horizontal_dimensions(data))
+        self.assertEqual((2, 4), data.get_nearest_valid_cell_map().invalid_cells.shape)
+        data.close()
+        data = Data(path + 'ogs_test_smaller.nc')
+        self.assertEqual(('latitude', 'longitude'), find_horizontal_dimensions(data))
+        data.close()
+
+
+    def test_extent(self):
+        self.assertEqual((4.75, 7.5), AxisGeometry('lon', np.array([5.0, 5.5, 6.0, 7.0])).get_extent())
+        self.assertEqual((56.0, 60.5), AxisGeometry('lat', np.array([60.0, 59.0, 57.0])).get_extent())
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test.nc')
+        test.assert_array_almost_equal((54.4, 57.6, 5.05, 7.05), data.get_grid_geometry().get_extent(), 5)
+        data.close()
@@ -12,8 +12,16 @@
 # You should have received a copy of the GNU General Public License along
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
 
+import os
 import unittest
-from opec.main import parse_arguments
+
+import numpy.testing as test
+
+from opec import utils
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.main import extract_batch_values, parse_arguments
+from opec.matchup_engine import MatchupEngine
 
 class Main_test(unittest.TestCase):
 
@@ -30,3 +38,16 @@ class Main_test(unittest.TestCase):
         self.assertEqual("MyModelOutput.nc", args.path.lstrip().rstrip())
         self.assertIsNone(args.output_dir)
         self.assertIsNone(args.prefix)
+
+    def test_extract_batch_values(self):
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test_single_model_fill_values.nc')
+        config = Configuration(batch_size=1)
+        me = MatchupEngine(data, config)
+        values, matchup_count = extract_batch_values(me, data, config, [['chl', 'chl_ref']])
+        matchups = me.remove_empty_matchups(me.find_all_matchups())
+        self.assertEqual(len(matchups), matchup_count)
+        expected_ref, expected_model = utils.harmonise(*utils.extract_values(matchups, data, 'chl_ref', 'chl'))
+        test.assert_array_almost_equal(expected_ref.compressed(), values[('chl', 'chl_ref')][0])
+        test.assert_array_almost_equal(expected_model.compressed(), values[('chl', 'chl_ref')][1])
+        self.assertRaises(ValueError, lambda: extract_batch_values(me, data, Configuration(batch_size=1, super_observations=True), [['chl', 'chl_ref']]))
+        data.close()
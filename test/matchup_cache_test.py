@@ -0,0 +1,106 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy.testing as test
+
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.matchup_cache import MatchupCache
+from opec.matchup_engine import MatchupEngine
+from opec.reference_records_finder import ReferenceRecordsFinder
+
+
+class MatchupCache_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__)) + '/../'
+        self.data = Data(self.path + 'resources/test.nc')
+        self.cache_dir = tempfile.mkdtemp()
+        self.ref_columns = ReferenceRecordsFinder(self.data).find_reference_columns()
+
+
+    def tearDown(self):
+        self.data.close()
+        shutil.rmtree(self.cache_dir)
+
+
+    def test_key_depends_on_matchup_criteria(self):
+        cache = MatchupCache(self.cache_dir)
+        key = cache.create_key(self.data, Configuration(), self.ref_columns)
+        self.assertEqual(key, cache.create_key(self.data, Configuration(), self.ref_columns))
+        self.assertNotEqual(key, cache.create_key(self.data, Configuration(time_delta=10), self.ref_columns))
+        self.assertNotEqual(key, cache.create_key(self.data, Configuration(max_distance=5), self.ref_columns))
+
+
+    def test_store_and_load(self):
+        cache = MatchupCache(self.cache_dir)
+        self.assertIsNone(cache.load('unknown'))
+
+        matchups = MatchupEngine(self.data).find_all_matchups()
+        cache.store('key', matchups)
+        loaded = cache.load('key')
+        self.assertEqual(len(matchups), len(loaded))
+        for name, column in matchups.columns.items():
+            if column is None:
+                self.assertIsNone(loaded.get_column(name))
+            else:
+                test.assert_array_equal(column, loaded.get_column(name))
+        test.assert_array_almost_equal(matchups.get_model_values('chl', self.data), loaded.get_model_values('chl', self.data))
+
+
+    def test_engine_uses_cache(self):
+        config = Configuration(cache_dir=self.cache_dir)
+        matchups = MatchupEngine(self.data, config).find_all_matchups()
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+        cached_matchups = MatchupEngine(self.data, config).find_all_matchups()
+        test.assert_array_equal(matchups.record_numbers, cached_matchups.record_numbers)
+        self.assertEqual(1, len(os.listdir(self.cache_dir)))
+
+
+    def test_evict_least_recently_used(self):
+        matchups = MatchupEngine(self.data).find_all_matchups()
+        cache = MatchupCache(self.cache_dir)
+        cache.store('first', matchups)
+        cache.store('second', matchups)
+        entry_size = os.path.getsize(os.path.join(self.cache_dir, 'matchups_first.npz'))
+        os.utime(os.path.join(self.cache_dir, 'matchups_first.npz'), (0, 0))
+
+        cache.max_size = 1.5 * entry_size / (1024 * 1024)
+        cache.evict()
+        self.assertEqual(['matchups_second.npz'], os.listdir(self.cache_dir))
+
+
+    def test_evict_stale_entries(self):
+        cache = MatchupCache(self.cache_dir, max_age=1)
+        cache.store('stale', MatchupEngine(self.data).find_all_matchups())
+        os.utime(os.path.join(self.cache_dir, 'matchups_stale.npz'), (0, 0))
+        cache.evict()
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+
+    def test_store_and_load_time_aggregation(self):
+        cache = MatchupCache(self.cache_dir)
+        matchups = MatchupEngine(self.data, Configuration(time_aggregation='median')).find_all_matchups()
+        cache.store('key', matchups)
+        loaded = cache.load('key')
+        self.assertEqual('median', loaded.time_aggregation)
+        test.assert_array_almost_equal(matchups.get_model_values('chl', self.data), loaded.get_model_values('chl', self.data))
+
+        cache.store('key', MatchupEngine(self.data).find_all_matchups())
+        self.assertIsNone(cache.load('key').time_aggregation)
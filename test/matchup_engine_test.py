@@ -15,14 +15,54 @@
 from unittest import TestCase
 import unittest
 import os
+import shutil
+import tempfile
+from unittest import mock
 
+import numpy
 import numpy.testing as np
 
 from opec.matchup_engine import normalise
 from opec.configuration import Configuration
-from opec.matchup_engine import MatchupEngine
+from opec import matchup_engine
+from opec.matchup_engine import MatchupEngine, create_worker_pool, find_cells_in_parallel
+from netCDF4 import Dataset
 from opec.data import Data
 from opec.reference_records_finder import ReferenceRecord, find_ref_coordinate_names
+from opec.utils import extract_values
+
+
+def create_curvilinear_file(file_name):
+    """
+    Writes a model file on a curvilinear grid, with 2-D latitude and longitude variables, including three reference
+    records; the model variable is invalid in the cell of the first record.
+    """
+    dataset = Dataset(file_name, 'w')
+    dataset.createDimension('time', 2)
+    dataset.createDimension('y', 3)
+    dataset.createDimension('x', 4)
+    dataset.createDimension('record_num', 3)
+    y, x = numpy.meshgrid(numpy.arange(3), numpy.arange(4), indexing='ij')
+    time = dataset.createVariable('time', 'i4', ('time',))
+    time.standard_name = 'time'
+    time[:] = [0, 3600]
+    lat = dataset.createVariable('lat', 'f4', ('y', 'x'))
+    lat.standard_name = 'latitude'
+    lat[:] = 50 + y + 0.1 * x
+    lon = dataset.createVariable('lon', 'f4', ('y', 'x'))
+    lon.standard_name = 'longitude'
+    lon[:] = 5 + x - 0.1 * y
+    chl = dataset.createVariable('chl', 'f4', ('time', 'y', 'x'), fill_value=-1.0)
+    chl.coordinates = 'time lat lon'
+    values = numpy.arange(24, dtype=numpy.float32).reshape((2, 3, 4))
+    values[:, 0, 0] = -1
+    chl[:] = values
+    for name, dtype, record_values in (('time_ref', 'i4', [10, 20, 3590]), ('lat_ref', 'f4', [50.0, 51.1, 52.2]), ('lon_ref', 'f4', [5.0, 6.0, 7.0])):
+        dataset.createVariable(name, dtype, ('record_num',))[:] = record_values
+    chl_ref = dataset.createVariable('chl_ref', 'f4', ('record_num',), fill_value=-1.0)
+    chl_ref.coordinates = 'time_ref lat_ref lon_ref'
+    chl_ref[:] = [1, 2, 3]
+    dataset.close()
 
 
 class MatchupEngine_test(TestCase):
@@ -145,6 +185,27 @@ class MatchupEngine_test(TestCase):
         self.assertEqual(2, len(matchups))
 
 
+    def test_find_matchups_on_curvilinear_grid(self):
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, 'test_curvilinear.nc')
+        create_curvilinear_file(file_name)
+        data = Data(file_name)
+        self.assertEqual(['chl'], data.model_vars())
+
+        me = MatchupEngine(data)
+        matchups = me.find_all_matchups()
+        self.assertEqual(3, len(matchups))
+        np.assert_array_equal([0, 1, 2], matchups.get_column('lat_index'))
+        np.assert_array_equal([0, 1, 2], matchups.get_column('lon_index'))
+        matchups = me.remove_empty_matchups(matchups)
+        self.assertEqual(2, len(matchups))
+        reference_values, model_values = extract_values(matchups, data, 'chl_ref', 'chl')
+        np.assert_array_equal([2, 3], reference_values)
+        np.assert_array_equal([5, 22], model_values)
+        data.close()
+        shutil.rmtree(temp_dir)
+
+
     def test_exclude_reference_records_with_out_of_bounds_lats(self):
         reference_record = ReferenceRecord(0, 54.1, 5.5, 1261440252, 0.0012)
         me = MatchupEngine(self.data, Configuration())
@@ -158,4 +219,277 @@ class MatchupEngine_test(TestCase):
         me = MatchupEngine(data, Configuration())
         matchups = me.find_all_matchups()
         self.assertIsNotNone(matchups)
-        self.assertEqual(6560, len(matchups))
\ No newline at end of file
+        self.assertEqual(6560, len(matchups))
+
+    def test_find_matchup_cells(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=10, depth_delta=0.0001))
+        lats = numpy.array([55.20123, 54.1, 55.3])
+        lons = numpy.array([6.30048, 5.5, 5.5])
+        times = numpy.array([1261447205, 1261440252, 1261440252])
+        depths = numpy.array([0.0020015, 0.0012, 0.0012])
+        record_indices, time_indices, depth_indices, lat_indices, lon_indices = me.find_matchup_cells(lats, lons, times, depths)
+        np.assert_array_equal([0], record_indices)
+        np.assert_array_equal([1], time_indices)
+        np.assert_array_equal([1], depth_indices)
+        np.assert_array_equal([0], lat_indices)
+        np.assert_array_equal([2], lon_indices)
+
+
+    def test_find_matchup_cells_equals_single_record_search(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000, depth_delta=0.0008))
+        lats = numpy.linspace(54.5, 57.5, 40)
+        lons = numpy.linspace(7.5, 4.8, 40)
+        times = numpy.linspace(1261434000, 1261452000, 40).astype(int)
+        depths = numpy.linspace(0.0, 0.004, 40)
+        for ref_times, ref_depths in ((times, depths), (None, None), (times, None)):
+            record_indices, time_indices, depth_indices, lat_indices, lon_indices = me.find_matchup_cells(lats, lons, ref_times, ref_depths)
+            expected = []
+            for i in range(len(lats)):
+                time = ref_times[i] if ref_times is not None else None
+                depth = ref_depths[i] if ref_depths is not None else None
+                for matchup in me.find_matchups(ReferenceRecord(i, lats[i], lons[i], time, depth)):
+                    expected.append([i] + matchup.cell_position)
+            actual = numpy.array([record_indices, time_indices, depth_indices, lat_indices, lon_indices]).T
+            np.assert_array_equal(numpy.array(expected), actual)
+
+
+    def test_find_all_matchups_in_parallel(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000))
+        serial_matchups = me.find_all_matchups(worker_count=1)
+        parallel_matchups = me.find_all_matchups(worker_count=2)
+        self.assertEqual(len(serial_matchups), len(parallel_matchups))
+        for name in ('record_number', 'time_index', 'depth_index', 'lat_index', 'lon_index', 'ref_lat'):
+            np.assert_array_equal(serial_matchups.get_column(name), parallel_matchups.get_column(name))
+
+
+    def test_find_cells_in_parallel(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000, depth_delta=0.0008))
+        lats = numpy.ma.array(numpy.linspace(54.5, 57.5, 40), mask=numpy.arange(40) % 7 == 0)
+        lons = numpy.linspace(7.5, 4.8, 40)
+        times = numpy.linspace(1261434000, 1261452000, 40).astype(int)
+        expected = me.find_matchup_cells(lats, lons, times, None)
+        actual = find_cells_in_parallel(me.get_cell_finder(), (lats, lons, times, None), 3, chunk_size=6)
+        self.assertEqual(5, len(actual))
+        for index in range(5):
+            np.assert_array_equal(expected[index], actual[index])
+
+
+    def test_find_cells_in_parallel_reusing_worker_pool(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000, depth_delta=0.0008))
+        cell_finder = me.get_cell_finder()
+        with create_worker_pool(cell_finder, 2) as executor:
+            for count in (40, 25):
+                lats = numpy.linspace(54.5, 57.5, count)
+                lons = numpy.linspace(7.5, 4.8, count)
+                times = numpy.linspace(1261434000, 1261452000, count).astype(int)
+                expected = me.find_matchup_cells(lats, lons, times, None)
+                actual = find_cells_in_parallel(cell_finder, (lats, lons, times, None), 2, chunk_size=6, executor=executor)
+                for index in range(5):
+                    np.assert_array_equal(expected[index], actual[index])
+
+
+    def test_iter_matchups_in_parallel(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000))
+        all_matchups = me.find_all_matchups(worker_count=1)
+        with mock.patch.object(matchup_engine, 'create_worker_pool', side_effect=create_worker_pool) as create_pool:
+            batches = list(me.iter_matchups(batch_size=2, worker_count=2))
+        self.assertEqual(1, create_pool.call_count)
+        for name in ('record_number', 'time_index', 'lat_index', 'lon_index'):
+            np.assert_array_equal(all_matchups.get_column(name), numpy.concatenate([batch.get_column(name) for batch in batches]))
+
+
+    def test_iter_matchups(self):
+        me = MatchupEngine(self.data, Configuration(time_delta=4000))
+        all_matchups = me.find_all_matchups()
+        batches = list(me.iter_matchups(batch_size=2))
+        self.assertEqual(2, len(batches))
+        for name in ('record_number', 'time_index', 'depth_index', 'lat_index', 'lon_index', 'ref_lat', 'ref_time'):
+            np.assert_array_equal(all_matchups.get_column(name), numpy.concatenate([batch.get_column(name) for batch in batches]))
+        batch_ref_values = numpy.concatenate([batch.get_ref_values('chl_ref', self.data) for batch in batches])
+        np.assert_array_almost_equal(all_matchups.get_ref_values('chl_ref', self.data), batch_ref_values)
+
+
+    def test_remove_empty_matchups_from_list(self):
+        data = Data(self.path + 'resources/test_single_model_fill_values.nc')
+        me = MatchupEngine(data)
+        matchups = list(me.find_all_matchups())
+        remaining = me.remove_empty_matchups(matchups)
+        self.assertTrue(isinstance(remaining, list))
+        self.assertEqual([matchups[0], matchups[1]], remaining)
+        self.assertEqual([], me.remove_empty_matchups([]))
+        data.close()
+
+
+    def test_find_all_matchups_interpolated_bilinearly(self):
+        nearest_matchups = MatchupEngine(self.data, Configuration()).find_all_matchups()
+        matchups = MatchupEngine(self.data, Configuration(interpolation='bilinear')).find_all_matchups()
+        np.assert_array_equal(nearest_matchups.record_numbers, matchups.record_numbers)
+        self.assertTrue(matchups.is_interpolated())
+        self.assertIsNone(matchups.get_brackets('time'))
+        lat_lower, lat_upper, lat_weights = matchups.get_brackets('lat')
+        np.assert_array_equal([0, 0, 0], lat_lower)
+        np.assert_array_almost_equal([0.00625, 0.375, 0.575], lat_weights)
+
+        lat_weight = 0.00625
+        lon_weight = 0.02
+        expected = (1 - lat_weight) * ((1 - lon_weight) * 0.1111 + lon_weight * 0.2111) + \
+                   lat_weight * ((1 - lon_weight) * 0.1121 + lon_weight * 0.2121)
+        model_values = matchups.get_model_values('chl', self.data)
+        self.assertAlmostEqual(expected, model_values[0], 6)
+        np.assert_array_almost_equal(nearest_matchups.get_ref_values('chl_ref', self.data), matchups.get_ref_values('chl_ref', self.data))
+
+
+    def test_find_all_matchups_interpolated_in_time_and_depth(self):
+        matchups = MatchupEngine(self.data, Configuration(time_depth_interpolation='linear')).find_all_matchups()
+        self.assertIsNone(matchups.get_brackets('lat'))
+        time_lower, time_upper, time_weights = matchups.get_brackets('time')
+        np.assert_array_equal([0, 0, 0], time_lower)
+        np.assert_array_equal([1, 1, 1], time_upper)
+        np.assert_array_almost_equal([250 / 7200, 300 / 7200, 7000 / 7200], time_weights)
+        depth_lower, depth_upper, depth_weights = matchups.get_brackets('depth')
+        np.assert_array_almost_equal([0.2, 0.3, 1.0], depth_weights)
+
+        model_values = matchups.get_model_values('chl', self.data)
+        self.assertNotIn('chl', self.data.cached_list)
+        chl = self.data.read_model('chl')
+        for index in range(len(matchups)):
+            lat_index = matchups.get_column('lat_index')[index]
+            lon_index = matchups.get_column('lon_index')[index]
+            time_weight = time_weights[index]
+            depth_weight = depth_weights[index]
+            expected = (1 - time_weight) * ((1 - depth_weight) * chl[0, 0, lat_index, lon_index] + depth_weight * chl[0, 1, lat_index, lon_index]) + \
+                       time_weight * ((1 - depth_weight) * chl[1, 0, lat_index, lon_index] + depth_weight * chl[1, 1, lat_index, lon_index])
+            self.assertAlmostEqual(expected, model_values[index], 6)
+
+
+    def test_find_all_matchups_within_max_distance(self):
+        matchups = MatchupEngine(self.data, Configuration()).find_all_matchups()
+        np.assert_array_almost_equal([1.28009, 66.90676, 349.15441], matchups.get_column('distance'), 4)
+
+        matchups = MatchupEngine(self.data, Configuration(max_distance=100)).find_all_matchups()
+        np.assert_array_equal([0, 1], matchups.record_numbers)
+
+
+    def test_find_all_matchups_aggregated_in_time(self):
+        chl = self.data.read_model('chl')
+        for time_aggregation in ('mean', 'median'):
+            matchups = MatchupEngine(self.data, Configuration(time_aggregation=time_aggregation)).find_all_matchups()
+            start_indices, stop_indices = matchups.get_time_windows()
+            np.assert_array_equal([0, 0, 0], start_indices)
+            np.assert_array_equal([2, 2, 2], stop_indices)
+            cell_indices = matchups.get_cell_indices()[1:]
+            expected = (chl[0][cell_indices] + chl[1][cell_indices]) / 2
+            np.assert_array_almost_equal(expected, matchups.get_model_values('chl', self.data))
+
+        matchups = MatchupEngine(self.data, Configuration(time_aggregation='mean', time_delta=300)).find_all_matchups()
+        start_indices, stop_indices = matchups.get_time_windows()
+        np.assert_array_equal([0, 1], start_indices)
+        np.assert_array_equal([1, 2], stop_indices)
+        nearest_matchups = MatchupEngine(self.data, Configuration(time_delta=300)).find_all_matchups()
+        np.assert_array_almost_equal(nearest_matchups.get_model_values('chl', self.data), matchups.get_model_values('chl', self.data))
+
+
+    def test_find_all_matchups_with_windows(self):
+        matchups = MatchupEngine(self.data, Configuration(window_size=3, window_min_valid=0.4)).find_all_matchups()
+        self.assertEqual(3, matchups.window_size)
+        chl = self.data.read_model('chl')
+        statistics = matchups.get_window_statistics('chl', self.data)
+        # the first matchup cell is in the grid corner, so only 4 of its 9 window cells are inside the grid, all valid
+        self.assertEqual(4, statistics['count'][0])
+        self.assertAlmostEqual(1.0, statistics['valid_fraction'][0])
+        self.assertAlmostEqual(chl[0, 0, 0:2, 0:2].mean(), statistics['mean'][0], 6)
+        self.assertAlmostEqual(chl[0, 0, 0:2, 0:2].std(), statistics['stddev'][0], 6)
+        self.assertAlmostEqual(chl[0, 0, 0, 0], statistics['centre'][0], 6)
+
+        model_values = matchups.get_model_values('chl', self.data)
+        self.assertAlmostEqual(chl[0, 0, 0:2, 0:2].mean(), model_values[0], 6)
+        matchups.window_min_valid = 1.0
+        self.assertAlmostEqual(chl[0, 0, 0:2, 0:2].mean(), matchups.get_model_values('chl', self.data)[0], 6)
+
+        self.assertRaises(ValueError, lambda: Configuration(window_size=2))
+        self.assertRaises(ValueError, lambda: MatchupEngine(self.data, Configuration(window_size=3, time_aggregation='mean')).find_all_matchups())
+
+
+    def test_find_all_matchups_in_trajectory_mode(self):
+        expected = MatchupEngine(self.data, Configuration(time_depth_interpolation='linear')).find_all_matchups().get_model_values('chl', self.data)
+        data = Data(self.path + 'resources/test.nc')
+        matchups = MatchupEngine(data, Configuration(time_depth_interpolation='linear', trajectory_mode=True, trajectory_time_slices=2)).find_all_matchups()
+        self.assertEqual(2, matchups.time_slice_window)
+        np.assert_array_almost_equal(expected, matchups.get_model_values('chl', data))
+        self.assertNotIn('chl', data.cached_list)
+        self.assertIsNone(MatchupEngine(data, Configuration()).find_all_matchups().time_slice_window)
+        self.assertRaises(ValueError, lambda: Configuration(trajectory_time_slices=1))
+        data.close()
+
+
+    def test_find_all_matchups_as_super_observations(self):
+        self.assertFalse(MatchupEngine(self.data, Configuration()).find_all_matchups().super_observations)
+        matchups = MatchupEngine(self.data, Configuration(super_observations=True)).find_all_matchups()
+        self.assertTrue(matchups.super_observations)
+        self.assertTrue(matchups.filter(numpy.array([0, 1])).super_observations)
+
+
+    def test_find_all_matchups_with_windows_at_grid_edge_and_next_to_land(self):
+        matchups = MatchupEngine(self.data, Configuration(window_size=3)).find_all_matchups()
+        self.assertEqual(3, len(MatchupEngine(self.data).remove_empty_matchups(matchups)))
+        self.assertFalse(numpy.any(numpy.ma.getmaskarray(matchups.get_model_values('chl', self.data))))
+
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, 'test_with_land.nc')
+        shutil.copy(self.path + 'resources/test.nc', file_name)
+        dataset = Dataset(file_name, 'a')
+        for lat_index, lon_index in ((0, 1), (1, 0), (1, 1)):
+            dataset.variables['chl'][:, :, lat_index, lon_index] = -1
+        dataset.close()
+        data = Data(file_name)
+        chl = data.read_model('chl')
+        matchups = MatchupEngine(data, Configuration(window_size=3)).find_all_matchups()
+        statistics = matchups.get_window_statistics('chl', data)
+        # only the matchup cell itself is valid in the window of the first matchup, so its value is used
+        self.assertAlmostEqual(0.25, statistics['valid_fraction'][0])
+        self.assertAlmostEqual(chl[0, 0, 0, 0], matchups.get_model_values('chl', data)[0], 6)
+        data.close()
+        shutil.rmtree(temp_dir)
+
+
+    def test_find_all_matchups_replacing_invalid_cells(self):
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, 'test_with_land.nc')
+        shutil.copy(self.path + 'resources/test.nc', file_name)
+        dataset = Dataset(file_name, 'a')
+        for variable_name in ('chl', 'sst'):
+            for lat_index, lon_index in ((0, 0), (0, 1), (1, 1)):
+                dataset.variables[variable_name][:, :, lat_index, lon_index] = -1
+        dataset.close()
+        data = Data(file_name)
+
+        matchups = MatchupEngine(data, Configuration(valid_cell_search_radius=100)).find_all_matchups()
+        np.assert_array_equal([0, 2, 3], matchups.get_column('lon_index'))
+        np.assert_array_equal([0, 1, 0], matchups.get_column('lon_offset'))
+        np.assert_array_equal([0, 0, 0], matchups.get_column('lat_offset'))
+        self.assertAlmostEqual(6.3, matchups.get_column('lon')[1], 5)
+        model_values = matchups.get_model_values('chl', data)
+        self.assertTrue(model_values[0] is numpy.ma.masked)
+        self.assertFalse(model_values[1] is numpy.ma.masked)
+
+        matchups = MatchupEngine(data, Configuration(valid_cell_search_radius=200)).find_all_matchups()
+        np.assert_array_equal([1, 0, 0], matchups.get_column('lat_offset'))
+        self.assertIsNone(MatchupEngine(data).find_all_matchups().get_column('lat_offset'))
+        data.close()
+        shutil.rmtree(temp_dir)
+
+
+    def test_find_all_matchups_replacing_invalid_cells_on_curvilinear_grid(self):
+        temp_dir = tempfile.mkdtemp()
+        file_name = os.path.join(temp_dir, 'test_curvilinear.nc')
+        create_curvilinear_file(file_name)
+        data = Data(file_name)
+
+        self.assertTrue(data.get_nearest_valid_cell_map().invalid_cells[0, 0])
+        self.assertEqual(1, numpy.count_nonzero(data.get_nearest_valid_cell_map().invalid_cells))
+        matchups = MatchupEngine(data, Configuration(valid_cell_search_radius=200)).find_all_matchups()
+        np.assert_array_equal([1, 0, 0], matchups.get_column('lat_offset'))
+        np.assert_array_equal([0, 0, 0], matchups.get_column('lon_offset'))
+        np.assert_array_equal([4, 5, 22], matchups.get_model_values('chl', data))
+        data.close()
+        shutil.rmtree(temp_dir)
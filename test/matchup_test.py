@@ -0,0 +1,177 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+# 
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+# 
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import os
+import unittest
+
+import numpy as np
+import numpy.testing as test
+
+from opec.data import Data
+from opec.matchup import Matchup, MatchupSet, create_matchup_set
+from opec.matchup_engine import MatchupEngine
+from opec.reference_records_finder import ReferenceRecord
+from opec.utils import extract_values
+
+
+class MatchupSet_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__)) + '/../'
+        self.data = Data(self.path + 'resources/test.nc')
+        self.matchups = MatchupEngine(self.data).find_all_matchups()
+
+
+    def tearDown(self):
+        self.data.close()
+
+
+    def test_len_and_iteration(self):
+        self.assertEqual(3, len(self.matchups))
+        matchups = list(self.matchups)
+        self.assertEqual(3, len(matchups))
+        self.assertTrue(isinstance(matchups[0], Matchup))
+        self.assertEqual([0, 0, 0, 0], matchups[0].cell_position)
+        self.assertEqual(2, matchups[2].reference_record.record_number)
+        self.assertEqual(2, self.matchups[-1].reference_record.record_number)
+
+
+    def test_slicing_and_filtering(self):
+        sliced = self.matchups[1:]
+        self.assertTrue(isinstance(sliced, MatchupSet))
+        test.assert_array_equal([1, 2], sliced.record_numbers)
+
+        filtered = self.matchups.filter(np.array([True, False, True]))
+        test.assert_array_equal([0, 2], filtered.record_numbers)
+        self.assertAlmostEqual(56.12, filtered[1].reference_record.lat, 5)
+
+
+    def test_get_values(self):
+        test.assert_array_almost_equal([0.1111, 0.2111, 0.2224], self.matchups.get_model_values('chl', self.data))
+        test.assert_array_almost_equal([0.1, 0.2, 0.3], self.matchups.get_ref_values('chl_ref', self.data))
+
+
+    def test_create_matchup_set(self):
+        matchups = [
+            Matchup([0, 0, 0, 0], [1261440000, 0.001, 55.2, 5.3], ReferenceRecord(0, 55.21, 5.31, 1261440250, 0.0012)),
+            Matchup([0, 0, 0, 1], [1261440000, 0.001, 55.2, 5.8], ReferenceRecord(1, 55.8, 5.72, 1261440300, 0.0013))
+        ]
+        matchup_set = create_matchup_set(matchups)
+        self.assertEqual(2, len(matchup_set))
+        test.assert_array_equal([0, 1], matchup_set.get_column('lon_index'))
+        test.assert_array_almost_equal([55.21, 55.8], matchup_set.get_column('ref_lat'))
+        test.assert_array_almost_equal([0.1111, 0.2111], matchup_set.get_model_values('chl', self.data))
+        self.assertIs(matchup_set, create_matchup_set(matchup_set))
+
+
+    def test_get_model_values_in_time_order(self):
+        data = TimeSlicedData(np.arange(10 * 3 * 4, dtype=np.float64).reshape(10, 3, 4))
+        random = np.random.RandomState(0)
+        time_indices = random.randint(0, 10, 50)
+        columns = {'record_number': np.arange(50), 'time_index': time_indices, 'depth_index': None,
+                   'lat_index': random.randint(0, 3, 50), 'lon_index': random.randint(0, 4, 50)}
+        matchups = MatchupSet(dict(columns))
+        swept_matchups = MatchupSet(dict(columns), time_slice_window=3)
+        test.assert_array_equal(matchups.get_model_values('chl', data), swept_matchups.get_model_values('chl', data))
+        self.assertEqual(10, sum(data.read_counts))
+        self.assertTrue(max(data.read_counts) <= 3)
+
+        brackets = (time_indices, np.minimum(time_indices + 1, 9), random.uniform(size=50))
+        matchups.set_brackets('time', brackets)
+        swept_matchups.set_brackets('time', brackets)
+        expected = matchups.get_model_values('chl', data)
+        data.read_counts = []
+        test.assert_array_almost_equal(expected, swept_matchups.get_model_values('chl', data))
+        self.assertTrue(max(data.read_counts) <= 3)
+
+
+    def test_get_model_values_aggregated_in_time(self):
+        data = TimeSlicedData(np.arange(100 * 3 * 4, dtype=np.float64).reshape(100, 3, 4))
+        columns = {'record_number': np.arange(4), 'time_index': np.array([0, 30, 60, 98]), 'depth_index': None,
+                   'lat_index': np.array([0, 1, 2, 1]), 'lon_index': np.array([0, 1, 2, 3])}
+        matchups = MatchupSet(columns)
+        matchups.set_time_windows(np.array([0, 29, 60, 98]), np.array([2, 32, 61, 100]), 'mean')
+        expected = [np.mean(data.values[start:stop, lat, lon]) for start, stop, lat, lon in ((0, 2, 0, 0), (29, 32, 1, 1), (60, 61, 2, 2), (98, 100, 1, 3))]
+        test.assert_array_almost_equal(expected, matchups.get_model_values('chl', data))
+        # exactly the steps of each matchup's own window are gathered
+        self.assertEqual([2 + 3 + 1 + 2], data.gathered_counts)
+
+        matchups.time_aggregation = 'median'
+        test.assert_array_almost_equal(expected, matchups.get_model_values('chl', data))
+
+
+    def test_get_window_statistics_in_time_order(self):
+        matchups = MatchupEngine(self.data).find_all_matchups()
+        matchups.window_size = 3
+        expected = matchups.get_window_statistics('chl', self.data)
+        data = Data(self.path + 'resources/test.nc')
+        matchups.time_slice_window = 2
+        statistics = matchups.get_window_statistics('chl', data)
+        self.assertNotIn('chl', data.cached_list)
+        for name in ('mean', 'stddev', 'count', 'valid_fraction'):
+            test.assert_array_almost_equal(expected[name], statistics[name])
+        data.close()
+
+
+    def test_get_super_observations(self):
+        matchups = self.matchups.filter(np.array([0, 0, 1, 2, 2]))
+        group_indices, first_indices = matchups.get_cell_groups()
+        test.assert_array_equal([0, 0, 1, 2, 2], group_indices)
+        reference_statistics, model_statistics = matchups.get_super_observations('chl_ref', 'chl', self.data)
+        test.assert_array_almost_equal([0.1, 0.2, 0.3], reference_statistics['mean'])
+        test.assert_array_equal([2, 1, 2], reference_statistics['count'])
+        test.assert_array_almost_equal([0.0, 0.0, 0.0], reference_statistics['stddev'])
+        test.assert_array_almost_equal([0.1111, 0.2111, 0.2224], model_statistics['mean'])
+
+        matchups.super_observations = True
+        self.assertTrue(matchups[1:].super_observations)
+        reference_values, model_values = extract_values(matchups, self.data, 'chl_ref', 'chl')
+        test.assert_array_almost_equal([0.1, 0.2, 0.3], reference_values)
+        test.assert_array_almost_equal([0.1111, 0.2111, 0.2224], model_values)
+
+
+class TimeSlicedData(object):
+
+    def __init__(self, values):
+        self.values = values
+        self.read_counts = []
+        self.gathered_counts = []
+
+
+    def read_model(self, variable_name):
+        return np.ma.array(self.values)
+
+
+    def gather(self, variable_name, index_arrays):
+        return np.ma.array(self.values)[tuple(index_arrays)]
+
+
+    def get_gather_view(self, variable_name):
+        return RecordingView(np.ma.array(self.values), self.gathered_counts)
+
+
+    def read_model_time_slices(self, variable_name, time_indices):
+        self.read_counts.append(len(time_indices))
+        return np.ma.array(self.values[time_indices])
+
+
+class RecordingView(object):
+
+    def __init__(self, values, gathered_counts):
+        self.values = values
+        self.gathered_counts = gathered_counts
+
+
+    def __getitem__(self, index_arrays):
+        self.gathered_counts.append(np.broadcast(*index_arrays).size)
+        return self.values[index_arrays]
@@ -0,0 +1,85 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import logging
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from opec import memory
+from opec.memory import MemoryTracker, current_rss, log_memory, peak_rss
+
+
+class Memory_test(unittest.TestCase):
+
+    def test_current_and_peak_rss(self):
+        rss = current_rss()
+        self.assertTrue(rss is None or rss > 0)
+        peak = peak_rss()
+        if peak is not None and rss is not None:
+            self.assertTrue(peak >= rss * 0.5)
+
+
+    def test_current_rss_without_statm(self):
+        with mock.patch.object(memory, 'STATM_FILE', '/does/not/exist'):
+            self.assertEqual(peak_rss(), current_rss())
+
+
+    def test_log_memory_only_measures_at_debug_level(self):
+        logger = logging.getLogger()
+        level = logger.level
+        try:
+            with mock.patch.object(memory, 'current_rss', return_value=2048) as measure:
+                logger.setLevel(logging.INFO)
+                log_memory('Memory in use')
+                self.assertEqual(0, measure.call_count)
+                logger.setLevel(logging.DEBUG)
+                with self.assertLogs(level=logging.DEBUG) as logs:
+                    log_memory('Memory in use')
+                self.assertEqual(1, measure.call_count)
+                self.assertIn('Memory in use: 2.00 MB', logs.output[0])
+                with self.assertLogs(level=logging.DEBUG) as logs:
+                    log_memory('Memory in use after reading %s', 'chl')
+                self.assertIn('Memory in use after reading chl: 2.00 MB', logs.output[0])
+        finally:
+            logger.setLevel(level)
+
+
+    def test_memory_tracker(self):
+        tracker = MemoryTracker()
+        tracker.start('allocation')
+        values = np.ones(5 * 1024 * 1024)
+        tracker.start('release')
+        del values
+        tracker.stop()
+        tracker.stop()
+        self.assertEqual(['allocation', 'release'], [stage['stage'] for stage in tracker.stages])
+        if current_rss() is not None:
+            self.assertTrue(tracker.get_peak('allocation') >= tracker.stages[0]['start_rss'])
+        self.assertIsNone(tracker.get_peak('unknown'))
+
+        with mock.patch.object(memory, 'current_rss', side_effect=[1000, 3000]), \
+             mock.patch.object(memory, 'peak_rss', side_effect=[5000, 5000]):
+            tracker = MemoryTracker()
+            tracker.start('stage')
+            tracker.stop()
+        self.assertEqual(3000, tracker.get_peak('stage'))
+
+        with mock.patch.object(memory, 'current_rss', side_effect=[1000, 3000]), \
+             mock.patch.object(memory, 'peak_rss', side_effect=[5000, 8000]):
+            tracker = MemoryTracker()
+            tracker.start('stage')
+            tracker.stop()
+        self.assertEqual(8000, tracker.get_peak('stage'))
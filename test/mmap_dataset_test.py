@@ -0,0 +1,124 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import numpy.ma as ma
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from netCDF4 import Dataset
+
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.matchup_engine import MatchupEngine
+from opec.mmap_dataset import MmapDataset, is_classic_format
+from opec.netCDF_facade import NetCDFFacade
+
+
+class MmapDataset_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__)) + '/../resources/'
+        self.temp_dir = tempfile.mkdtemp()
+        self.classic_file = os.path.join(self.temp_dir, 'test_classic.nc')
+        source = Dataset(self.path + 'test.nc')
+        target = Dataset(self.classic_file, 'w', format='NETCDF3_CLASSIC')
+        target.setncattr('title', 'classic copy')
+        for name, dimension in source.dimensions.items():
+            target.createDimension(name, None if name == 'record_num' else len(dimension))
+        for name, variable in source.variables.items():
+            attributes = {attribute: variable.getncattr(attribute) for attribute in variable.ncattrs()}
+            fill_value = attributes.pop('_FillValue', None)
+            target_variable = target.createVariable(name, variable.dtype, variable.dimensions, fill_value=fill_value)
+            target_variable.setncatts(attributes)
+            target_variable[:] = variable[:]
+        packed = target.createVariable('packed', 'i2', ('lat', 'lon'), fill_value=-1)
+        packed.scale_factor = 0.5
+        packed.add_offset = 10.0
+        packed.set_auto_maskandscale(False)
+        packed[:] = np.array([[0, 1, 2, 3], [4, -1, 6, 7]], dtype=np.int16)
+        source.close()
+        target.close()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_is_classic_format(self):
+        self.assertTrue(is_classic_format(self.classic_file))
+        self.assertFalse(is_classic_format(self.path + 'test.nc'))
+
+
+    def test_read_variables(self):
+        dataset = MmapDataset(self.classic_file)
+        expected = Dataset(self.classic_file)
+        self.assertEqual('classic copy', dataset.title)
+        self.assertEqual(3, len(dataset.dimensions['record_num']))
+        for name in expected.variables:
+            variable = dataset.variables[name]
+            self.assertEqual(expected.variables[name].shape, variable.shape)
+            self.assertEqual(sorted(expected.variables[name].ncattrs()), sorted(variable.ncattrs()))
+            values = variable[:]
+            expected_values = expected.variables[name][:]
+            assert_array_equal(ma.getmaskarray(expected_values), ma.getmaskarray(values))
+            assert_array_almost_equal(expected_values.compressed(), values.compressed())
+        assert_array_almost_equal([[10.0, 10.5, 11.0, 11.5], [12.0, 0.0, 13.0, 13.5]], dataset.variables['packed'][:].filled(0.0))
+        assert_array_almost_equal([11.5, 13.5], dataset.variables['packed'][:, 3])
+        self.assertEqual('milligram m-3', dataset.variables['chl'].units)
+        self.assertFalse(hasattr(dataset.variables['chl'], 'scale_factor'))
+        expected.close()
+        dataset.close()
+
+
+    def test_mask_is_only_allocated_for_invalid_values(self):
+        dataset = MmapDataset(self.classic_file)
+        self.assertIs(ma.nomask, dataset.variables['lat'][:].mask)
+        self.assertIs(ma.nomask, dataset.variables['packed'][0].mask)
+        with mock.patch('opec.mmap_dataset.MASK_BLOCK_SIZE', 3):
+            packed = dataset.variables['packed'][:]
+        assert_array_equal([[False, False, False, False], [False, True, False, False]], packed.mask)
+        self.assertAlmostEqual(11.5, dataset.variables['packed'][0, 3])
+        dataset.close()
+
+
+    def test_facade(self):
+        facade = NetCDFFacade(self.classic_file, use_mmap=True)
+        self.assertTrue(isinstance(facade.data_set, MmapDataset))
+        self.assertEqual(['chl', 'sst', 'packed'], facade.get_model_variables())
+        self.assertEqual(['chl_ref'], facade.get_reference_variables())
+        self.assertEqual('time depth lat lon', facade.get_dimension_string('chl'))
+        self.assertEqual(-1.0, facade.get_variable_attribute('chl', '_FillValue'))
+        assert_array_almost_equal([[[[0.1223]]]], facade.get_data('chl', [1, 0, 1, 2], [1, 1, 1, 1]))
+        facade.close()
+        facade = NetCDFFacade(self.path + 'test.nc', use_mmap=True)
+        self.assertFalse(isinstance(facade.data_set, MmapDataset))
+        facade.close()
+
+
+    def test_find_all_matchups_from_memory_mapped_file(self):
+        expected_data = Data(self.path + 'test.nc')
+        data = Data(self.classic_file, use_mmap=True)
+        expected = MatchupEngine(expected_data, Configuration()).find_all_matchups()
+        matchups = MatchupEngine(data, Configuration()).find_all_matchups()
+        assert_array_equal(expected.get_cell_indices(), matchups.get_cell_indices())
+        assert_array_almost_equal(expected.get_model_values('chl', expected_data), matchups.get_model_values('chl', data))
+        assert_array_almost_equal(expected.get_ref_values('chl_ref', expected_data), matchups.get_ref_values('chl_ref', data))
+        assert_array_almost_equal(expected_data.read_model('sst'), data.read_model('sst'))
+        expected_data.close()
+        data.close()
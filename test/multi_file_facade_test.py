@@ -0,0 +1,118 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from numpy.testing import assert_array_equal, assert_array_almost_equal
+from netCDF4 import Dataset
+
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.matchup_engine import MatchupEngine
+from opec.multi_file_facade import MultiFileFacade, FileHandlePool, expand_file_names
+from opec.netCDF_facade import NetCDFFacade
+
+
+class MultiFileFacade_test(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.dirname(os.path.realpath(__file__)) + '/../resources/'
+        self.ref_file = self.path + 'test_only_reference.nc'
+        self.temp_dir = tempfile.mkdtemp()
+        self.file_names = []
+        for index, (start, stop) in enumerate(((0, 2), (2, 2), (2, 3))):
+            self.file_names.append(self.__write_records(self.ref_file, start, stop, 'ref_%s.nc' % index))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def __write_records(self, source_file_name, start, stop, target_name):
+        file_name = os.path.join(self.temp_dir, target_name)
+        source = Dataset(source_file_name)
+        target = Dataset(file_name, 'w', format='NETCDF4_CLASSIC')
+        target.createDimension('record_num', stop - start)
+        for name, variable in source.variables.items():
+            attributes = {attribute: variable.getncattr(attribute) for attribute in variable.ncattrs()}
+            fill_value = attributes.pop('_FillValue', None)
+            target_variable = target.createVariable(name, variable.dtype, variable.dimensions, fill_value=fill_value)
+            target_variable.setncatts(attributes)
+            target_variable[:] = variable[start:stop]
+        source.close()
+        target.close()
+        return file_name
+
+
+    def test_expand_file_names(self):
+        self.assertEqual(self.file_names, expand_file_names(os.path.join(self.temp_dir, 'ref_*.nc')))
+        self.assertEqual(['a.nc', self.file_names[1]], expand_file_names(['a.nc', os.path.join(self.temp_dir, 'ref_1.*')]))
+        self.assertEqual(['a.nc'], expand_file_names('a.nc'))
+        self.assertRaises(ValueError, lambda: expand_file_names(os.path.join(self.temp_dir, 'missing_*.nc')))
+
+
+    def test_concatenated_records(self):
+        facade = MultiFileFacade(self.file_names, max_open_files=1)
+        single_file = NetCDFFacade(self.ref_file)
+        self.assertEqual(3, facade.get_dim_size('record_num'))
+        # counting the records leaves the pool of file handles untouched
+        self.assertEqual(0, facade.open_file_count())
+        self.assertEqual(['chl_ref'], facade.get_reference_variables())
+        self.assertEqual('milligram m-3', facade.get_variable_attribute('chl_ref', 'units'))
+        for name in ('time_ref', 'lat_ref', 'lon_ref', 'depth_ref', 'chl_ref'):
+            variable = facade.get_variable(name)
+            self.assertEqual((3,), variable.shape)
+            assert_array_equal(single_file.get_variable(name)[:], variable[:])
+        assert_array_equal(single_file.get_variable('lat_ref')[1:3], facade.get_variable('lat_ref')[1:3])
+        assert_array_equal(single_file.get_variable('lat_ref')[[2, 0]], facade.get_variable('lat_ref')[np.array([2, 0])])
+        self.assertAlmostEqual(56.12, facade.get_variable('lat_ref')[2], 5)
+        assert_array_equal(single_file.get_variable('lat_ref')[[2, 0, 1, 2]], facade.read_records('lat_ref', np.array([2, 0, 1, 2])))
+        self.assertEqual(0, len(facade.read_records('lat_ref', np.array([], dtype=np.int64))))
+        single_file.close()
+        facade.close()
+
+
+    def test_file_handle_pool(self):
+        pool = FileHandlePool(self.file_names, max_open_files=2)
+        first = pool.get(0)
+        pool.get(1)
+        self.assertIs(first, pool.get(0))
+        pool.get(2)
+        self.assertEqual(2, pool.open_file_count())
+        self.assertIs(first, pool.get(0))
+        self.assertIsNot(first, pool.get(1))
+        pool.close()
+        self.assertEqual(0, pool.open_file_count())
+        self.assertRaises(ValueError, lambda: FileHandlePool(self.file_names, max_open_files=0))
+
+
+    def test_find_all_matchups_from_multiple_files(self):
+        model_file = self.path + 'test_without_records.nc'
+        single_data = Data(model_file, self.ref_file)
+        multi_data = Data(model_file, os.path.join(self.temp_dir, 'ref_*.nc'), max_open_files=1)
+        self.assertEqual([model_file] + self.file_names, multi_data.get_file_names())
+        self.assertEqual(3, multi_data.reference_records_count({'record_num'}))
+
+        expected = MatchupEngine(single_data, Configuration()).find_all_matchups()
+        matchups = MatchupEngine(multi_data, Configuration()).find_all_matchups()
+        self.assertEqual(len(expected), len(matchups))
+        assert_array_equal(expected.get_column('record_number'), matchups.get_column('record_number'))
+        assert_array_almost_equal(expected.get_ref_values('chl_ref', single_data), matchups.get_ref_values('chl_ref', multi_data))
+        assert_array_almost_equal(expected.get_model_values('chl', single_data), matchups.get_model_values('chl', multi_data))
+        single_data.close()
+        multi_data.close()
@@ -12,9 +12,15 @@
 # You should have received a copy of the GNU General Public License along
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
 
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 import unittest
 from opec import processor
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.matchup_engine import MatchupEngine
 from opec.output import Output
 import numpy as np
 
@@ -36,3 +42,19 @@ class Output_test(TestCase):
 
         output = Output()
         output.csv(mappings, statistics, 10957, matchups=None, target_file='c:\\temp\\output\\benchmark\\test.csv')
+
+
+    def test_matchup_file_has_distance_column_only_if_cells_are_found_by_distance(self):
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test.nc')
+        temp_dir = tempfile.mkdtemp()
+        target_file = os.path.join(temp_dir, 'statistics.csv')
+        matchups = MatchupEngine(data).find_all_matchups()
+        statistics = {('chl', 'chl_ref'): processor.calculate_statistics(np.array([1.0, 2.0]), np.array([1.5, 2.5]), 'chl', 'chl_ref')}
+        for config, expected in ((Configuration(), False), (Configuration(max_distance=100), True)):
+            Output(config).csv(data, [('chl', 'chl_ref')], statistics, len(matchups), matchups, target_file=target_file)
+            with open(os.path.join(temp_dir, 'statistics_matchups.csv')) as file:
+                header = file.readline().strip().split(config.separator)
+            self.assertEqual(expected, 'distance' in header)
+            self.assertEqual('model_lon', header[8])
+        data.close()
+        shutil.rmtree(temp_dir)
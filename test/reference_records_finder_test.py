@@ -14,8 +14,11 @@
 import os
 
 from unittest import TestCase
+import numpy as np
+import numpy.testing as test
+from opec.configuration import Configuration
 from opec.data import Data
-from opec.reference_records_finder import ReferenceRecordsFinder
+from opec.reference_records_finder import ReferenceRecordsFinder, ReferenceRecordTable, ReferenceRecord
 
 class ReferenceRecordsFinder_test(TestCase):
 
@@ -49,4 +52,46 @@ class ReferenceRecordsFinder_test(TestCase):
         self.data = Data(self.path + 'resources/test_without_depth.nc')
         rrf = ReferenceRecordsFinder(self.data)
         reference_records = rrf.find_reference_records()
-        self.assertEqual(3, len(reference_records))
\ No newline at end of file
+        self.assertEqual(3, len(reference_records))
+
+
+    def test_reference_record_table(self):
+        reference_records = ReferenceRecordsFinder(self.data).find_reference_records()
+        self.assertTrue(isinstance(reference_records, ReferenceRecordTable))
+        self.assertTrue(np.shares_memory(reference_records.lats, self.data.read_reference('lat_ref')))
+        test.assert_array_equal([0, 1, 2], reference_records.record_numbers)
+        self.assertTrue(isinstance(reference_records[-1], ReferenceRecord))
+        self.assertEqual(2, reference_records[-1].record_number)
+        self.assertEqual([0, 1, 2], [record.record_number for record in reference_records])
+
+        filtered = reference_records.filter(np.array([False, True, True]))
+        self.assertEqual(2, len(filtered))
+        test.assert_array_equal([1, 2], filtered.record_numbers)
+        self.assertAlmostEqual(56.12, filtered[1].lat, 4)
+        self.assertAlmostEqual(0.0021, filtered[1].depth, 4)
+        self.assertRaises(IndexError, lambda: filtered[2])
+
+
+    def test_iter_reference_records(self):
+        batches = list(ReferenceRecordsFinder(self.data).iter_reference_records(2))
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+        test.assert_array_equal([2], batches[1].record_numbers)
+        self.assertAlmostEqual(12.35, batches[1][0].lon, 4)
+        self.assertAlmostEqual(1261447000, batches[1][0].time, 4)
+
+
+    def test_prefilter_reference_records(self):
+        reference_records = ReferenceRecordsFinder(self.data, Configuration(prefilter_records=True)).find_reference_records()
+        test.assert_array_equal([0, 1], reference_records.record_numbers)
+        reference_records = ReferenceRecordsFinder(self.data, Configuration(prefilter_records=True, prefilter_tolerance=6)).find_reference_records()
+        test.assert_array_equal([0, 1, 2], reference_records.record_numbers)
+        self.assertEqual(3, len(ReferenceRecordsFinder(self.data, Configuration()).find_reference_records()))
+
+
+    def test_filter_by_model_extent(self):
+        reference_records = ReferenceRecordTable(np.ma.array([55.0, 54.3, 57.7, 56.0, 56.0, 56.0], mask=[False, False, False, True, False, False]),
+                                                 np.array([5.1, 6.0, 6.0, 6.0, 6.0, 6.0]),
+                                                 np.array([1261440000, 1261440000, 1261440000, 1261440000, 1261447500, 1261439800]))
+        rrf = ReferenceRecordsFinder(self.data)
+        test.assert_array_equal([0, 3, 5], rrf.filter_by_model_extent(reference_records, time_delta=200).record_numbers)
+        test.assert_array_equal([0, 1, 2, 3, 4, 5], rrf.filter_by_model_extent(reference_records, 0.2, 400).record_numbers)
@@ -0,0 +1,89 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import os
+import unittest
+
+import numpy as np
+import numpy.ma as ma
+import numpy.testing as test
+
+from opec.configuration import Configuration
+from opec.data import Data
+from opec.grid_geometry import GridGeometry
+from opec.matchup_engine import MatchupEngine
+from opec.spatial_index import SpatialIndex, great_circle_distance, haversine_distance, to_cartesian
+
+
+def create_curvilinear_grid():
+    rows, columns = np.mgrid[0:20, 0:30]
+    lats = 50.0 + 0.1 * rows + 0.05 * columns
+    lons = 5.0 + 0.1 * columns - 0.03 * rows
+    return lats, lons
+
+
+class SpatialIndex_test(unittest.TestCase):
+
+    def test_query_curvilinear_grid(self):
+        lats, lons = create_curvilinear_grid()
+        index = SpatialIndex(lats, lons)
+        ref_lats = np.array([50.52, 51.33, 52.01, 49.0])
+        ref_lons = np.array([5.61, 6.02, 7.15, 5.0])
+        (rows, columns), distances, valid = index.query(ref_lats, ref_lons)
+        self.assertTrue(np.all(valid))
+        for i in range(len(ref_lats)):
+            chords = np.linalg.norm(to_cartesian(lats.ravel(), lons.ravel()) - to_cartesian([ref_lats[i]], [ref_lons[i]]), axis=1)
+            expected = np.unravel_index(np.argmin(chords), lats.shape)
+            self.assertEqual(expected, (rows[i], columns[i]))
+            self.assertAlmostEqual(great_circle_distance(np.min(chords)), distances[i], 6)
+
+
+    def test_query_max_distance(self):
+        lats, lons = create_curvilinear_grid()
+        index = SpatialIndex(lats, lons)
+        (rows, columns), distances, valid = index.query(ma.array([50.52, 49.0, 0.0], mask=[False, False, True]), np.array([5.61, 5.0, 5.0]), 10)
+        test.assert_array_equal([True, False, False], valid)
+        self.assertLess(distances[0], 10)
+
+
+    def test_masked_cells_are_ignored(self):
+        lats = ma.array([[50.0, 50.0], [51.0, 51.0]], mask=[[True, False], [False, False]])
+        lons = ma.array([[5.0, 6.0], [5.0, 6.0]])
+        (rows, columns), distances, valid = SpatialIndex(lats, lons).query(np.array([50.0]), np.array([5.1]))
+        self.assertEqual((0, 1), (rows[0], columns[0]))
+
+
+    def test_grid_geometry_of_curvilinear_grid(self):
+        lats, lons = create_curvilinear_grid()
+        grid_geometry = GridGeometry('lat', lats, 'lon', lons)
+        self.assertTrue(grid_geometry.is_curvilinear)
+        lat_indices, lon_indices, valid = grid_geometry.find_positions(np.array([lats[3, 7]]), np.array([lons[3, 7]]))
+        self.assertEqual((3, 7), (lat_indices[0], lon_indices[0]))
+        found_lats, found_lons = grid_geometry.get_coordinates(lat_indices, lon_indices)
+        self.assertAlmostEqual(lats[3, 7], found_lats[0])
+
+
+    def test_matchup_engine_with_spatial_index(self):
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test.nc')
+        me = MatchupEngine(data, Configuration(spatial_index=True))
+        self.assertEqual((1, 0, 5.8, 55.2), tuple(np.round(me.find_matchup_position(55.3, 5.75), 4)))
+        me = MatchupEngine(data, Configuration(spatial_index=True, max_distance=20))
+        self.assertIsNone(me.find_matchup_position(55.3, 12.35))
+        data.close()
+
+
+    def test_haversine_distance(self):
+        distances = haversine_distance(np.array([0.0, 55.21, 90.0]), np.array([0.0, 5.31, 0.0]), np.array([0.0, 55.2, -90.0]), np.array([1.0, 5.3, 0.0]))
+        test.assert_array_almost_equal([111.19493, 1.28026, 20015.08680], distances, 4)
+        chords = np.linalg.norm(to_cartesian([55.8], [5.72]) - to_cartesian([55.2], [5.8]), axis=1)
+        self.assertAlmostEqual(great_circle_distance(chords)[0], haversine_distance(55.8, 5.72, 55.2, 5.8), 6)
@@ -0,0 +1,37 @@
+# Copyright (C) 2013 Brockmann Consult GmbH (info@brockmann-consult.de)
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation; either version 3 of the License, or (at your option)
+# any later version.
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, see http://www.gnu.org/licenses/gpl.html
+
+import unittest
+
+from opec.tiling import default_tile_shape, find_tiles, tile_slices
+
+
+class Tiling_test(unittest.TestCase):
+
+    def test_default_tile_shape(self):
+        self.assertEqual((1, 3, 200, 400), default_tile_shape((500, 4, 200, 400), 4, 1024 * 1024))
+        self.assertEqual((1, 2, 200, 400), default_tile_shape((500, 4, 200, 400), 4, 2 * 200 * 400 * 4))
+        self.assertEqual((1, 1, 2, 400), default_tile_shape((500, 4, 200, 400), 4, 1000 * 4))
+        self.assertEqual((1, 1, 1, 100), default_tile_shape((500, 4, 200, 400), 4, 100 * 4))
+        self.assertEqual((2, 3), default_tile_shape((2, 3), 8))
+
+
+    def test_tile_slices(self):
+        self.assertEqual((slice(2, 3), slice(4, 6)), tile_slices((2, 1), (1, 4), (5, 6)))
+
+
+    def test_find_tiles(self):
+        self.assertEqual([(1, 0), (1, 1), (2, 0), (2, 1)], find_tiles((slice(1, 3), slice(3, 5)), (1, 4), (5, 6)))
+        self.assertEqual([(0, 1)], find_tiles((slice(0, 1), slice(4, None)), (1, 4), (5, 6)))
+        self.assertEqual([], find_tiles((slice(2, 2), slice(0, 6)), (1, 4), (5, 6)))
@@ -11,13 +11,17 @@
 # 
 # You should have received a copy of the GNU General Public License along
 # with this program; if not, see http://www.gnu.org/licenses/gpl.html
+import os
 import unittest
 
 import numpy as np
 import numpy.ma as ma
 import numpy.testing as test
 from opec import utils
+from opec.configuration import Configuration
+from opec.data import Data
 from opec.matchup import Matchup
+from opec.matchup_engine import MatchupEngine
 from opec.reference_records_finder import ReferenceRecord
 from opec.utils import harmonise
 
@@ -51,6 +55,24 @@ class Utils_test(unittest.TestCase):
         test.assert_almost_equal(ref, np.ma.array([np.nan, 0.2], mask=[True, False]))
         test.assert_almost_equal(model, np.ma.array([0.1111, 0.2111], mask=[False, False]))
 
+    def test_extract_values_from_batches(self):
+        data = Data(os.path.dirname(os.path.realpath(__file__)) + '/../resources/test.nc')
+        me = MatchupEngine(data, Configuration(time_delta=4000))
+        variable_pairs = [('chl_ref', 'chl'), ('chl_ref', 'sst')]
+        values = utils.extract_values_from_batches(me.iter_matchups(batch_size=1), data, variable_pairs)
+        self.assertEqual(2, len(values))
+        for (ref_name, model_name), (ref, model) in zip(variable_pairs, values):
+            expected_ref, expected_model = utils.extract_values(me.find_all_matchups(), data, ref_name, model_name)
+            test.assert_array_almost_equal(expected_ref, ref)
+            test.assert_array_almost_equal(expected_model, model)
+
+        values = utils.extract_values_from_batches(me.iter_matchups(batch_size=1), data, variable_pairs, compress=True)
+        expected_ref, expected_model = utils.harmonise(*utils.extract_values(me.find_all_matchups(), data, 'chl_ref', 'chl'))
+        test.assert_array_almost_equal(expected_ref.compressed(), values[0][0])
+        test.assert_array_almost_equal(expected_model.compressed(), values[0][1])
+        data.close()
+
+
     def test_harmonise_1(self):
         model_values = ma.array(np.arange(1.0, 5.0, 1), mask=np.array([False, False, True, False])) # [1, --, 3, 4]
         ref_values = np.array([1.1, 2.2, 2.9, 3.7])